@@ -1,14 +1,32 @@
 # Simulator output function for least squares optimisation
 import csv
+import multiprocessing
 import numpy as np
-from numba.decorators import jit, autojit
 from math import floor, ceil
 run_count = 0
 
 from scipy.optimize import leastsq, curve_fit, least_squares
+from veloce import thermal_model
+from veloce import lti
 #from numba import jit
 voltage = 23.68 #voltage to heaters
 heater_resistance  = 10 #individual heater resistance ohms
+#Number of processes for FitPool. None for the number of CPUs.
+FIT_PROCESSES = None
+#The log that run_optimisation fits by default.
+FIT_LOGFILE = "C:\\Users\\mattr\\OneDrive\\Documents\\Stromolo Job\\test_otherheaters.log"
+#Relative step for forward-difference Jacobians, as for least_squares.
+DIFFERENCE_STEP = np.sqrt(np.finfo(float).eps)
+#Multistart: number of starts, number kept after the coarse fits, timestep of
+#the coarse fits in s, and function evaluations per coarse fit.
+MULTISTART_STARTS = 64
+MULTISTART_KEEP = 8
+MULTISTART_COARSE_DT = 10.
+MULTISTART_COARSE_NFEV = 20
+#Starts are sampled within these factors of the default conductances and 
+#capacitances. The capacitances follow from the masses, so are better known.
+MULTISTART_CONDUCTANCE_RANGE = 10.
+MULTISTART_CAPACITANCE_RANGE = 2.
 ##input data conditioning
 def read_data(logfile, dt):
     #read in log file
@@ -222,141 +240,7 @@ def simulate(constants, temps, heaters, ambient, dt, return_temps=False):
     temps or residuals
     """
 
-    individual_ghp = constants[0]
-    gpb_total = constants[1]
-    gpb7 = constants[2]
-    gpa_total = constants[3]
-    gps = constants[4]
-    gsb = constants[5]
-    individual_gih = constants[6]
-    linear_cond = constants[7]
-    table_cond = constants[8]
-    individual_ch = constants[9]
-    lid_total = constants[10]
-    cp7 = constants[11]
-    cb = constants[12]
-    cp4 = constants[13]
-    linear_cond_bottom = constants[14]
-    #DEFINE SIMULATION LOOP MATRIX CONSTANTS
-    #a lot of sides can be determined relative to each other by surface area ratios
-    # long sides(1.94 x 0.66), short sides (1.54 x 0.66), top/bottom (1.54 x 1.94)
-    total_sa = 2*(1.94*0.66 + 1.54*0.66 + 1.94*1.54)
-    #----individual fractions of total system qauntity that each side type should have based on surface area ratio
-    #----side number designations----see doco - curently M.R. thesis
-    #SIDE       NUMBER      COUPLING
-    #LONG A     1           2,4,5,6,7
-    #TOP        2           1,3,5,6
-    #LONG B     3           2,4,5,6,7
-    #BOTTOM     4           1,3,5,6,7
-    #SHORT A    5           1,2,3,4,7
-    #SHORT B    6           1,2,3,4,7
-    #OPTICAL    7           1,3,4,5,6       
-    long_frac = 1.94*0.66/total_sa #sides 1,3
-    short_frac = 1.54*0.66/total_sa #sides 5,6
-    topbottom_frac = 1.94*1.54/total_sa #sides 2,4
-
-    #Gah - conductance between heater and the ambient - model as 0 for simplictiy, add if needed later
-    gah1 = gah2 = gah3 = gah4 = gah5 = gah6 = 0 
-
-    #ghp - conductance between heaters and plates, defined by the conductance for an individual heater and # of heaters on each of the sides W/K
-    #individual_ghp = 192.6
-    ghp1 = ghp3 = ghp5 = ghp6 = 6*individual_ghp
-    ghp2 = ghp4 = 18*individual_ghp
-
-    #Gpb - conductance between plate and internal air temperature t_b
-    #defined by estimated total system values W/K
-    #gpb_total = 264.0594
-    gpb1 = gpb3 = long_frac*gpb_total
-    gpb5 = gpb6 = short_frac*gpb_total
-    gpb2 = gpb4 = topbottom_frac*gpb_total
-
-    #gpb7 = 74.2374
-    #gpa - conduction between plates and ambient W/K
-    #gpa_total = 7.6962
-    gpa1 = gpa3 = long_frac*gpa_total
-    gpa5 = gpa6 = short_frac*gpa_total
-    gpa2 = gpa4 = topbottom_frac*gpa_total
-    #Gps - conduction between plate and sensor W/K
-    #gps = 0.4599
-    gps2 = gps4 = gps7 = gps
-    #Gsb - conduction between sensor and enclosure air temperature W/K
-    #gsb = 0.003
-    gsb2 = gsb4 = gsb7 = gsb
-    #Gih - conduction betweeen internal heater temperature and exterior of heater casing W/K
-    #individual_gih = 85.719
-    gih1 = gih3 = gih5 = gih6 = 6*individual_gih
-    gih2 = gih4 = 18*individual_gih
-    #gnm - conduction between sides and optical table, proportional to the length of intersection between the sides for the sides while optical table is different
-    #this assumes thickness of joins are the same for all sides
-    #linear_cond = 1,366.6667 #W/K/mm
-    #--three different types
-    #but bottom is different since it is bolted on
-    #BOTTOM
-    g14 = g34 = 1940*linear_cond_bottom*10**(-3)
-    g45 = g46 = 1540*linear_cond_bottom*10**(-3)
-    #1940mm
-    g23 = g12 = 1940*linear_cond*10**(-3)
-    #1540mm
-    g25 = g26 = 1540*linear_cond*10**(-3)
-    #660mm
-    g15 = g35 = g36 = g16 = 660*linear_cond*10**(-3)
-    #optical table will couple differently
-    #table_cond =1.125
-    g17 = g27 = g37 = g47 = g57 = g67 = table_cond
-
-    #ch - heater thermal capacitances J/K
-    #individual_ch = 29.8552579523659
-    ch1 = ch3 = ch5 = ch6 = individual_ch*6 #heater thermal capacitance of the short and long sides
-    ch2 = ch4 = individual_ch*18 #heater thermal capacitance of top and bottom, 3x greater due to 3x more heaters
-    
-    #cp - plate thermal capacitances J/K
-    #cp_total = 40000
-    #in testing bottom plate was found to exhibit different behaviour to the top plate, so define different area ratios
-    lid_sa = 1.94*1.54 + 2*(1.94*0.66 + 1.54*0.66) # surface area of lid of enclosure
-    cp2 = (1.94*1.54/lid_sa)*lid_total
-    cp1 = cp3 = (1.94*0.66/lid_sa)*lid_total
-    cp5 = cp6 = (1.54*0.66/lid_sa)*lid_total
-    #cp7 = 100000 #optical table approx 200kg of Al
-    #cb - Internal air thermal capacitance J/K
-    #cb = 2387.88 #J/K
-    #dt_damp ambient noise dampening constant
-    #dt_damp = 1000
-    
-    A_sim= np.array([ [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,], 
-            [0, (-gpb1 - gpb2 - gpb3 - gpb4 - gpb5 - gpb6 - gpb7 - gsb2 + gsb2**2/(gps2 + gsb2) - gsb4 + gsb4**2/(gps4 + gsb4) - gsb7 + gsb7**2/(gps7 + gsb7))/cb, gpb1/cb, (gpb2 + (gps2*gsb2)/(gps2 + gsb2))/cb, gpb3/cb, (gpb4 + (gps4*gsb4)/(gps4 + gsb4))/cb, gpb5/cb, gpb6/cb, (gpb7 + (gps7*gsb7)/(gps7 + gsb7))/cb,0,0,0,0,0,0],
-            [(((gah1*ghp1)/(gah1 + ghp1 + gih1) + gpa1))/cp1, (gpb1)/cp1, (-g12 - g14 - g15 - g16 - g17 - ghp1 + ghp1**2/(gah1 + ghp1 + gih1) - gpa1 - gpb1)/cp1, g12/cp1, 0, g14/cp1, g15/cp1, g16/cp1, g17/cp1, (ghp1*gih1)/(cp1*(gah1 + ghp1 + gih1)), 0, 0, 0, 0, 0],
-            [((gah2*ghp2)/(gah2 + ghp2 + gih2) + gpa2)/cp2, (gpb2 + (gps2*gsb2)/(gps2 + gsb2))/cp2, g12/cp2, (-g12 - g23 - g25 - g26 - ghp2 + ghp2**2/(gah2 + ghp2 + gih2) - gpa2 - gpb2 - gps2 + gps2**2/(gps2 + gsb2))/cp2, g23/cp2, 0, g25/cp2, g26/cp2, 0, 0, (ghp2*gih2)/(cp2*(gah2 + ghp2 + gih2)), 0, 0, 0, 0],
-            [((gah3*ghp3)/(gah3 + ghp3 + gih3) + gpa3)/cp3, gpb3/cp3, 0, g23/cp3, (-g23 - g34 - g35 - g36 - g37 - ghp3 + ghp3**2/(gah3 + ghp3 + gih3) - gpa3 - gpb3)/cp3, g34/cp3, g35/cp3, g36/cp3, g37/cp3, 0, 0, (ghp3*gih3)/(cp3*(gah3 + ghp3 + gih3)), 0, 0, 0],
-            [((gah4*ghp4)/(gah4 + ghp4 + gih4) + gpa4)/cp4, (gpb4 + (gps4*gsb4)/(gps4 + gsb4))/cp4, g14/cp4, 0, g34/cp4, (-g14 - g34 - g45 - g46 - g47 - ghp4 + ghp4**2/(gah4 + ghp4 + gih4) - gpa4 - gpb4 - gps4 + gps4**2/(gps4 + gsb4))/cp4, g45/cp4, g46/cp4, g47/cp4, 0, 0, 0, (ghp4*gih4)/(cp4*(gah4 + ghp4 + gih4)),0,0], 
-            [((gah5*ghp5)/(gah5 + ghp5 + gih5) + gpa5)/cp5, gpb5/cp5, g15/cp5, g25/cp5, g35/cp5, g45/cp5, (-g15 - g25 - g35 - g45 - g57 - ghp5 + ghp5**2/(gah5 + ghp5 + gih5) - gpa5 - gpb5)/cp5, 0, g57/cp5, 0, 0, 0, 0, (ghp5*gih5)/(cp5*(gah5 + ghp5 + gih5)), 0],
-            [((gah6*ghp6)/(gah6 + ghp6 + gih6) + gpa6)/cp6, gpb6/cp6, g16/cp6, g26/cp6, g36/cp6, g46/cp6, 0, (-g16 - g26 - g36 - g46 - g67 - ghp6 + ghp6**2/(gah6 + ghp6 + gih6) - gpa6 - gpb6)/cp6, g67/cp6, 0, 0, 0, 0, 0, (ghp6*gih6)/(cp6*(gah6 + ghp6 + gih6))],
-            [0, (gpb7 + (gps7*gsb7)/(gps7 + gsb7))/cp7, g17/cp7, 0, g37/cp7, g47/cp7, g57/cp7, g67/cp7, (-g17 - g37 - g47 - g57 - g67 - gpb7 - gps7 + gps7**2/(gps7 + gsb7))/cp7, 0, 0, 0, 0, 0, 0],
-            [(gah1*gih1)/(ch1*(gah1 + ghp1 + gih1)), 0, (ghp1*gih1)/(ch1*(gah1 + ghp1 + gih1)), 0, 0, 0, 0, 0, 0, (-gih1 + gih1**2/(gah1 + ghp1 + gih1))/ch1, 0, 0, 0, 0, 0],
-            [(gah2*gih2)/(ch2*(gah2 + ghp2 + gih2)),0, 0, (ghp2*gih2)/(ch2*(gah2 + ghp2 + gih2)), 0, 0, 0, 0, 0, 0, (-gih2 + gih2**2/(gah2 + ghp2 + gih2))/ch2, 0, 0, 0, 0],
-            [(gah3*gih3)/(ch3*(gah3 + ghp3 + gih3)), 0, 0, 0, (ghp3*gih3)/(ch3*(gah3 + ghp3 + gih3)), 0, 0, 0, 0, 0, 0, (-gih3 + gih3**2/(gah3 + ghp3 + gih3))/ch3, 0, 0, 0],
-            [(gah4*gih4)/(ch4*(gah4 + ghp4 + gih4)), 0, 0, 0, 0, (ghp4*gih4)/(ch4*(gah4 + ghp4 + gih4)), 0, 0, 0, 0, 0, 0, (-gih4 + gih4**2/(gah4 + ghp4 + gih4))/ch4, 0, 0],
-            [(gah5*gih5)/(ch5*(gah5 + ghp5 + gih5)), 0, 0, 0, 0, 0, (ghp5*gih5)/(ch5*(gah5 + ghp5 + gih5)), 0, 0, 0, 0, 0, 0, (-gih5 + gih5**2/(gah5 + ghp5 + gih5))/ch5, 0],
-            [(gah6*gih6)/(ch6*(gah6 + ghp6 + gih6)), 0, 0, 0, 0, 0, 0, (ghp6*gih6)/(ch6*(gah6 + ghp6 + gih6)), 0, 0, 0, 0, 0, 0, (-gih6 + gih6**2/(gah6 + ghp6 + gih6))/ch6] ])
-
-    B_sim = np.array([ [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0], 
-                   [0,0,0,0,0,0],
-                   [1/ch1,0,0,0,0,0],
-                   [0, 1/ch2,0,0,0,0],
-                   [0,0, 1/ch3,0,0,0],
-                   [0,0,0, 1/ch4,0,0],
-                   [0,0,0,0, 1/ch5,0],
-                   [0,0,0,0,0, 1/ch6] ])
-
-    C_sim = np.array([ [0, gsb2/(gps2 + gsb2), 0, gps2/(gps2 + gsb2), 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-                   [0, gsb4/(gps4 + gsb4), 0, 0, 0, gps4/(gps4 + gsb4), 0, 0, 0, 0, 0, 0, 0, 0, 0],
-                   [0, gsb7/(gps7 + gsb7), 0, 0, 0, 0, 0, 0, gps7/(gps7 + gsb7), 0, 0, 0, 0, 0, 0] ])
+    A_sim, B_sim, C_sim = thermal_model.enclosure_model(constants)
 
     #Simulation variables
     timesteps = len(temps[0,:])#number of integration timesteps
@@ -378,13 +262,376 @@ def simulate(constants, temps, heaters, ambient, dt, return_temps=False):
         yvalues[:,(step - 1):step] = np.dot(C_sim, xvalues[:, (step -1):step])
         #record sensor values to compare
         #ycomp[:,step:(step + 1)] = temps[:, step:(step + 1)]
-    print(constants)
     if return_temps:
         return yvalues
     else:
         #compute residuals and flatten
         return (yvalues - temps[:,0:(timesteps-1)]).flatten()
 
+def simulate_jacobian(constants, temps, heaters, ambient, dt, return_temps=False, columns=None):
+    """Compute the Jacobian of the residuals from simulate in one pass, by 
+    integrating the sensitivity equations alongside the state.
+    
+    The sensitivities S = dx/d(constants) follow from differentiating each
+    simulate timestep: S <- S + (A_sim S + dA/dc x + dB/dc u)*dt, with the 
+    ambient row forced to 0 and the initial S the identity for the initial 
+    state constants. The residual derivatives are then C_sim S + dC/dc x.
+    
+    Parameters
+    ----------
+    constants, temps, heaters, ambient, dt:
+        As for simulate.
+    return_temps: bool (optional)
+        Ignored, so that this can be passed to least_squares as jac with the 
+        same args as simulate.
+    columns: list (optional)
+        Only compute the derivatives with respect to these constants.
+    
+    Returns
+    -------
+    jacobian: numpy array
+        The (3*(n_times - 1), 30) derivatives of the residuals, or 
+        (3*(n_times - 1), len(columns)) if columns is given.
+    """
+    A_sim, B_sim, C_sim = thermal_model.enclosure_model(constants)
+    dA, dB, dC = thermal_model.enclosure_model_derivatives(constants)
+    nmodel = len(dA) #number of constants in the model matrices
+    nstates = len(A_sim)
+    if columns is None:
+        columns = np.arange(len(constants))
+    columns = np.asarray(columns)
+    #Work with the model constants first, then the initial state constants.
+    order = np.argsort(columns >= nmodel, kind='mergesort')
+    columns = columns[order]
+    nm = int(np.sum(columns < nmodel))
+    dA, dB, dC = dA[columns[:nm]], dB[columns[:nm]], dC[columns[:nm]]
+    timesteps = len(temps[0,:])
+    jacobian = np.empty( (3, timesteps - 1, len(columns)) )
+    #The state followed by its sensitivity to each constant.
+    z = np.zeros( (nstates, 1 + len(columns)) )
+    z[:,0] = constants[15:15 + nstates]
+    z[columns[nm:] - nmodel, 1 + np.arange(nm, len(columns))] = 1
+    for step in range(1, timesteps):
+        x = z[:,0]
+        u = heaters[:, step - 1]
+        jacobian[:,step - 1] = np.dot(C_sim, z[:,1:])
+        jacobian[:,step - 1,:nm] += np.dot(dC, x).T
+        zdot = np.dot(A_sim, z)
+        zdot[:,0] += np.dot(B_sim, u)
+        zdot[:,1:1 + nm] += (np.dot(dA, x) + np.dot(dB, u)).T
+        z += zdot*dt
+        #The ambient temperature is an input, not a function of the constants.
+        z[0,0] = ambient[0,step]
+        z[0,1:] = 0
+    jacobian = jacobian.reshape( (3*(timesteps - 1), len(columns)) )
+    if np.any(order != np.arange(len(order))):
+        unordered = np.empty_like(jacobian)
+        unordered[:,order] = jacobian
+        return unordered
+    return jacobian
+
+def simulate_exact(constants, temps, heaters, ambient, dt, return_temps=False):
+    """As for simulate, but propagating the model exactly over each timestep
+    (with the heater powers and ambient temperature held), rather than with 
+    Euler steps. This is stable for any dt, so can be used with decimated 
+    logs."""
+    A_sim, B_sim, C_sim = thermal_model.enclosure_model(constants)
+    timesteps = len(temps[0,:])
+    #The ambient temperature (state 0) is an input, like the heater powers.
+    inputs = np.empty( (timesteps - 1, 1 + len(B_sim[0])) )
+    inputs[:,0] = ambient[0,:timesteps - 1]
+    inputs[0,0] = constants[15]
+    inputs[:,1:] = heaters[:,:timesteps - 1].T
+    Phi, Gamma = lti.zoh(A_sim[1:,1:], np.hstack((A_sim[1:,:1], B_sim[1:])), dt)
+    nstates = len(A_sim)
+    xvalues = lti.propagate(Phi, Gamma, constants[16:15 + nstates], inputs[:-1])
+    yvalues = np.dot(C_sim[:,1:], xvalues.T) + np.outer(C_sim[:,0], inputs[:,0])
+    if return_temps:
+        return yvalues
+    else:
+        return (yvalues - temps[:,0:(timesteps-1)]).flatten()
+
+def euler_stable(constants, dt):
+    """Return whether simulate is stable with these constants and dt, i.e. 
+    whether every eigenvalue of the Euler step has magnitude at most 1."""
+    A_sim = thermal_model.enclosure_model(constants)[0]
+    step = np.eye(len(A_sim) - 1) + A_sim[1:,1:]*dt
+    return np.max(np.abs(np.linalg.eigvals(step))) <= 1
+
+def decimate(temps, heaters, ambient, factor):
+    """Decimate a log by factor, for coarse fits with simulate_exact and a
+    timestep of dt*factor. The temperatures are sampled at the start of each
+    block of timesteps, and the inputs are averaged over it."""
+    nblocks = len(temps[0,:])//factor
+    def block_mean(array):
+        return array[:,:nblocks*factor].reshape( (len(array), nblocks, factor) ).mean(axis=2)
+    return temps[:,:nblocks*factor:factor], block_mean(heaters), block_mean(ambient)
+
+def calibration_bounds():
+    """Return the lower and upper bounds of the 15 model constants, within 
+    which multistart samples its starts."""
+    constants = default_constants()[:15]
+    ranges = MULTISTART_CONDUCTANCE_RANGE*np.ones(15)
+    #individual_ch, lid cp, table cp, cb and bottom cp.
+    ranges[9:14] = MULTISTART_CAPACITANCE_RANGE
+    return constants/ranges, constants*ranges
+
+def latin_hypercube(nsamples, lower, upper, seed=None):
+    """Return (nsamples, n) Latin hypercube samples between lower and upper,
+    uniform in the log of each of the n constants (as they are scales).
+    
+    Each constant has one sample in each of nsamples equal intervals, with 
+    the intervals of different constants matched at random."""
+    rng = np.random.RandomState(seed)
+    lower = np.log(lower)
+    upper = np.log(upper)
+    intervals = np.array([rng.permutation(nsamples) for ix in range(len(lower))]).T
+    fractions = (intervals + rng.uniform(size=intervals.shape))/nsamples
+    return np.exp(lower + fractions*(upper - lower))
+
+def share_array(array):
+    """Copy an array into shared memory, so that it can be given to pool 
+    processes (as an initializer argument) without pickling its contents.
+    
+    Returns
+    -------
+    shared: tuple
+        The shared buffer and the shape, for shared_array.
+    """
+    array = np.asarray(array, dtype=float)
+    buf = multiprocessing.RawArray('d', int(array.size))
+    shared_array( (buf, array.shape) )[...] = array
+    return buf, array.shape
+
+def shared_array(shared):
+    """Return a numpy view of an array from share_array."""
+    buf, shape = shared
+    return np.frombuffer(buf, dtype=float).reshape(shape)
+
+#The shared arrays of a FitPool, in each of its processes.
+_pool_arrays = {}
+
+def _init_pool(shared):
+    """Process pool initializer for FitPool."""
+    for name in shared:
+        _pool_arrays[name] = shared_array(shared[name])
+
+def _jacobian_columns(args):
+    """Process pool target for FitPool.jacobian."""
+    constants, columns, dt = args
+    d = _pool_arrays
+    d['jacobian'][:,columns] = simulate_jacobian(constants, d['temps'], 
+        d['heaters'], d['ambient'], dt, columns=columns)
+
+def _difference_columns(args):
+    """Process pool target for FitPool.jacobian, by forward differences."""
+    constants, columns, dt = args
+    d = _pool_arrays
+    for column in columns:
+        perturbed = np.array(constants, dtype=float)
+        step = DIFFERENCE_STEP*max(1., abs(perturbed[column]))
+        perturbed[column] += step
+        d['jacobian'][:,column] = (simulate(perturbed, d['temps'], d['heaters'], 
+            d['ambient'], dt) - d['residuals'])/step
+
+def _fit_segment(args):
+    """Process pool target for FitPool.fit_segments and FitPool.fit_starts."""
+    constants, start, stop, dt, exact, kwargs = args
+    d = _pool_arrays
+    fit_args = (d['temps'][:,start:stop], d['heaters'][:,start:stop], 
+        d['ambient'][:,start:stop], dt, False)
+    constants = np.array(constants, dtype=float)
+    constants[15] = fit_args[2][0,0]
+    if exact:
+        fun, jac = simulate_exact, '2-point'
+    else:
+        fun, jac = simulate, simulate_jacobian
+    result = least_squares(fun, constants, jac=jac, x_scale='jac', 
+        args=fit_args, bounds=([0]*30,[np.inf]*30), **kwargs)
+    return result.x, result.cost, result.status
+
+class FitPool:
+    def __init__(self, temps, heaters, ambient, dt, processes=FIT_PROCESSES, 
+        method='sensitivity', share_jacobian=True):
+        """A process pool for fitting the constants to one log. The log 
+        arrays are shared with the processes once, rather than pickled for
+        every task.
+        
+        Parameters
+        ----------
+        temps, heaters, ambient, dt:
+            As for simulate.
+        processes: int (optional)
+            Number of processes. Defaults to the number of CPUs.
+        method: string (optional)
+            How each process computes its Jacobian columns: 'sensitivity' 
+            (simulate_jacobian) or '2-point' (forward differences). Every 
+            sensitivity pass also simulates the state, so with many processes
+            '2-point' can take less time, but it is less accurate.
+        share_jacobian: bool (optional)
+            If false, don't allocate the shared Jacobian, which is as large as
+            the log times 90. Then only fit_segments and fit_starts can be 
+            used.
+        """
+        if method not in ('sensitivity', '2-point'):
+            raise UserWarning("Unknown Jacobian method: " + str(method))
+        self.method = method
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.temps, self.heaters, self.ambient = temps, heaters, ambient
+        self.dt = dt
+        ncolumns = len(default_constants())
+        shared = dict(temps=share_array(temps), heaters=share_array(heaters), 
+            ambient=share_array(ambient))
+        self.share_jacobian = share_jacobian
+        if share_jacobian:
+            shared['jacobian'] = share_array(np.zeros( (3*(temps.shape[1] - 1), ncolumns) ))
+            shared['residuals'] = share_array(np.zeros(3*(temps.shape[1] - 1)))
+            self.jacobian_buffer = shared_array(shared['jacobian'])
+            self.residuals_buffer = shared_array(shared['residuals'])
+        #Each process computes a block of Jacobian columns.
+        self.column_blocks = [block for block in 
+            np.array_split(np.arange(ncolumns), processes) if len(block) > 0]
+        self.pool = multiprocessing.Pool(processes, _init_pool, (shared,))
+    
+    def residuals(self, constants):
+        """The residuals from simulate, computed in this process."""
+        return simulate(constants, self.temps, self.heaters, self.ambient, self.dt)
+    
+    def jacobian(self, constants):
+        """The Jacobian of the residuals, as for simulate_jacobian, with 
+        blocks of columns computed in parallel."""
+        if not self.share_jacobian:
+            raise UserWarning("FitPool was made with share_jacobian=False, so has no Jacobian")
+        if self.method == '2-point':
+            self.residuals_buffer[:] = self.residuals(constants)
+            target = _difference_columns
+        else:
+            target = _jacobian_columns
+        self.pool.map(target, [(constants, block, self.dt) for block in self.column_blocks])
+        return self.jacobian_buffer.copy()
+    
+    def fit(self, constants, **kwargs):
+        """Fit the constants to the whole log with least_squares, computing 
+        the Jacobian in parallel. kwargs are passed on to least_squares."""
+        if not self.share_jacobian:
+            raise UserWarning("FitPool was made with share_jacobian=False, so can't fit with its Jacobian")
+        return least_squares(self.residuals, constants, jac=self.jacobian, 
+            x_scale='jac', bounds=([0]*30,[np.inf]*30), **kwargs)
+    
+    def fit_segments(self, constants, segments, **kwargs):
+        """Fit the constants separately to segments of the log, in parallel.
+        
+        Parameters
+        ----------
+        constants: numpy array
+            The starting constants for every segment.
+        segments: list
+            (start, stop) timestep indices of each segment.
+        kwargs:
+            Passed on to least_squares.
+        
+        Returns
+        -------
+        results: list
+            The fitted constants, final cost and least_squares status for 
+            each segment.
+        """
+        return self.pool.map(_fit_segment, [(constants, start, stop, self.dt, False, kwargs)
+            for start, stop in segments])
+    
+    def fit_starts(self, starts, exact=False, **kwargs):
+        """Fit the constants to the whole log from each of several starts, in
+        parallel. Every fit holds its own Jacobian.
+        
+        Parameters
+        ----------
+        starts: list
+            The starting constants for each fit.
+        exact: bool (optional)
+            If true, fit with simulate_exact and a finite-difference Jacobian,
+            e.g. for a decimated log.
+        kwargs:
+            Passed on to least_squares.
+        
+        Returns
+        -------
+        results: list
+            As for fit_segments.
+        """
+        return self.pool.map(_fit_segment, [(constants, 0, None, self.dt, exact, kwargs)
+            for constants in starts])
+    
+    def close(self):
+        """Stop the processes."""
+        self.pool.close()
+        self.pool.join()
+
+def multistart(temps, heaters, ambient, dt, nstarts=MULTISTART_STARTS, 
+    nkeep=MULTISTART_KEEP, coarse_dt=MULTISTART_COARSE_DT, 
+    coarse_nfev=MULTISTART_COARSE_NFEV, seed=None, processes=FIT_PROCESSES, **kwargs):
+    """Fit the constants from many starts, to avoid poor local minima where 
+    conductances and capacitances trade off against each other.
+    
+    The model constants of each start are Latin hypercube samples within 
+    calibration_bounds. Every start is first fitted briefly to the log 
+    decimated to coarse_dt, with simulate_exact. Only the nkeep best of these 
+    for which simulate is stable at the full log's timestep dt are then fitted
+    to the full log. All fits are spread over a process pool.
+    
+    Parameters
+    ----------
+    temps, heaters, ambient, dt:
+        As for simulate.
+    nstarts: int (optional)
+        Number of starts.
+    nkeep: int (optional)
+        Number of coarse fits to fit to the full log.
+    coarse_dt: float (optional)
+        Timestep of the decimated log, in s.
+    coarse_nfev: int (optional)
+        Maximum number of function evaluations for each coarse fit.
+    seed: int (optional)
+        Seed for the Latin hypercube.
+    processes: int (optional)
+        Number of processes. Defaults to the number of CPUs.
+    kwargs:
+        Passed on to least_squares for the full fits.
+    
+    Returns
+    -------
+    results: list of dicts
+        The fitted 'constants', 'cost', least_squares 'status' and 
+        'coarse_cost' of each full fit, in order of increasing cost.
+    """
+    lower, upper = calibration_bounds()
+    starts = np.tile(default_constants(), (nstarts, 1))
+    starts[:,:15] = latin_hypercube(nstarts, lower, upper, seed)
+    factor = max(int(round(coarse_dt/dt)), 1)
+    coarse_temps, coarse_heaters, coarse_ambient = decimate(temps, heaters, ambient, factor)
+    pool = FitPool(coarse_temps, coarse_heaters, coarse_ambient, dt*factor, processes, 
+        share_jacobian=False)
+    try:
+        coarse = pool.fit_starts(starts, exact=True, max_nfev=coarse_nfev)
+    finally:
+        pool.close()
+    #The coarse fits use simulate_exact, which is stable for any timestep, so
+    #their own step (dt*factor) needs no check. What matters is whether the
+    #full fits that start from them, with simulate's Euler steps of dt, are
+    #stable, so screen with dt.
+    costs = np.array([cost if euler_stable(x, dt) else np.inf for x, cost, status in coarse])
+    keep = np.argsort(costs)[:nkeep]
+    keep = keep[np.isfinite(costs[keep])]
+    pool = FitPool(temps, heaters, ambient, dt, processes, share_jacobian=False)
+    try:
+        fits = pool.fit_starts([coarse[ix][0] for ix in keep], **kwargs)
+    finally:
+        pool.close()
+    results = [dict(constants=x, cost=cost, status=status, coarse_cost=coarse[ix][1]) 
+        for ix, (x, cost, status) in zip(keep, fits)]
+    return sorted(results, key=lambda result: result['cost'])
+
 
 def wrapper_sim(xdata, c0, c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12, c13, c14, c15, c16, c17, c18, c19, c20, c21, c22, c23, c24, c25, c26, c27, c28, c29):
     constants = [0]*30
@@ -424,52 +671,71 @@ def wrapper_sim(xdata, c0, c1, c2, c3, c4, c5, c6, c7, c8, c9, c10, c11, c12, c1
     temps = xdata[0:3,:]
     heaters = xdata[3:9,:]
     ambient = xdata[9:24,:]
+    from numba.decorators import autojit
     simulate_numba = autojit(simulate)
     return simulate_numba(constants,temps, heaters, ambient, dt, True)
     
 
-def run_optimisation():
+def run_optimisation(file=FIT_LOGFILE, dt=0.05, processes=FIT_PROCESSES, **kwargs):
+    """Fit the constants to a log file, computing the Jacobian in a FitPool.
+    
+    Parameters
+    ----------
+    file: string (optional)
+        The log file, as for read_data.
+    dt: float (optional)
+        Timestep in s to condition the log to.
+    processes: int (optional)
+        Number of processes. Defaults to the number of CPUs.
+    kwargs:
+        Passed on to least_squares.
+    
+    Returns
+    -------
+    result: scipy.optimize.OptimizeResult
+        The least_squares result, with the fitted constants in result.x.
+    """
+    temps, heaters, ambient = read_data(file, dt)
     #set initialvalues to pass to simulator
-    dt = 0.05
-    file = "C:\\Users\\mattr\\OneDrive\\Documents\\Stromolo Job\\test_otherheaters.log"
     constants = default_constants()
-    #import pdb; pdb.set_trace()
+    constants[15] = ambient[0,0]
+    #The constants range from 1e-3 to 1e5, so FitPool.fit scales them by the
+    #Jacobian columns.
+    pool = FitPool(temps, heaters, ambient, dt, processes)
+    try:
+        return pool.fit(constants, **kwargs)
+    finally:
+        pool.close()
     
-    simulate_numba = autojit(simulate)
+def run_multistart(file=FIT_LOGFILE, dt=0.05, processes=FIT_PROCESSES, **kwargs):
+    """Fit the constants to a log file from many starts, with multistart.
+    
+    Parameters
+    ----------
+    file, dt, processes:
+        As for run_optimisation.
+    kwargs:
+        Passed on to multistart, e.g. nstarts or seed.
+    
+    Returns
+    -------
+    results: list of dicts
+        As for multistart, best first.
+    """
     temps, heaters, ambient = read_data(file, dt)
-    constants[15] = ambient[0,0]
-    import matplotlib.pyplot as plt
-    out = simulate_numba(constants,temps, heaters, ambient, dt, True)
-    plt.plot(out[0,:])
-   # plt.plot(out[1,:])
-    #plt.plot(out[2,:])
-    plt.plot(temps[0,:])
-    #plt.plot(temps[1,:])
-    #plt.plot(temps[2,:])
-    plt.show()
-    import pdb; pdb.set_trace()
-    result = least_squares(simulate_numba, constants, args=(temps, heaters, ambient, dt, False), bounds=([0]*30,[np.inf]*30))
-    #x, cov = leastsq(simulate_numba, constants, args=(temps, heaters, ambient, dt, False), maxfev = 1000000000)
-    import pdb; pdb.set_trace()
+    return multistart(temps, heaters, ambient, dt, processes=processes, **kwargs)
     
 def default_constants():
     """"Some initial/default values of constants"""
-    constants = 27.6*np.ones( (30) )
-    #constants = (192.6, 264.0594, 74.2374, 7.6962, 0.4599, 0.003, 85.719, 1366.6667, 1.125, 29.8553, 82898.64, 234879.48, 2387.88, 46054.8, 1366.6667, amb[0,0], 25,25,25,25,25,25,25,25,25,25,25,25,25,25)
-    constants[0] = 192.6 #individual_ghp
-    constants[1] = 264.0594 #gpb_total
-    constants[2] = 74.2374 #gpb7
-    constants[3] = 7.6962 #gpa_total
-    constants[4] = 0.4599 #gps
-    constants[5] = 0.003 #gsb
-    constants[6] = 85.719  #individual_gih
-    constants[7] = 1366.6667 #linear conductance lid
-    constants[8] = 1.125 #optical table conductance to other sides
-    constants[9] = 29.8553 #individual_ch
-    constants[10] = 82898.64 #lid cp
-    constants[11] = 234879.48 #table cp
-    constants[12] = 2387.88 #cb
-    constants[13] = 46054.8 #bottom cp
-    constants[14] = 1366.6667 #bottom linear conductance
-    constants[15] = 22.0 #Guess of ambient temperature.
-    return constants
+    return thermal_model.default_constants()
+
+if __name__=="__main__":
+    #The pool's processes import this module, so only fit when run as a script.
+    #Set use_multistart to fit from many starts rather than default_constants().
+    use_multistart = False
+    if use_multistart:
+        results = run_multistart()
+        print(results[0]['constants'])
+    else:
+        result = run_optimisation()
+        print(result.x)
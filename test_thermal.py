@@ -1,13 +1,21 @@
+import sys
 import veloce
 
+#Run with --fake to use a simulated labjack and enclosure instead of hardware.
+if "--fake" in sys.argv:
+    from veloce import fake_ljm
+    backend = fake_ljm.FakeLJM()
+else:
+    backend = None
+
 #Initialise our thermal_verver object
-tc = veloce.thermal_control.ThermalControl()
+tc = veloce.thermal_control.ThermalControl(backend=backend)
 server_cmds = veloce.thermal_control_cmds.CommandList(tc)
 #The following line starts the server.
 thermal_server = veloce.server.ServerSocket(3000, "VTherm", server_cmds)
 
 #Add jobs we want to test.
-thermal_server.add_job(tc.job_doservo)
+tc.servo_job = thermal_server.add_job(tc.job_doservo, period=tc.dt)
 
 #Run!
-thermal_server.run()
+thermal_server.run(threaded_jobs=True)
@@ -0,0 +1,10 @@
+import pytest
+from veloce import lqg_math
+
+@pytest.fixture(autouse=True)
+def gain_cache_dir(tmp_path, monkeypatch):
+    """Keep the LQG gain cache of every test in its own temporary directory,
+    rather than in the user's cache."""
+    monkeypatch.setenv('VELOCE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(lqg_math, 'GAIN_CACHE_DIR', str(tmp_path))
+    return tmp_path
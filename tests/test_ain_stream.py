@@ -0,0 +1,76 @@
+import numpy as np
+from veloce import thermal_control
+from veloce import fake_ljm
+from veloce import ain_stream
+from veloce.replay import VirtualClock
+
+NCHAN = len(thermal_control.AIN_NAMES)
+SCANS_PER_READ = ain_stream.STREAM_SCANS_PER_READ
+
+def make_streaming_control():
+    clock = VirtualClock(0.)
+    lj = fake_ljm.FakeLJM(seed=0, clock=clock, sleep=clock.sleep)
+    tc = thermal_control.ThermalControl(backend=lj)
+    assert tc.cmd_streamstart("STREAMSTART").startswith("Streaming")
+    return tc, lj, clock
+
+def test_callbacks_are_delivered_when_due():
+    tc, lj, clock = make_streaming_control()
+    #Not a whole block yet.
+    clock.advance_to(clock() + 0.5*SCANS_PER_READ/ain_stream.STREAM_SCAN_RATE)
+    assert lj.deliver_stream() == 0
+    clock.advance_to(clock() + 3*SCANS_PER_READ/ain_stream.STREAM_SCAN_RATE)
+    assert lj.deliver_stream() == 3
+    assert lj.ncalls['eStreamRead'] == 3
+    voltages, nsamples = tc.stream.average()
+    assert np.all(nsamples == 3*SCANS_PER_READ)
+    #Everything has been averaged, so there is nothing new.
+    voltages, nsamples = tc.stream.average()
+    assert np.all(nsamples == 0)
+    assert np.all(np.isnan(voltages))
+
+def test_average_ignores_dummy_values():
+    tc, lj, clock = make_streaming_control()
+    lj.overflow_next(SCANS_PER_READ + 3)
+    clock.advance_to(clock() + 2*SCANS_PER_READ/ain_stream.STREAM_SCAN_RATE)
+    assert lj.deliver_stream() == 2
+    assert np.sum(tc.stream.buffer == ain_stream.STREAM_DUMMY_VALUE) == \
+        (SCANS_PER_READ + 3)*NCHAN
+    voltages, nsamples = tc.stream.average()
+    assert np.all(nsamples == SCANS_PER_READ - 3)
+    expected = np.array(lj.eReadNames(tc.handle, NCHAN, thermal_control.AIN_NAMES))
+    assert np.allclose(voltages, expected, atol=1e-6)
+    #A block of nothing but dummy values gives no samples, not -9999.
+    lj.overflow_next(SCANS_PER_READ)
+    clock.advance_to(clock() + SCANS_PER_READ/ain_stream.STREAM_SCAN_RATE)
+    assert lj.deliver_stream() == 1
+    voltages, nsamples = tc.stream.average()
+    assert np.all(nsamples == 0)
+    assert np.all(np.isnan(voltages))
+
+def test_stream_temperatures_match_model():
+    tc, lj, clock = make_streaming_control()
+    clock.advance_to(clock() + 1.0)
+    lj.deliver_stream()
+    ok = tc.acquire_voltages()
+    assert np.all(ok)
+    assert np.allclose(tc.gettemps()[:4], lj.temperatures()[:4], atol=1e-3)
+
+def test_failed_stream_reverts_to_polling():
+    tc, lj, clock = make_streaming_control()
+    lj.fail_next(1)
+    clock.advance_to(clock() + 2*SCANS_PER_READ/ain_stream.STREAM_SCAN_RATE)
+    lj.deliver_stream()
+    assert tc.stream.error is not None
+    lj.ncalls.clear()
+    ok = tc.acquire_voltages()
+    assert np.all(ok)
+    assert tc.stream is None
+    assert lj.ncalls['eReadNames'] == 1
+
+def test_streamstop():
+    tc, lj, clock = make_streaming_control()
+    tc.cmd_streamstop("STREAMSTOP")
+    assert tc.stream is None
+    assert lj.stream is None
+    assert lj.ncalls['eStreamStop'] == 1
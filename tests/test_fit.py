@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import simulator_output_func as sof
+
+def synthetic_log(ntimes=200, dt=0.5, seed=0):
+    """A log simulated with the default constants, with varying heaters. The
+    timestep is short enough for simulate to be stable."""
+    rng = np.random.RandomState(seed)
+    constants = sof.default_constants()
+    heaters = np.repeat(rng.uniform(0, 20, size=(6, ntimes//20 + 1)), 20, axis=1)[:,:ntimes]
+    ambient = np.zeros( (15, ntimes) )
+    ambient[0] = constants[15] + 0.5*np.sin(np.arange(ntimes)*dt/30.)
+    temps = np.zeros( (3, ntimes) )
+    temps[:,:ntimes-1] = sof.simulate(constants, temps, heaters, ambient, dt, return_temps=True)
+    return constants, temps, heaters, ambient, dt
+
+def forward_differences(constants, temps, heaters, ambient, dt):
+    residuals = sof.simulate(constants, temps, heaters, ambient, dt)
+    jacobian = np.empty( (len(residuals), len(constants)) )
+    for column in range(len(constants)):
+        perturbed = constants.copy()
+        step = sof.DIFFERENCE_STEP*max(1., abs(perturbed[column]))
+        perturbed[column] += step
+        jacobian[:,column] = (sof.simulate(perturbed, temps, heaters, ambient, dt) - residuals)/step
+    return jacobian
+
+def test_simulate_jacobian_matches_finite_differences():
+    constants, temps, heaters, ambient, dt = synthetic_log()
+    #Fit to slightly different temperatures, so the residuals aren't zero.
+    temps = temps + 0.01
+    jacobian = sof.simulate_jacobian(constants, temps, heaters, ambient, dt)
+    assert jacobian.shape == (3*(temps.shape[1] - 1), len(constants))
+    for column in range(len(constants)):
+        #Central differences, with steps relative to each constant.
+        step = 1e-4*max(abs(constants[column]), 1e-3)
+        plus = constants.copy()
+        plus[column] += step
+        minus = constants.copy()
+        minus[column] -= step
+        difference = (sof.simulate(plus, temps, heaters, ambient, dt) - 
+            sof.simulate(minus, temps, heaters, ambient, dt))/(2*step)
+        scale = np.max(np.abs(jacobian[:,column]))
+        assert np.allclose(jacobian[:,column], difference, rtol=0, atol=1e-4*scale)
+
+def test_simulate_jacobian_columns():
+    constants, temps, heaters, ambient, dt = synthetic_log(ntimes=50)
+    jacobian = sof.simulate_jacobian(constants, temps, heaters, ambient, dt)
+    #Columns in any order, mixing model and initial state constants.
+    columns = [20, 3, 15, 9, 0]
+    assert np.allclose(sof.simulate_jacobian(constants, temps, heaters, ambient, dt, 
+        columns=columns), jacobian[:,columns], rtol=1e-12, atol=0)
+
+def test_pool_jacobian_matches_serial():
+    constants, temps, heaters, ambient, dt = synthetic_log()
+    expected = dict(sensitivity=sof.simulate_jacobian(constants, temps, heaters, ambient, dt))
+    expected['2-point'] = forward_differences(constants, temps, heaters, ambient, dt)
+    for method in expected:
+        pool = sof.FitPool(temps, heaters, ambient, dt, processes=2, method=method)
+        try:
+            jacobian = pool.jacobian(constants)
+        finally:
+            pool.close()
+        assert np.array_equal(jacobian, expected[method])
+
+def test_run_optimisation(monkeypatch):
+    constants, temps, heaters, ambient, dt = synthetic_log(ntimes=50)
+    monkeypatch.setattr(sof, "read_data", lambda file, dt: (temps, heaters, ambient))
+    result = sof.run_optimisation("synthetic.log", dt, processes=1, max_nfev=2)
+    assert result.x.shape == constants.shape
+    #The log was simulated with the default constants, so it starts at the 
+    #minimum.
+    assert result.cost < 1e-20
+
+def test_pool_without_jacobian():
+    constants, temps, heaters, ambient, dt = synthetic_log(ntimes=50)
+    pool = sof.FitPool(temps, heaters, ambient, dt, processes=1, share_jacobian=False)
+    try:
+        with pytest.raises(UserWarning):
+            pool.jacobian(constants)
+        with pytest.raises(UserWarning):
+            pool.fit(constants)
+        #Fits that hold their own Jacobian still work.
+        results = pool.fit_starts([constants], max_nfev=2)
+        assert len(results) == 1
+    finally:
+        pool.close()
+
+def test_multistart():
+    constants, temps, heaters, ambient, dt = synthetic_log()
+    results = sof.multistart(temps, heaters, ambient, dt, nstarts=8, nkeep=3,
+        coarse_dt=10*dt, coarse_nfev=5, seed=1, processes=2, max_nfev=3)
+    assert 0 < len(results) <= 3
+    costs = [result['cost'] for result in results]
+    assert costs == sorted(costs)
+    for result in results:
+        assert np.all(np.isfinite(result['constants']))
+        assert np.all(result['constants'] >= 0)
+        assert np.isfinite(result['coarse_cost'])
+        assert np.isfinite(result['cost'])
+
+def test_run_multistart(monkeypatch):
+    constants, temps, heaters, ambient, dt = synthetic_log(ntimes=100)
+    monkeypatch.setattr(sof, "read_data", lambda file, dt: (temps, heaters, ambient))
+    results = sof.run_multistart("synthetic.log", dt, processes=1, nstarts=2, 
+        nkeep=1, coarse_dt=10*dt, coarse_nfev=2, seed=0, max_nfev=2)
+    assert len(results) == 1
+    assert results[0]['constants'].shape == constants.shape
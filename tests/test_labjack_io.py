@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from veloce import thermal_control
+from veloce import fake_ljm
+from veloce import thermistor
+
+NCHAN = len(thermal_control.AIN_NAMES)
+
+def make_control(**kwargs):
+    lj = fake_ljm.FakeLJM(seed=0, **kwargs)
+    tc = thermal_control.ThermalControl(backend=lj)
+    lj.ncalls.clear()
+    return tc, lj
+
+def test_one_read_per_tick():
+    tc, lj = make_control()
+    ok = tc.acquire_voltages()
+    assert np.all(ok)
+    assert lj.ncalls['eReadNames'] == 1
+    assert lj.ncalls['eReadName'] == 0
+    #The table, lower, upper and cryostat temperatures are those modelled.
+    assert np.allclose(tc.gettemps()[:4], lj.temperatures()[:4], atol=1e-3)
+
+def test_failed_batch_read_falls_back_to_each_channel():
+    tc, lj = make_control()
+    tc.acquire_voltages()
+    old_voltages = tc.voltages.copy()
+    lj.x[1:] += 1.0
+    #Fail the batched read, then the first two single-channel reads.
+    lj.fail_next(3)
+    ok = tc.acquire_voltages()
+    assert lj.ncalls['eReadNames'] == 2
+    assert lj.ncalls['eReadName'] == NCHAN
+    assert not np.any(ok[:2])
+    assert np.all(ok[2:])
+    #Channels that fail keep their previous voltage.
+    assert np.array_equal(tc.voltages[:2], old_voltages[:2])
+    assert np.all(tc.voltages[2:4] != old_voltages[2:4])
+    assert tc.nfailed_ticks == 0
+
+def heater_register(lj, ix):
+    return lj.registers["DIO"+thermal_control.HEATER_DIOS[ix]+"_EF_CONFIG_A"]
+
+def test_heater_writes_are_coalesced():
+    tc, lj = make_control()
+    for ix, fraction in enumerate([0.1, 0.2, 0.3]):
+        tc.set_heater(ix, fraction)
+    assert lj.ncalls['eWriteNames'] == 0
+    assert tc.flush_heaters() == 3
+    assert lj.ncalls['eWriteNames'] == 1
+    assert heater_register(lj, 1) == int(0.2*thermal_control.PWM_MAX)
+    #Unchanged registers are skipped, and nothing is written if none changed.
+    assert tc.flush_heaters() == 0
+    assert lj.ncalls['eWriteNames'] == 1
+    tc.set_heater(1, 0.5)
+    tc.set_heater(2, 0.3)
+    assert tc.flush_heaters() == 1
+    assert lj.ncalls['eWriteNames'] == 2
+    assert heater_register(lj, 1) == int(0.5*thermal_control.PWM_MAX)
+
+def test_failed_heater_write_is_retried():
+    tc, lj = make_control()
+    tc.set_heater(0, 0.4)
+    lj.fail_next(1)
+    with pytest.raises(fake_ljm.LJMError):
+        tc.flush_heaters()
+    assert tc.flush_heaters() == 1
+    assert heater_register(lj, 0) == int(0.4*thermal_control.PWM_MAX)
+
+def test_one_write_per_servo_tick():
+    tc, lj = make_control()
+    tc.cmd_lqgstart("")
+    tc.cmd_cryostart("")
+    lj.ncalls.clear()
+    nwrites = []
+    for i in range(5):
+        tc.job_doservo()
+        nwrites.append(lj.ncalls['eWriteNames'])
+    #The LQG and cryostat servos both set heaters, in at most one write.
+    assert nwrites[0] == 1
+    assert np.all(np.diff(nwrites) <= 1)
+    assert lj.ncalls['eReadNames'] == 5
+
+def test_conversions_are_cached_until_voltages_change():
+    tc, lj = make_control()
+    tc.acquire_voltages()
+    temps = tc.gettemps()
+    resistances = tc.getresistances()
+    assert np.allclose(temps, thermal_control.TEMP_TABLE.temps(tc.voltages))
+    assert np.allclose(resistances, thermistor.bridge_resistances(tc.voltages))
+    #Every consumer shares the same read-only arrays.
+    assert tc.gettemps() is temps
+    assert tc.getresistances() is resistances
+    with pytest.raises(ValueError):
+        temps[0] = 0.
+    with pytest.raises(ValueError):
+        resistances[0] = 0.
+    #New voltages give new conversions.
+    lj.x[1:] += 1.0
+    tc.acquire_voltages()
+    new_temps = tc.gettemps()
+    assert new_temps is not temps
+    assert np.allclose(new_temps, thermal_control.TEMP_TABLE.temps(tc.voltages))
+    assert np.allclose(tc.getresistances(), thermistor.bridge_resistances(tc.voltages))
+    #Other voltages are converted without touching the cache.
+    other = tc.gettemps(tc.voltages + 0.01)
+    assert not np.allclose(other, new_temps)
+    assert tc.gettemps() is new_temps
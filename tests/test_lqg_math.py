@@ -0,0 +1,183 @@
+import os
+import numpy as np
+import pytest
+import scipy.linalg as la
+from veloce import lqg_math
+
+def cache_file(design=None):
+    return os.path.join(lqg_math.GAIN_CACHE_DIR, 
+        'lqg_gains_' + lqg_math.design_key(design) + '.npz')
+
+def test_load_gains_caches(gain_cache_dir):
+    gains = lqg_math.load_gains()
+    assert os.path.exists(cache_file())
+    cached = lqg_math.load_gains()
+    for name in lqg_math.GAIN_NAMES:
+        assert np.array_equal(gains[name], cached[name])
+    assert os.listdir(str(gain_cache_dir)) == [os.path.basename(cache_file())]
+
+def test_load_gains_replaces_corrupt_cache():
+    expected = lqg_math.solve_gains()
+    filename = cache_file()
+    lqg_math.load_gains()
+    with open(filename, 'rb') as f:
+        valid = f.read()
+    for contents in [valid[:len(valid)//2], b'', b'PK\x03\x04 truncated', b'not a zip file']:
+        with open(filename, 'wb') as f:
+            f.write(contents)
+        gains = lqg_math.load_gains()
+        for name in lqg_math.GAIN_NAMES:
+            assert np.allclose(gains[name], expected[name])
+        #The corrupt file has been rewritten.
+        with np.load(filename) as cached:
+            assert np.allclose(cached['K_mat'], expected['K_mat'])
+
+def test_lqg_step_matches_reference():
+    design = lqg_math.lqg_design()
+    A, B, C = design['A_mat'], design['B_mat'], design['C_mat']
+    K, L = design['K_mat'], design['L_mat']
+    umax = np.array([67.2, 28.8, 13.09])
+    step = lqg_math.LQGStep(design, umax)
+    rng = np.random.RandomState(1)
+    x = np.zeros(len(A))
+    u = np.zeros(len(umax))
+    ninterior = 0
+    for i in range(200):
+        #The gains are high, so only tiny errors keep the heaters off the rails.
+        y = 1e-5*rng.normal(size=len(C))
+        step.y[:] = y
+        fractions = step.update()
+        prediction = np.dot(A, x) + np.dot(B, u)
+        x = prediction + np.dot(K, y - np.dot(C, prediction))
+        u = np.clip(-np.dot(L, x), 0, umax)
+        assert np.allclose(step.x, x, rtol=1e-10, atol=1e-12)
+        assert np.allclose(step.u, u, rtol=1e-10, atol=1e-12)
+        assert np.allclose(fractions, u/umax)
+        ninterior += np.sum((u > 0) & (u < umax))
+    assert ninterior > 0
+
+class ReferenceFilter:
+    """A plain time-varying Kalman filter and clipped feedback, starting from
+    the steady state covariance after a measurement update."""
+    def __init__(self, design, umax):
+        self.design = design
+        self.umax = umax
+        A, C = design['A_mat'], design['C_mat']
+        self.P = np.dot(np.eye(len(A)) - np.dot(design['K_mat'], C), design['P_mat'])
+        self.x = np.zeros(len(A))
+        self.u = np.zeros(len(umax))
+
+    def update(self, y, valid, nsteps=1):
+        d = self.design
+        A, B, C = d['A_mat'], d['B_mat'], d['C_mat']
+        for i in range(nsteps):
+            self.x = np.dot(A, self.x) + np.dot(B, self.u)
+            self.P = np.dot(np.dot(A, self.P), A.T) + d['V_mat']
+        if np.any(valid):
+            Cv = C[valid]
+            S = np.dot(np.dot(Cv, self.P), Cv.T) + d['W_mat'][np.ix_(valid, valid)]
+            K = np.dot(np.dot(self.P, Cv.T), np.linalg.inv(S))
+            self.x = self.x + np.dot(K, y[valid] - np.dot(Cv, self.x))
+            self.P = np.dot(np.eye(len(A)) - np.dot(K, Cv), self.P)
+        self.u = np.clip(-np.dot(d['L_mat'], self.x), 0, self.umax)
+
+def run_against_reference(valids, nsteps):
+    design = lqg_math.lqg_design()
+    umax = np.array([67.2, 28.8, 13.09])
+    step = lqg_math.LQGStep(design, umax)
+    reference = ReferenceFilter(design, umax)
+    rng = np.random.RandomState(2)
+    steady = []
+    for valid, n in zip(valids, nsteps):
+        y = 1e-5*rng.normal(size=len(design['C_mat']))
+        step.y[:] = y
+        step.update(valid, n)
+        reference.update(y, valid, n)
+        #Until the filter is back to the steady state, the updates are the
+        #same. After that, they differ by about STEADY_RTOL of a correction.
+        assert np.allclose(step.x, reference.x, rtol=1e-8, atol=1e-11)
+        assert np.allclose(step.u, reference.u, rtol=1e-8, atol=1e-11)
+        steady.append(step.steady)
+        if step.steady:
+            break
+    return step, steady
+
+def test_filter_update_with_masked_channel():
+    p = len(lqg_math.C_mat)
+    masked = np.ones(p, dtype=bool)
+    masked[2] = False
+    valids = [masked]*20 + [np.ones(p, dtype=bool)]*5000
+    step, steady = run_against_reference(valids, [1]*len(valids))
+    assert not any(steady[:20])
+    #The filter goes back to the combined update once all channels are valid.
+    assert steady[-1]
+    assert np.array_equal(step.P, step.P_steady)
+
+def test_filter_update_with_late_ticks():
+    p = len(lqg_math.C_mat)
+    all_valid = np.ones(p, dtype=bool)
+    #A single late tick with every channel.
+    step, steady = run_against_reference([all_valid]*2, [100, 1])
+    #Late ticks, with a channel missing as well.
+    masked = all_valid.copy()
+    masked[0] = False
+    valids = [masked]*5 + [all_valid]*5000
+    nsteps = [3, 1, 2, 5, 2] + [1]*5000
+    step, steady = run_against_reference(valids, nsteps)
+    assert not any(steady[:5])
+    assert steady[-1]
+    assert np.array_equal(step.P, step.P_steady)
+
+def small_design():
+    """A stable two-state plant with one heater and one sensor, with its LQG
+    gains."""
+    A = np.array([[0.9, 0.05], [0.1, 0.8]])
+    B = np.array([[0.], [0.5]])
+    C = np.array([[1., 0.5]])
+    V, W = np.diag([0.01, 0.02]), np.array([[0.05]])
+    Q, R = np.eye(2), np.array([[0.1]])
+    P = la.solve_discrete_are(A.T, C.T, V, W)
+    S = la.solve_discrete_are(A, B, Q, R)
+    K = np.dot(np.dot(P, C.T), np.linalg.inv(np.dot(np.dot(C, P), C.T) + W))
+    L = np.linalg.solve(np.dot(np.dot(B.T, S), B) + R, np.dot(np.dot(B.T, S), A))
+    return dict(A_mat=A, B_mat=B, C_mat=C, V_mat=V, W_mat=W, K_mat=K, L_mat=L)
+
+def test_closed_loop_covariance_matches_monte_carlo():
+    design = small_design()
+    A, B, C = design['A_mat'], design['B_mat'], design['C_mat']
+    K, L = design['K_mat'], design['L_mat']
+    rng = np.random.RandomState(0)
+    npaths, nsettle, nsteps = 2000, 100, 1000
+    x = np.zeros( (npaths, 2) )
+    x_est = np.zeros( (npaths, 2) )
+    sum_sq = np.zeros( (2,2) )
+    sum_est_sq = np.zeros( (2,2) )
+    for i in range(nsettle + nsteps):
+        #The recurrence of LQGStep, without clipping.
+        u = -np.dot(x_est, L.T)
+        x = np.dot(x, A.T) + np.dot(u, B.T) + \
+            rng.multivariate_normal(np.zeros(2), design['V_mat'], size=npaths)
+        y = np.dot(x, C.T) + rng.normal(size=(npaths, 1))*np.sqrt(design['W_mat'][0,0])
+        x_pred = np.dot(x_est, A.T) + np.dot(u, B.T)
+        x_est = x_pred + np.dot(y - np.dot(x_pred, C.T), K.T)
+        if i >= nsettle:
+            sum_sq += np.dot(x.T, x)
+            sum_est_sq += np.dot(x_est.T, x_est)
+    covariances = lqg_math.closed_loop_covariance(design)
+    #Paths are independent, and each is correlated over only a few steps, 
+    #so the sampling error is well under 1%.
+    assert np.allclose(sum_sq/npaths/nsteps, covariances['state'], rtol=0.02, 
+        atol=0.002*np.max(covariances['state']))
+    assert np.allclose(sum_est_sq/npaths/nsteps, covariances['estimate'], rtol=0.02,
+        atol=0.002*np.max(covariances['estimate']))
+
+def test_closed_loop_covariance_holds_external_states():
+    design = lqg_math.lqg_design()
+    external = lqg_math.external_states(design['A_mat'], design['B_mat'])
+    assert np.any(external)
+    covariances = lqg_math.closed_loop_covariance(design)
+    assert np.all(covariances['state'][external] == 0)
+    assert np.all(np.isfinite(covariances['state_rms']))
+    assert np.all(covariances['state_rms'][~external] > 0)
+    with pytest.raises(UserWarning):
+        lqg_math.closed_loop_covariance(design, hold_external=False)
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import scipy.linalg as la
+from veloce import lti
+from veloce import thermal_model
+
+ZOH_VALUES = os.path.join(os.path.dirname(__file__), '..', 'ZOH Values.txt')
+
+def read_matlab_matrices(filename):
+    """Read lines like "A = [1,0;0,1]" into a dict of numpy arrays."""
+    matrices = {}
+    with open(filename) as f:
+        for line in f:
+            if '=' not in line or line.startswith('#'):
+                continue
+            name, value = line.split('=')
+            rows = value.strip().strip('[]').split(';')
+            matrices[name.strip()] = np.array([[float(v) for v in row.split(',')] for row in rows])
+    return matrices
+
+def stable_system(n=5, m=2, seed=0):
+    rng = np.random.RandomState(seed)
+    A = rng.normal(size=(n,n)) - 3*n*np.eye(n)
+    B = rng.normal(size=(n,m))
+    return A, B
+
+def test_zoh_matches_expm():
+    A, B = stable_system()
+    dt = 0.3
+    Phi, Gamma = lti.zoh(A, B, dt)
+    expected_Phi = la.expm(A*dt)
+    #For invertible A, Gamma = A^-1 (Phi - I) B.
+    expected_Gamma = np.linalg.solve(A, np.dot(expected_Phi - np.eye(len(A)), B))
+    assert np.allclose(Phi, expected_Phi, rtol=1e-12, atol=1e-14)
+    assert np.allclose(Gamma, expected_Gamma, rtol=1e-10, atol=1e-14)
+
+def test_zoh_matches_matlab_plate_model():
+    #The 2-state plate model of thermal_plate_sim (ambient then plate), with
+    #the constants that the MATLAB c2d values in "ZOH Values.txt" were made 
+    #from, at a 1s timestep.
+    G_sa, G_ah, G_ps, G_hp = 1.25, 1.0, 10.0, 10.0
+    C_p = 4300.0
+    dt_damp = 5000.0
+    G_frac = G_hp*G_ah/(G_hp + G_ah) + G_ps*G_sa/(G_ps + G_sa)
+    A = np.array([[-1/dt_damp,   0],
+                  [G_frac/C_p, -G_frac/C_p]])
+    B = np.array([[0],
+                  [G_hp/(G_hp + G_ah)/C_p]])
+    C = np.array([[G_sa/(G_sa + G_ps), G_ps/(G_sa + G_ps)]])
+    expected = read_matlab_matrices(ZOH_VALUES)
+    Phi, Gamma = lti.zoh(A, B, 1.0)
+    assert np.allclose(Phi, expected['A'], rtol=1e-13, atol=1e-16)
+    assert np.allclose(Gamma, expected['B'], rtol=1e-13, atol=1e-16)
+    assert np.allclose(C, expected['C'], rtol=1e-13)
+
+def test_propagate_matches_continuous_solution():
+    A, B = stable_system()
+    dt = 0.05
+    nsteps = 40
+    x0 = np.arange(1., len(A) + 1)
+    u = np.array([1., -2.])
+    Phi, Gamma = lti.zoh(A, B, dt)
+    x = lti.propagate(Phi, Gamma, x0, np.tile(u, (nsteps, 1)))
+    assert x.shape == (nsteps + 1, len(A))
+    for i in [0, 1, 17, nsteps]:
+        t = i*dt
+        E = la.expm(A*t)
+        expected = np.dot(E, x0) + np.linalg.solve(A, np.dot(E - np.eye(len(A)), np.dot(B, u)))
+        assert np.allclose(x[i], expected, rtol=1e-9, atol=1e-12)
+
+def test_zoh_of_plant_model():
+    #The plant model has an integrating (ambient) state, so A isn't 
+    #invertible.
+    A, B, C = thermal_model.plant_model(thermal_model.default_constants())
+    dt = 10.
+    Phi, Gamma = lti.zoh(A, B, dt)
+    assert np.allclose(Phi, la.expm(A*dt))
+    #Many small steps with held inputs converge to the same discretisation.
+    nsub = 1000
+    Phi_sub, Gamma_sub = lti.zoh(A, B, dt/nsub)
+    x = lti.propagate(Phi_sub, Gamma_sub, np.ones(len(A)), np.ones( (nsub, B.shape[1]) ))
+    assert np.allclose(x[-1], np.dot(Phi, np.ones(len(A))) + np.dot(Gamma, np.ones(B.shape[1])))
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.linalg as la
+from veloce import model_reduction
+from veloce import thermal_model
+from veloce import thermal_control
+
+def frequency_response(A, B, C, omegas):
+    n = len(A)
+    return [np.dot(C, np.linalg.solve(1j*omega*np.eye(n) - A, B)) for omega in omegas]
+
+def max_gain_error(full, reduced, omegas):
+    return max([np.linalg.norm(G - G_r, 2) for G, G_r in
+        zip(frequency_response(*(full + (omegas,))), frequency_response(*(reduced + (omegas,))))])
+
+def plant_without_ambient():
+    A, B, C = thermal_model.plant_model(thermal_model.default_constants())
+    return A[1:,1:], B[1:], C[:,1:]
+
+def test_reduced_model_is_balanced():
+    A, B, C = plant_without_ambient()
+    A_r, B_r, C_r, hsv = model_reduction.balanced_truncation(A, B, C, nstates=5)
+    Wc = la.solve_continuous_lyapunov(A_r, -np.dot(B_r, B_r.T))
+    Wo = la.solve_continuous_lyapunov(A_r.T, -np.dot(C_r.T, C_r))
+    assert np.allclose(Wc, np.diag(hsv[:5]), rtol=1e-6, atol=1e-8*hsv[0])
+    assert np.allclose(Wo, np.diag(hsv[:5]), rtol=1e-6, atol=1e-8*hsv[0])
+    assert np.all(np.diff(hsv) <= 0)
+
+def test_error_bound():
+    A, B, C = plant_without_ambient()
+    omegas = np.concatenate(([0.], np.logspace(-8, 1, 400)))
+    for nstates in [2, 4, 6]:
+        A_r, B_r, C_r, hsv = model_reduction.balanced_truncation(A, B, C, nstates=nstates)
+        bound = 2*np.sum(hsv[nstates:])
+        error = max_gain_error((A, B, C), (A_r, B_r, C_r), omegas)
+        assert error <= bound*(1 + 1e-6)
+    #Keeping every state reproduces the model, to the precision allowed by
+    #the smallest singular values.
+    A_r, B_r, C_r, hsv = model_reduction.balanced_truncation(A, B, C, nstates=len(A))
+    assert max_gain_error((A, B, C), (A_r, B_r, C_r), omegas) < 1e-5*hsv[0]
+
+def test_reduced_model_error_bound():
+    model = model_reduction.reduced_model(1e-3, thermal_control.HEATER_MAX, 
+        thermal_control.LQG_HEATERS, thermal_control.LQG_SENSORS)
+    assert model['error_bound'] <= 2*np.sum(model['hsv'][model['hsv'] <= 1e-3]) + 1e-12
+    assert len(model['A_cont']) - 1 == np.sum(model['hsv'] > 1e-3)
+    assert model['C_mat'].shape == (len(thermal_control.LQG_SENSORS), len(model['A_cont']))
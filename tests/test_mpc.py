@@ -0,0 +1,107 @@
+import numpy as np
+import scipy.linalg as la
+from scipy.optimize import lsq_linear
+from veloce import lqg_math
+from veloce import mpc
+
+UMAX = np.array([67.2, 28.8, 13.09])
+
+def test_block_lengths():
+    lengths = mpc.block_lengths(30, 48000)
+    assert len(lengths) == 30
+    assert np.sum(lengths) == 48000
+    assert lengths[0] == 1
+    assert np.all(lengths >= 1)
+    assert np.all(np.diff(lengths) >= 0)
+    assert np.array_equal(mpc.block_lengths(30, 10), np.ones(30, dtype=int))
+
+def test_prediction_matrices_match_simulation():
+    rng = np.random.RandomState(0)
+    A = 0.9*np.eye(4) + 0.02*rng.normal(size=(4,4))
+    B = rng.normal(size=(4,2))
+    lengths = np.array([1, 2, 3, 5])
+    Phi, Gamma = mpc.prediction_matrices(A, B, len(lengths), lengths)
+    x0 = rng.normal(size=4)
+    U = rng.normal(size=(len(lengths), 2))
+    predicted = (np.dot(Phi, x0) + np.dot(Gamma, U.ravel())).reshape( (len(lengths), 4) )
+    x = x0
+    for k, length in enumerate(lengths):
+        for i in range(length):
+            x = np.dot(A, x) + np.dot(B, U[k])
+        assert np.allclose(predicted[k], x)
+
+def exact_solution(step, x):
+    """Solve the MPC problem with scipy, as a bounded least squares problem."""
+    Lc = la.cholesky(step.H)
+    b = -la.solve_triangular(Lc, np.dot(step.F, x), trans='T')
+    return lsq_linear(Lc, b, bounds=(0, np.tile(step.umax, step.horizon)), tol=1e-12).x
+
+def test_solution_is_constrained_optimum():
+    design = lqg_math.lqg_design()
+    rng = np.random.RandomState(2)
+    nsaturated = 0
+    ninterior = 0
+    for scale in [1e-3, 1e-2, 1.]:
+        step = mpc.MPCStep(design, UMAX, tol=1e-7, max_iter=5000)
+        x = -scale*(1 + 0.1*rng.normal(size=len(design['A_mat'])))
+        u = step.solve(x)
+        assert np.all(step.U >= 0)
+        assert np.all(step.U <= step.upper)
+        assert np.allclose(step.U, exact_solution(step, x), atol=1e-4*np.max(UMAX))
+        nsaturated += np.sum(u == UMAX)
+        ninterior += np.sum((u > 0) & (u < UMAX))
+    #The cases include heaters at the limit and in between.
+    assert nsaturated > 0
+    assert ninterior > 0
+
+def test_unconstrained_matches_lqr():
+    #Without active constraints, MPC with the LQR cost-to-go as its terminal
+    #cost is the LQR itself, for any horizon, when the blocks are one 
+    #timestep each.
+    design = lqg_math.lqg_design()
+    A, B, R, S = design['A_mat'], design['B_mat'], design['R_mat'], design['S_mat']
+    step = mpc.MPCStep(design, 1e12*np.ones(3), horizon=10, horizon_time=0.,
+        tol=1e-9, max_iter=100000)
+    x = np.zeros(len(A))
+    x[3:] = [-1e-3, -2e-3, -1e-3, -1e-3]
+    BtS = np.dot(B.T, S)
+    u_lqr = -np.linalg.solve(R + np.dot(BtS, B), np.dot(np.dot(BtS, A), x))
+    assert np.all(u_lqr > 0)
+    step.U[:] = np.tile(u_lqr, step.horizon)
+    assert np.allclose(step.solve(x), u_lqr, rtol=1e-3)
+
+def test_steady_state_targets():
+    design = lqg_math.lqg_design()
+    A, B, Q = design['A_mat'], design['B_mat'], design['Q_mat']
+    ext = lqg_math.external_states(A, B)
+    assert np.sum(ext) > 0
+    Tx, Tu = mpc.steady_state_targets(A, B, Q)
+    #Ambient etc. 2K below the setpoint.
+    x = np.zeros(len(A))
+    x[ext] = -2.
+    x_target = np.dot(Tx, x)
+    u_target = np.dot(Tu, x)
+    assert np.array_equal(x_target[ext], x[ext])
+    #The targets are a steady state of the internal states.
+    assert np.allclose(x_target[~ext], (np.dot(A, x_target) + np.dot(B, u_target))[~ext])
+    #Heating brings the weighted states closer to the setpoint.
+    assert np.all(u_target > 0)
+    x_free = x.copy()
+    x_free[~ext] = np.linalg.solve(np.eye(np.sum(~ext)) - A[np.ix_(~ext,~ext)], 
+        np.dot(A[np.ix_(~ext,ext)], x[ext]))
+    assert np.dot(x_target, np.dot(Q, x_target)) < np.dot(x_free, np.dot(Q, x_free))
+
+def test_mpc_holds_targets():
+    #Starting at the targets, with the heaters within their limits, the 
+    #solution is to stay there.
+    design = lqg_math.lqg_design()
+    A, B, Q = design['A_mat'], design['B_mat'], design['Q_mat']
+    ext = lqg_math.external_states(A, B)
+    Tx, Tu = mpc.steady_state_targets(A, B, Q)
+    x = np.zeros(len(A))
+    x[ext] = -0.5
+    u_target = np.dot(Tu, x)
+    assert np.all((u_target > 0) & (u_target < UMAX))
+    step = mpc.MPCStep(design, UMAX, tol=1e-9, max_iter=20000)
+    step.U[:] = np.tile(u_target, step.horizon)
+    assert np.allclose(step.solve(np.dot(Tx, x)), u_target, rtol=1e-3)
@@ -0,0 +1,156 @@
+import threading
+import numpy as np
+import pytest
+from veloce import reconnect
+from veloce import thermal_control
+from veloce import fake_ljm
+
+class Connection:
+    """A connect function that fails a given number of times."""
+    def __init__(self, nfailures):
+        self.nfailures = nfailures
+        self.ncalls = 0
+        self.connected = threading.Event()
+    
+    def __call__(self):
+        self.ncalls += 1
+        if self.ncalls <= self.nfailures:
+            raise IOError("Connection refused")
+        self.connected.set()
+
+def test_reconnector_retries_until_connected():
+    connect = Connection(3)
+    r = reconnect.Reconnector(connect, min_delay=0.001, max_delay=0.004)
+    r.start()
+    r.thread.join(5)
+    assert not r.running()
+    assert connect.connected.is_set()
+    assert connect.ncalls == 4
+    assert r.nreconnects == 1
+    assert r.nattempts == 0
+    assert isinstance(r.last_error, IOError)
+
+def test_reconnector_stop():
+    connect = Connection(10**6)
+    r = reconnect.Reconnector(connect, min_delay=0.001, max_delay=0.001)
+    r.start()
+    r.stop()
+    r.thread.join(5)
+    assert not r.running()
+    assert not connect.connected.is_set()
+    assert r.nreconnects == 0
+
+def test_reconnector_start_while_running():
+    connect = Connection(10**6)
+    r = reconnect.Reconnector(connect, min_delay=10, max_delay=10)
+    r.start()
+    thread = r.thread
+    r.start()
+    assert r.thread is thread
+    r.stop()
+    thread.join(5)
+    assert not r.running()
+
+def stop_reconnector(tc):
+    """Stop tc's background reconnection, and re-arm it so that the test can
+    call reconnect by hand."""
+    tc.reconnector.stop()
+    tc.reconnector.thread.join()
+    tc.reconnector.stop_event.clear()
+
+def offline_control(lj):
+    """Make a ThermalControl with the labjack offline, then stop its
+    background reconnection so that the test can reconnect by hand."""
+    lj.offline = True
+    tc = thermal_control.ThermalControl(backend=lj)
+    assert not tc.labjack_open
+    assert tc.handle is None
+    assert tc.reconnector.running()
+    stop_reconnector(tc)
+    return tc
+
+def test_reconnect_after_offline_at_startup():
+    lj = fake_ljm.FakeLJM()
+    tc = offline_control(lj)
+    with pytest.raises(fake_ljm.LJMError):
+        tc.reconnect()
+    lj.offline = False
+    tc.reconnect()
+    assert tc.labjack_open
+    assert lj.handles == set([tc.handle])
+    tc.job_doservo()
+    assert tc.ain_ok.all()
+
+class BrokenClockLJM(fake_ljm.FakeLJM):
+    """Fails reading the PWM clock with an error that isn't an LJMError."""
+    def eReadNames(self, handle, numFrames, aNames):
+        if "DIO_EF_CLOCK0_ENABLE" in aNames:
+            raise RuntimeError("Unexpected failure")
+        return fake_ljm.FakeLJM.eReadNames(self, handle, numFrames, aNames)
+
+def test_failed_reconnect_closes_new_handle():
+    lj = BrokenClockLJM()
+    tc = offline_control(lj)
+    lj.offline = False
+    with pytest.raises(RuntimeError):
+        tc.reconnect()
+    assert not tc.labjack_open
+    assert tc.handle is None
+    assert len(lj.handles) == 0
+
+def test_reconnect_replaces_handle():
+    lj = fake_ljm.FakeLJM()
+    tc = thermal_control.ThermalControl(backend=lj)
+    assert tc.labjack_open
+    old_handle = tc.handle
+    tc.reconnect()
+    assert tc.handle != old_handle
+    assert lj.handles == set([tc.handle])
+
+class CloseWhileOpeningLJM(fake_ljm.FakeLJM):
+    """Runs a CLOSE command while a reconnection is opening the labjack, i.e.
+    after openS and before the reconnection takes io_lock."""
+    tc = None
+    def openS(self, deviceType, connectionType, identifier):
+        handle = fake_ljm.FakeLJM.openS(self, deviceType, connectionType, identifier)
+        if self.tc is not None:
+            closer = threading.Thread(target=self.tc.cmd_close, args=("",))
+            closer.start()
+            closer.join()
+        return handle
+
+def test_close_while_reconnecting():
+    lj = CloseWhileOpeningLJM()
+    tc = offline_control(lj)
+    lj.offline = False
+    lj.tc = tc
+    tc.reconnect()
+    assert not tc.labjack_open
+    assert tc.handle is None
+    assert len(lj.handles) == 0
+
+def test_failed_initialize_hands_over_to_reconnector():
+    lj = fake_ljm.FakeLJM()
+    real_write = lj.eWriteNames
+    def failing_write(*args):
+        raise fake_ljm.LJMError("Simulated failure in eWriteNames")
+    lj.eWriteNames = failing_write
+    tc = thermal_control.ThermalControl(backend=lj)
+    assert not tc.labjack_open
+    assert tc.reconnector.running()
+    stop_reconnector(tc)
+    lj.eWriteNames = real_write
+    tc.reconnect()
+    assert tc.labjack_open
+
+def test_servo_with_failures():
+    #Failures can hit the setup writes as well as the servo ticks.
+    for seed in range(5):
+        lj = fake_ljm.FakeLJM(failure_rate=0.2, seed=seed)
+        tc = thermal_control.ThermalControl(backend=lj)
+        tc.cmd_lqgstart("")
+        for i in range(50):
+            tc.job_doservo()
+        tc.reconnector.stop()
+        assert np.all(np.isfinite(tc.get_snapshot()['heaters']))
+        assert np.all(np.isfinite(tc.x_est))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from veloce import replay
+from veloce import thermal_control
+
+def test_replay_with_failures():
+    #Failures can hit the setup writes as well as the servo ticks.
+    for seed in range(5):
+        history = replay.replay("lqg cryo", duration=60., logfile=None, 
+            failure_rate=0.2, seed=seed)
+        assert np.all(np.isfinite(history['true_temps']))
+
+def test_replay_stops_reconnector_on_error(monkeypatch):
+    controls = []
+    def failing_servo(self):
+        controls.append(self)
+        raise RuntimeError("Servo failure")
+    monkeypatch.setattr(thermal_control.ThermalControl, 'lqg_servo', failing_servo)
+    #With every call failing, the labjack never opens, so the reconnector runs.
+    with pytest.raises(RuntimeError):
+        replay.replay("lqg", duration=10., logfile=None, failure_rate=1.0, seed=0)
+    assert len(controls) == 1
+    reconnector = controls[0].reconnector
+    assert reconnector.stop_event.is_set()
+    reconnector.thread.join(5)
+    assert not reconnector.running()
+
+def rms(history, ix, settle_time, setpoint=25.):
+    settled = history['time'] >= settle_time
+    return np.sqrt(np.mean((history['true_temps'][settled,ix] - setpoint)**2))
+
+def test_mpc_holds_setpoint():
+    history = replay.replay("mpc", duration=1800., logfile=None, initial_temp=25., 
+        noise=0.0005, seed=1)
+    #Table and cryostat.
+    assert rms(history, 0, 450.) < 0.05
+    assert rms(history, 3, 450.) < 0.2
+
+def test_reduced_model_holds_setpoint(monkeypatch):
+    monkeypatch.setattr(thermal_control, "LQG_HSV_CUTOFF", 1e-3)
+    history = replay.replay("lqg", duration=1800., logfile=None, initial_temp=25., 
+        noise=0.0005, seed=1)
+    assert rms(history, 0, 450.) < 0.075
+    assert rms(history, 3, 450.) < 0.04
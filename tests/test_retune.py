@@ -0,0 +1,100 @@
+import time
+import numpy as np
+from veloce import thermal_control
+from veloce import fake_ljm
+from veloce import lqg_math
+from veloce.server.scheduler import PeriodicJob
+
+def wait_for_design(tc, timeout=30.):
+    """Wait for the worker thread started by a retune command to finish."""
+    t0 = time.time()
+    while time.time() < t0 + timeout:
+        with tc.state_lock:
+            if tc.pending_design is not None or tc.design_error is not None:
+                return
+        time.sleep(0.01)
+    raise AssertionError("LQG design not computed")
+
+def make_control():
+    tc = thermal_control.ThermalControl(backend=fake_ljm.FakeLJM())
+    tc.cmd_lqgstart("")
+    tc.job_doservo()
+    return tc
+
+def test_setq_swaps_design_and_keeps_estimate():
+    tc = make_control()
+    old_design = tc.lqg_design
+    assert tc.cmd_setq("SETQ 3 2.5") == "Computing new LQG design..."
+    wait_for_design(tc)
+    #Nothing changes until the next tick.
+    assert tc.lqg_design is old_design
+    assert "being computed" in tc.cmd_lqgstatus("")
+    x_est = tc.x_est.copy()
+    tc.swap_design()
+    assert tc.lqg_design['Q_mat'][3,3] == 2.5
+    assert tc.lqg_design['generation'] == tc.design_generation
+    assert np.array_equal(tc.x_est, x_est)
+    assert "being computed" not in tc.cmd_lqgstatus("")
+    expected = tc.make_design(tc.lqg_params)
+    assert np.allclose(tc.lqg_design['L_mat'], expected['L_mat'])
+    tc.job_doservo()
+    assert np.all(np.isfinite(tc.x_est))
+
+def test_setdt_changes_servo_period():
+    tc = make_control()
+    tc.servo_job = PeriodicJob(tc.job_doservo, tc.dt)
+    tc.cmd_setdt("SETDT 0.6")
+    wait_for_design(tc)
+    tc.swap_design()
+    assert tc.dt == 0.6
+    assert tc.servo_job.period == 0.6
+    assert "0.600" in tc.cmd_lqgstatus("")
+
+def test_older_design_is_discarded():
+    tc = make_control()
+    tc.cmd_setr("SETR 0 0.5")
+    tc.cmd_setr("SETR 1 0.7")
+    wait_for_design(tc)
+    #The first design may finish last, but is never used.
+    time.sleep(0.5)
+    tc.swap_design()
+    assert tc.lqg_design['R_mat'][0,0] == 0.5
+    assert tc.lqg_design['R_mat'][1,1] == 0.7
+    assert tc.lqg_design['generation'] == 2
+
+def test_failed_design_is_reported(monkeypatch):
+    tc = make_control()
+    old_design = tc.lqg_design
+    def failing_design(**params):
+        raise np.linalg.LinAlgError("Riccati solver failed")
+    monkeypatch.setattr(lqg_math, 'lqg_design', failing_design)
+    tc.cmd_setnoise("SETNOISE 0.1 0.001")
+    wait_for_design(tc)
+    tc.swap_design()
+    assert tc.lqg_design is old_design
+    assert "Last design failed: Riccati solver failed" in tc.cmd_lqgstatus("")
+
+def test_setreduction_switches_model():
+    tc = make_control()
+    nfull = len(tc.x_est)
+    tc.cmd_setreduction("SETREDUCTION 0.001")
+    wait_for_design(tc)
+    tc.swap_design()
+    assert tc.lqg_design['hsv_cutoff'] == 0.001
+    assert len(tc.x_est) == len(tc.lqg_design['A_cont']) < nfull
+    assert "balanced truncation" in tc.cmd_lqgstatus("")
+    tc.job_doservo()
+    tc.cmd_setreduction("SETREDUCTION 0")
+    wait_for_design(tc)
+    tc.swap_design()
+    assert len(tc.x_est) == nfull
+    assert "Model: lqg_math" in tc.cmd_lqgstatus("")
+
+def test_retune_command_errors():
+    tc = make_control()
+    assert tc.cmd_setq("SETQ 3").startswith("Useage")
+    assert tc.cmd_setq("SETQ 100 1").startswith("ERROR")
+    assert tc.cmd_setr("SETR x 1").startswith("ERROR")
+    assert tc.cmd_setdt("SETDT -1").startswith("ERROR")
+    assert tc.cmd_setreduction("SETREDUCTION -1").startswith("ERROR")
+    assert tc.design_generation == 0
@@ -0,0 +1,45 @@
+from veloce.server.scheduler import PeriodicJob
+
+class StepClock:
+    """A clock that only moves when set."""
+    def __init__(self):
+        self.t = 100.
+    def __call__(self):
+        return self.t
+
+def make_job(period=1.):
+    clock = StepClock()
+    runs = []
+    job = PeriodicJob(lambda: runs.append(clock.t), period, clock=clock)
+    return job, clock, runs
+
+def test_deadlines_do_not_drift():
+    job, clock, runs = make_job()
+    job.run()
+    #Starting each run a little late doesn't move later deadlines.
+    for i in range(1, 5):
+        clock.t = 100. + i + 0.3
+        message, missed = job.run()
+        assert missed == 0
+        assert job.next_deadline == 100. + i + 1
+    assert job.nruns == 5
+    assert abs(job.max_jitter - 0.3) < 1e-9
+
+def test_late_run_skips_missed_deadlines():
+    job, clock, runs = make_job()
+    job.run()
+    clock.t = 103.5
+    message, missed = job.run()
+    #Deadlines at 101, 102 and 103 have passed: 101 is this run, 102 and 103
+    #are skipped, and the next is 104.
+    assert missed == 2
+    assert job.nmissed == 2
+    assert job.next_deadline == 104.
+    assert len(runs) == 2
+
+def test_time_to_deadline():
+    job, clock, runs = make_job(0.5)
+    assert job.time_to_deadline() == 0.
+    job.run()
+    clock.t = 100.2
+    assert abs(job.time_to_deadline() - 0.3) < 1e-9
@@ -0,0 +1,15 @@
+import numpy as np
+from veloce import simulator
+
+def test_output_cadence_does_not_change_states():
+    #The model is discretised exactly, so sampling less often gives the same
+    #states at the common times.
+    times, xvalues, yvalues = simulator.simulate(t_end=1000, dt=1.0)
+    coarse_times, coarse_x, coarse_y = simulator.simulate(t_end=1000, dt=10.0)
+    assert np.allclose(coarse_times, times[::10])
+    assert np.allclose(coarse_x, xvalues[:,::10], rtol=1e-10, atol=1e-10)
+    assert np.allclose(coarse_y, yvalues[:,::10], rtol=1e-10, atol=1e-10)
+    #The ambient follows its sinusoid.
+    expected = simulator.ambient_mean + simulator.ambient_amplitude* \
+        np.sin(2*np.pi*times/simulator.ambient_period)
+    assert np.allclose(xvalues[0], expected, atol=1e-9)
@@ -0,0 +1,21 @@
+import numpy as np
+from veloce import thermal_model
+
+def test_models_are_cached_and_read_only():
+    constants = thermal_model.default_constants()
+    A, B, C = thermal_model.enclosure_model(constants)
+    assert thermal_model.enclosure_model(constants.copy())[0] is A
+    for array in (A, B, C):
+        assert not array.flags.writeable
+    #Different constants give a new model.
+    constants[0] *= 2
+    assert not np.array_equal(thermal_model.enclosure_model(constants)[0], A)
+
+def test_lqg_enclosure_model_elements():
+    A, B, C = thermal_model.lqg_enclosure_model()
+    assert A.shape == (7,7) and B.shape == (7,3) and C.shape == (4,7)
+    A2, B2, C2 = thermal_model.lqg_enclosure_model({'g12': 2*thermal_model.LQG_MODEL_ELEMENTS['g12']})
+    #Only the lid and table rows depend on the lid to table coupling.
+    changed = np.flatnonzero(np.any(A2 != A, axis=1))
+    assert list(changed) == [3, 4]
+    assert np.array_equal(B2, B) and np.array_equal(C2, C)
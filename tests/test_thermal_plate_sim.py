@@ -0,0 +1,15 @@
+import numpy as np
+import thermal_plate_sim
+
+def test_ensemble_matches_exact_rms():
+    lqg_rms, p_rms = thermal_plate_sim.ensemble(n_ensemble=100, n_t=20000, seed=0)
+    assert lqg_rms.shape == p_rms.shape == (100,)
+    #Removing the mean of each history makes the mean square slightly low.
+    assert np.isclose(np.mean(lqg_rms**2), thermal_plate_sim.exact_rms(True)**2, rtol=0.05)
+    assert np.isclose(np.mean(p_rms**2), thermal_plate_sim.exact_rms(False)**2, rtol=0.05)
+
+def test_ensemble_is_reproducible():
+    first = thermal_plate_sim.ensemble(n_ensemble=10, n_t=1000, noise_block=300, seed=1)
+    second = thermal_plate_sim.ensemble(n_ensemble=10, n_t=1000, noise_block=300, seed=1)
+    assert np.array_equal(first[0], second[0])
+    assert np.array_equal(first[1], second[1])
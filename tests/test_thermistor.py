@@ -0,0 +1,44 @@
+import numpy as np
+from veloce import thermistor
+from veloce import thermal_control
+
+def exact_temps(voltages, offsets):
+    resistances = thermistor.bridge_resistances(voltages)
+    return thermistor.steinhart_hart(resistances) - offsets
+
+def test_table_matches_steinhart_hart():
+    offsets = thermal_control.T_OFFSETS
+    table = thermistor.ThermistorTable(offsets=offsets)
+    temps = np.linspace(thermistor.TABLE_TMIN, thermistor.TABLE_TMAX, 2001)
+    temps = np.tile(temps, (len(offsets), 1)).T + offsets
+    voltages = thermistor.bridge_voltages(thermistor.steinhart_hart_resistances(temps))
+    error = table.temps(voltages) - exact_temps(voltages, offsets)
+    assert np.max(np.abs(error)) <= thermistor.TABLE_TOL
+
+def test_table_outside_range_is_exact():
+    table = thermistor.ThermistorTable()
+    temps = np.array([-45., 95.])
+    voltages = thermistor.bridge_voltages(thermistor.steinhart_hart_resistances(temps))
+    assert np.allclose(table.temps(voltages, channel=0), temps, atol=1e-9)
+
+def test_resistance_table():
+    table = thermistor.ThermistorTable(domain='resistance')
+    resistances = thermistor.steinhart_hart_resistances(np.linspace(0, 50, 101))
+    error = table.temps(resistances, channel=0) - thermistor.steinhart_hart(resistances)
+    assert np.max(np.abs(error)) <= thermistor.TABLE_TOL
+
+def test_calibration_fitted_temps_match_per_sample_loop():
+    import calibration
+    resistances = thermistor.steinhart_hart_resistances(np.linspace(5, 40, 50))
+    pvals = np.zeros((3,6))
+    for y in range(5):
+        pvals[:,y] = [calibration.defA*(1 + 1e-3*y), calibration.defB, calibration.defC*(1 - 1e-2*y)]
+    temps = calibration.fitted_temps(resistances, pvals)
+    expected = np.zeros_like(temps)
+    with np.errstate(divide='ignore'):
+        for y in range(6):
+            for i, res in enumerate(resistances):
+                expected[y,i] = calibration.thermistor_eqn(res, pvals[0,y], pvals[1,y], pvals[2,y])
+    assert np.allclose(temps[:5], expected[:5], atol=thermistor.TABLE_TOL, rtol=0)
+    #The column of zero constants that was never fitted gives inf, as before.
+    assert np.all(np.isinf(temps[5])) and np.all(np.isinf(expected[5]))
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from veloce import lqg_math
+from veloce import thermal_control
+from veloce import tuning
+
+DURATION = 3600.
+
+def reference_lqg(candidate, duration=DURATION, dt=lqg_math.lqg_dt, ambient=-3.0,
+    random_rate=tuning.EXTERNAL_RANDOM_RATE, seed=0):
+    """simulate_batch for a single LQG candidate, written as a plain loop over
+    timesteps with an LQGStep."""
+    rng = np.random.RandomState(seed)
+    A, B = lqg_math.discretise(lqg_math.A_cont, lqg_math.B_cont, dt)
+    C = lqg_math.C_mat
+    nsteps = int(duration/dt)
+    nsettle = int(tuning.SETTLE_FRACTION*nsteps)
+    process_noise = random_rate*np.sqrt(dt)*rng.normal(size=(nsteps, len(tuning.EXTERNAL_STATES)))
+    measurement_noise = lqg_math.T_NOISE_RATE*dt*rng.normal(size=(nsteps, len(C)))
+    step = tuning.lqg_step(candidate, dt)
+    x = np.zeros(A.shape[0])
+    x[tuning.EXTERNAL_STATES] = ambient
+    table = []
+    duty = []
+    for i in range(nsteps):
+        step.y[:] = np.dot(C, x) + measurement_noise[i]
+        step.update()
+        x = np.dot(A, x) + np.dot(B, step.u)
+        x[tuning.EXTERNAL_STATES] += process_noise[i]
+        if i >= nsettle:
+            table.append(x[tuning.TABLE_STATE])
+            duty.append(step.u/step.umax)
+    return np.sqrt(np.mean(np.square(table))), np.mean(duty, axis=0)
+
+def test_lqg_batch_matches_single_candidate_loop():
+    candidates = tuning.grid("lqg", q_table=[100,10000], r=[0.01,1])
+    table_rms, duty = tuning.simulate_batch("lqg", candidates, duration=DURATION)
+    for k, candidate in enumerate(candidates):
+        ref_rms, ref_duty = reference_lqg(candidate)
+        assert np.isclose(table_rms[k], ref_rms, rtol=1e-9)
+        assert np.allclose(duty[k], ref_duty, rtol=1e-9, atol=1e-12)
+    #The candidates differ, so they shouldn't all give the same result.
+    assert np.ptp(table_rms) > 0
+
+def test_batch_matches_candidates_one_at_a_time():
+    for servo, candidates in [
+        ("lqg", tuning.random_sample("lqg", 3, seed=1, q_table=(100,10000), r=(0.01,1))),
+        ("pid", tuning.random_sample("pid", 3, seed=1, pid_gain_hz=(0.0005,0.01),
+            nested_gain=(1,30)))]:
+        table_rms, duty = tuning.simulate_batch(servo, candidates, duration=DURATION)
+        for k, candidate in enumerate(candidates):
+            single_rms, single_duty = tuning.simulate_batch(servo, [candidate],
+                duration=DURATION)
+            assert np.isclose(table_rms[k], single_rms[0], rtol=1e-9)
+            assert np.allclose(duty[k], single_duty[0], rtol=1e-9, atol=1e-12)
+
+def test_pid_defaults_match_thermal_control():
+    candidate = tuning.make_candidate("pid")
+    assert candidate['pid_gain_hz'] == thermal_control.PID_GAIN_HZ
+    assert candidate['nested_gain'] == thermal_control.NESTED_GAIN
+
+def test_import_does_not_open_log(tmp_path):
+    #Each process pool worker imports thermal_control, which shouldn't create
+    #a log file.
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    subprocess.check_call([sys.executable, "-c", "import veloce.tuning"],
+        cwd=str(tmp_path), env=env)
+    assert not os.path.exists(str(tmp_path/thermal_control.LOG_FILENAME))
@@ -8,6 +8,7 @@ from __future__ import print_function, division
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy.linalg as la
+from veloce import lqg_math
 
 #Define thermal conductivities. Units: Watts/K.
 G_sa = 1.0
@@ -42,6 +43,12 @@ n_t = 10000
 #For comparision, a simple proportional servo
 servo_gain = 25 #Optimised by hand - applies to use_lqg=False
 use_lqg=0
+
+#Number of independent realisations for the ensemble comparison of the LQG and
+#proportional servos, or 0 for just the single trajectory. Noise is drawn for
+#noise_block timesteps at a time.
+n_ensemble = 1000
+noise_block = 500
 #------automatic below here------
 
 #Define the matrices. Note that the vector has T_a then T_p
@@ -67,41 +74,148 @@ K_mat = np.dot(np.dot(P_mat, C_mat.T),
 L_mat = np.dot(np.linalg.inv(np.dot(np.dot(B_mat.T, S_mat),B_mat)),
     np.dot(np.dot(B_mat.T, S_mat),A_mat))
 
-#We need to store both the actual and estimated values for x
-x = np.array([0.,0.])
-x_history = np.empty( (n_t, 2) )
-x_est = np.array([0.,0.])
-x_est_history = np.empty( (n_t, 2) )
-u = np.array([0])
-u_history = np.empty( n_t )
-for i in range(n_t):
-    #Compute our estimator for x_{i+1}
-    #First, what do we measure at this time?
-    y = np.dot(C_mat, x) 
-    y += np.random.multivariate_normal([0], W_mat)
-    
-    #Based on this measurement, what is the next value of x_est?
-    x_est_new = np.dot(A_mat, x_est)
-    x_est_new += np.dot(B_mat, u)
-    dummy = y - np.dot(C_mat, (np.dot(A_mat, x) + np.dot(B_mat, u)))
-    x_est_new += np.dot(K_mat, dummy)
-    x_est = x_est_new
-    x_est_history[i]=x_est
+def exact_rms(lqg):
+    """The exact steady-state RMS plate temperature of the loop simulated in 
+    the main script and by ensemble, for the LQG servo if lqg is True and
+    the proportional servo otherwise.
     
-    # Now find u
-    if use_lqg:
-        u = -np.dot(L_mat, x_est)
+    This solves the discrete Lyapunov equation for the combined [x; x_est] 
+    (see lqg_math.stationary_covariance). As written, the loop steps the plant 
+    by x_{i+1} = (I + A) x_i + B u_{i+1} + w_i, and the estimator predicts 
+    from the true x_i, so that 
+    x_est_{i+1} = K (C - CA) x_i + (A - BL + KCBL) x_est_i + K v_i.
+    """
+    I_2 = np.eye(2)
+    if lqg:
+        BL = np.dot(B_mat, L_mat)
+        est_x = np.dot(K_mat, C_mat - np.dot(C_mat, A_mat))
+        est_est = A_mat - BL + np.dot(np.dot(K_mat, C_mat), BL)
+        Phi = np.vstack((np.hstack((I_2 + A_mat - np.dot(BL, est_x), -np.dot(BL, est_est))),
+                         np.hstack((est_x, est_est))))
+        G = np.vstack((np.hstack((I_2, -np.dot(BL, K_mat))),
+                       np.hstack((np.zeros( (2,2) ), K_mat))))
     else:
-        u = -servo_gain*y
-    u_history[i] = u
-
-    #Compute the actual x_i+1
-    x += np.dot(A_mat, x)
-    x += np.dot(B_mat, u)
-    x += np.random.multivariate_normal([0,0], V_mat)
-  
-    #Save our history.
-    x_history[i]=x
+        Phi = I_2 + A_mat - servo_gain*np.dot(B_mat, C_mat)
+        G = np.hstack((I_2, -servo_gain*B_mat))
+    Sigma = lqg_math.stationary_covariance(Phi, np.dot(np.dot(G, la.block_diag(V_mat, W_mat)), G.T))
+    return np.sqrt(Sigma[1,1])
+
+def ensemble(n_ensemble=n_ensemble, n_t=n_t, noise_block=noise_block, seed=None):
+    """Simulate an ensemble of realisations of the LQG and proportional servos.
+    
+    This is the same recurrence as the single trajectory in the main script, 
+    with every realisation stepped together. The rows of the state are the 
+    realisations for the LQG servo then the same number for the proportional 
+    servo, and both servos see the same noise so that they can be compared 
+    directly.
+    
+    Parameters
+    ----------
+    n_ensemble: int (optional)
+        Number of realisations of each servo.
+    n_t: int (optional)
+        Number of timesteps.
+    noise_block: int (optional)
+        Number of timesteps to draw the noise for at a time.
+    seed: int (optional)
+        Random number seed.
+    
+    Returns
+    -------
+    lqg_rms, p_rms: numpy array
+        The RMS plate temperature about its mean, as for the single 
+        trajectory, of each LQG and proportional servo realisation.
+    """
+    rng = np.random.RandomState(seed)
+    lqg_rows = slice(0, n_ensemble)
+    p_rows = slice(n_ensemble, 2*n_ensemble)
+    x = np.zeros( (2*n_ensemble, 2) )
+    x_est = np.zeros( (2*n_ensemble, 2) )
+    u = np.zeros( (2*n_ensemble, 1) )
+    #Running sums for the RMS plate temperature of each realisation.
+    x_sum = np.zeros(2*n_ensemble)
+    x_sumsq = np.zeros(2*n_ensemble)
+    for i in range(n_t):
+        if i % noise_block == 0:
+            n_block = min(noise_block, n_t - i)
+            W_noise = rng.multivariate_normal([0], W_mat, size=(n_block, n_ensemble))
+            V_noise = rng.multivariate_normal([0,0], V_mat, size=(n_block, n_ensemble))
+            W_noise = np.concatenate((W_noise, W_noise), axis=1)
+            V_noise = np.concatenate((V_noise, V_noise), axis=1)
+        y = np.dot(x, C_mat.T) + W_noise[i % noise_block]
+        
+        #A x and B u are each used twice below.
+        Ax = np.dot(x, A_mat.T)
+        Bu = np.dot(u, B_mat.T)
+        x_est_new = np.dot(x_est, A_mat.T)
+        x_est_new += Bu
+        dummy = y - np.dot(Ax + Bu, C_mat.T)
+        x_est_new += np.dot(dummy, K_mat.T)
+        x_est = x_est_new
+        
+        u[lqg_rows] = -np.dot(x_est[lqg_rows], L_mat.T)
+        u[p_rows] = -servo_gain*y[p_rows]
+        
+        x += Ax
+        x += np.dot(u, B_mat.T)
+        x += V_noise[i % noise_block]
+        
+        x_sum += x[:,1]
+        x_sumsq += x[:,1]**2
+    
+    #The RMS about the mean of each history, as for np.std.
+    rms = np.sqrt(np.maximum(x_sumsq/n_t - (x_sum/n_t)**2, 0))
+    return rms[lqg_rows], rms[p_rows]
+
+if __name__ == "__main__":
+    print("Exact RMS plate temperature: {0:6.4f}".format(exact_rms(use_lqg)))
+    
+    #We need to store both the actual and estimated values for x
+    x = np.array([0.,0.])
+    x_history = np.empty( (n_t, 2) )
+    x_est = np.array([0.,0.])
+    x_est_history = np.empty( (n_t, 2) )
+    u = np.array([0])
+    u_history = np.empty( n_t )
+    for i in range(n_t):
+        #Compute our estimator for x_{i+1}
+        #First, what do we measure at this time?
+        y = np.dot(C_mat, x) 
+        y += np.random.multivariate_normal([0], W_mat)
+        
+        #Based on this measurement, what is the next value of x_est?
+        x_est_new = np.dot(A_mat, x_est)
+        x_est_new += np.dot(B_mat, u)
+        dummy = y - np.dot(C_mat, (np.dot(A_mat, x) + np.dot(B_mat, u)))
+        x_est_new += np.dot(K_mat, dummy)
+        x_est = x_est_new
+        x_est_history[i]=x_est
+        
+        # Now find u
+        if use_lqg:
+            u = -np.dot(L_mat, x_est)
+        else:
+            u = -servo_gain*y
+        u_history[i] = u[0]
+    
+        #Compute the actual x_i+1
+        x += np.dot(A_mat, x)
+        x += np.dot(B_mat, u)
+        x += np.random.multivariate_normal([0,0], V_mat)
+      
+        #Save our history.
+        x_history[i]=x
+        
+    #Now what is our RMS?
+    print("Simulated RMS plate temperature: {0:6.4f}".format(np.std(x_history[:,1]))) 
     
-#Now what is our RMS?
-print("RMS plate temperature: {0:6.4f}".format(np.std(x_history[:,1]))) 
+    if n_ensemble > 0:
+        lqg_rms, p_rms = ensemble()
+        print("Ensemble of {0:d} realisations:".format(n_ensemble))
+        for label, lqg, servo_rms in [("LQG", True, lqg_rms), ("Proportional", False, p_rms)]:
+            low, median, high = np.percentile(servo_rms, [2.5, 50, 97.5])
+            print("{0:>12s} RMS plate temperature: mean {1:7.5f} +/- {2:7.5f}, median {3:7.5f}, 95% range {4:7.5f} to {5:7.5f}, exact {6:7.5f}".format(
+                label, np.mean(servo_rms), 1.96*np.std(servo_rms)/np.sqrt(n_ensemble), median, low, high, exact_rms(lqg)))
+        difference = lqg_rms - p_rms
+        print("LQG - Proportional: {0:7.5f} +/- {1:7.5f} (95% confidence)".format(
+            np.mean(difference), 1.96*np.std(difference)/np.sqrt(n_ensemble)))
@@ -2,7 +2,8 @@
 __author__ = "Michael Ireland <michael.ireland@anu.edu.au>"
 __Version__ = "0.1"
 
-from server import server_zmq_socket as server
-import thermal_control
-import thermal_control_cmds
-import lqg_math
+from .server import server_zmq_socket as server
+from . import thermal_control
+from . import thermal_control_cmds
+from . import lqg_math
+from . import thermistor
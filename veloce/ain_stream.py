@@ -0,0 +1,133 @@
+"""Continuous sampling of the thermistor analog inputs using LJM stream mode.
+
+The labjack scans every channel at STREAM_SCAN_RATE, and LJM calls back into
+this module (from its own thread) each time STREAM_SCANS_PER_READ scans are
+ready. The scans are kept in a ring buffer, and every servo tick averages all
+of the scans that arrived since the previous tick. This gives a much lower
+noise per tick than a single command-response read, with no extra latency.
+"""
+from __future__ import print_function, division
+import threading
+import numpy as np
+try:
+    from labjack import ljm
+except ImportError:
+    ljm = None
+
+#Scans per second, where each scan samples every channel once. At resolution
+#index 8, 7 channels take roughly 10ms to scan.
+STREAM_SCAN_RATE = 50.0
+STREAM_SCANS_PER_READ = 10
+STREAM_RESOLUTION_INDEX = 8
+#Number of scans kept in the ring buffer. This only has to be longer than the
+#longest expected gap between servo ticks.
+STREAM_BUFFER_SCANS = 4096
+#LJM inserts this value for samples that were skipped after a buffer overflow.
+STREAM_DUMMY_VALUE = -9999.0
+
+class AINStream:
+    def __init__(self, handle, ain_names, scan_rate=STREAM_SCAN_RATE,
+        scans_per_read=STREAM_SCANS_PER_READ, buffer_scans=STREAM_BUFFER_SCANS,
+        backend=None):
+        """Stream a list of analog inputs into a ring buffer.
+
+        Parameters
+        ----------
+        handle: int
+            An open labjack handle.
+        ain_names: list of strings
+            The analog inputs to scan, e.g. ["AIN0", "AIN2"]
+        scan_rate: float (optional)
+            Requested scans per second. The labjack may choose a slightly
+            different rate, which is stored in self.scan_rate on start().
+        scans_per_read: int (optional)
+            Number of scans LJM collects before calling back.
+        buffer_scans: int (optional)
+            Length of the ring buffer in scans.
+        backend: module or object (optional)
+            Provides the labjack.ljm functions. Defaults to the real LJM library.
+        """
+        self.ljm = backend if backend is not None else ljm
+        self.handle = handle
+        self.ain_names = list(ain_names)
+        self.nchan = len(self.ain_names)
+        self.scan_rate = scan_rate
+        self.scans_per_read = scans_per_read
+        self.buffer = np.zeros( (buffer_scans, self.nchan) )
+        self.lock = threading.Lock()
+        #Total number of scans written to, and consumed from, the ring buffer.
+        self.nscans = 0
+        self.nread = 0
+        #Number of scans that were overwritten before they could be averaged.
+        self.noverrun = 0
+        self.device_backlog = 0
+        self.ljm_backlog = 0
+        self.error = None
+        self.running = False
+
+    def start(self):
+        """Configure and start the stream, and register our callback."""
+        aScanList = self.ljm.namesToAddresses(self.nchan, self.ain_names)[0]
+        aNames = ["STREAM_TRIGGER_INDEX", "STREAM_CLOCK_SOURCE",
+            "STREAM_RESOLUTION_INDEX", "STREAM_SETTLING_US"]
+        aValues = [0, 0, STREAM_RESOLUTION_INDEX, 0]
+        self.ljm.eWriteNames(self.handle, len(aNames), aNames, aValues)
+        self.scan_rate = self.ljm.eStreamStart(self.handle, self.scans_per_read,
+            self.nchan, aScanList, self.scan_rate)
+        self.error = None
+        self.running = True
+        self.ljm.setStreamCallback(self.handle, self._callback)
+        return self.scan_rate
+
+    def stop(self):
+        """Stop the stream. Errors are ignored, as the connection may already be
+        gone."""
+        self.running = False
+        try:
+            self.ljm.eStreamStop(self.handle)
+        except self.ljm.LJMError:
+            pass
+
+    def _callback(self, handle):
+        """Called by LJM in its own thread when scans_per_read scans are ready."""
+        if not self.running:
+            return
+        try:
+            aData, self.device_backlog, self.ljm_backlog = self.ljm.eStreamRead(handle)
+        except self.ljm.LJMError as e:
+            #We can't raise here, so leave the error for the servo loop.
+            self.error = e
+            self.running = False
+            return
+        scans = np.reshape(aData, (-1, self.nchan))
+        nbuf = self.buffer.shape[0]
+        with self.lock:
+            ix = np.arange(self.nscans, self.nscans + scans.shape[0]) % nbuf
+            self.buffer[ix] = scans
+            self.nscans += scans.shape[0]
+
+    def average(self):
+        """Average all scans that arrived since the last call.
+
+        Returns
+        -------
+        voltages: numpy float array
+            The mean voltage for each channel, or NaN for a channel with no
+            valid samples.
+        nsamples: numpy int array
+            The number of samples averaged for each channel.
+        """
+        nbuf = self.buffer.shape[0]
+        with self.lock:
+            nnew = self.nscans - self.nread
+            if nnew > nbuf:
+                self.noverrun += nnew - nbuf
+                nnew = nbuf
+            ix = np.arange(self.nscans - nnew, self.nscans) % nbuf
+            scans = self.buffer[ix]
+            self.nread = self.nscans
+        valid = scans != STREAM_DUMMY_VALUE
+        nsamples = np.sum(valid, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            voltages = np.sum(np.where(valid, scans, 0), axis=0)/nsamples
+        return voltages, nsamples
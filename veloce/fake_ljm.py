@@ -0,0 +1,324 @@
+"""An in-process stand-in for the labjack.ljm functions used by thermal_control,
+so that the servo and server can be run and profiled without hardware.
+
+Heater writes drive the enclosure model in thermal_model (plus a simple
+cryostat, coupled to the optical table), which is propagated exactly from one
+call to the next with the heater powers held constant in between. Analog input
+reads return the bridge voltages of the modelled thermistor temperatures.
+
+Every call can be given a latency, and calls can be made to fail at random,
+for a number of calls, or for as long as the device is "offline", to exercise
+the retry and reconnection paths. 
+
+Stream mode is simulated too, but LJM's callbacks are not made from a thread 
+of their own: deliver_stream makes every callback that is due by the current 
+time, so tests can control exactly when scans arrive. Streamed scans sample 
+the model at the time they are read. For example:
+
+    from veloce import thermal_control, fake_ljm
+    lj = fake_ljm.FakeLJM(latency=0.002, failure_rate=0.01)
+    tc = thermal_control.ThermalControl(backend=lj)
+"""
+from __future__ import print_function, division
+import time
+import threading
+import collections
+import numpy as np
+
+from . import thermal_control
+from . import thermal_model
+from . import thermistor
+from . import lti
+from .ain_stream import STREAM_DUMMY_VALUE
+
+#Full power of the cryostat heater in W.
+CRYO_HEATER_POWER = thermal_control.HEATER_MAX[2]
+#Relative change in the timestep below which the discretised model is re-used.
+ZOH_DT_RTOL = 1e-9
+#Modbus address of AIN0, the spacing of the analog input addresses, and the
+#LJM data type of their values (FLOAT32).
+AIN_ADDRESS = 0
+AIN_ADDRESS_STEP = 2
+AIN_DATA_TYPE = 3
+
+class LJMError(Exception):
+    pass
+
+class FakeLJM:
+    LJMError = LJMError
+
+    def __init__(self, constants=None, ambient=22.0, initial_temp=None, noise=0.,
+        latency=0., latency_jitter=0., failure_rate=0., speedup=1., clock=time.time,
+        sleep=time.sleep, seed=None):
+        """A simulated labjack, connected to a simulated enclosure.
+
+        Parameters
+        ----------
+        constants: numpy array (optional)
+            Enclosure model constants. Defaults to thermal_model.default_constants().
+        ambient: float (optional)
+            The (constant) ambient temperature in Celcius.
+        initial_temp: float (optional)
+            The initial temperature of everything else. Defaults to ambient.
+        noise: float (optional)
+            RMS noise in K added to every temperature read.
+        latency, latency_jitter: float (optional)
+            The mean time in seconds that each call takes, and the RMS of a
+            random variation around this.
+        failure_rate: float (optional)
+            Probability that any call raises an LJMError.
+        speedup: float (optional)
+            The number of simulated seconds per second of clock time.
+        clock, sleep: function (optional)
+            Functions returning the time and waiting, in seconds.
+        seed: int (optional)
+            Seed for the noise, latency and failure random numbers.
+        """
+        if constants is None:
+            constants = thermal_model.default_constants()
+        if initial_temp is None:
+            initial_temp = ambient
+        #The enclosure, with the cryostat as an extra state and input.
+        self.A, self.B, self.C = thermal_model.plant_model(constants)
+        n, m = self.B.shape
+        self.x = initial_temp*np.ones(n)
+        self.x[0] = ambient
+        self.u = np.zeros(m)
+
+        self.noise = noise
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.speedup = speedup
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = np.random.RandomState(seed)
+        self.lock = threading.RLock()
+        self.registers = {}
+        self.handles = set()
+        self.next_handle = 1
+        #When offline, every call fails. Otherwise, the next nfail calls fail.
+        self.offline = False
+        self.nfail = 0
+        #The running stream (see eStreamStart), and the number of streamed 
+        #scans still to be replaced by dummy values (see overflow_next).
+        self.stream = None
+        self.noverflow = 0
+        #Number of calls to each function, and the number that failed.
+        self.ncalls = collections.Counter()
+        self.nfailures = collections.Counter()
+        self.clock_start = clock()
+        self.model_time = 0.
+        #The last discretised model, and its timestep.
+        self.zoh_dt = None
+
+    def fail_next(self, ncalls):
+        """Make the next ncalls calls fail."""
+        self.nfail = ncalls
+
+    def overflow_next(self, nscans):
+        """Replace the next nscans streamed scans with STREAM_DUMMY_VALUE, as
+        LJM does for the scans lost when the stream buffer overflows."""
+        self.noverflow = nscans
+
+    def power_cycle(self):
+        """Simulate the labjack rebooting: all handles become invalid, all
+        registers (including the PWM setup) are reset and any stream stops."""
+        with self.lock:
+            self._advance()
+            self.handles = set()
+            self.registers = {}
+            self.stream = None
+            self._update_inputs()
+
+    def deliver_stream(self):
+        """Call the stream callback once for every block of scans that is 
+        due by now, as LJM would from its own thread.
+        
+        Returns
+        -------
+        ncallbacks: int
+            The number of callbacks made.
+        """
+        with self.lock:
+            stream = self.stream
+            if stream is None or stream['callback'] is None:
+                return 0
+            #The callback may fail to read, so work out the number of blocks
+            #first, rather than waiting for the reads to catch up.
+            nblocks = (self._scans_due(stream) - stream['nread'])//stream['scans_per_read']
+        for i in range(max(nblocks, 0)):
+            stream['callback'](stream['handle'])
+        return max(nblocks, 0)
+
+    def temperatures(self):
+        """Return the true modelled temperature for each thermal_control.AIN_NAMES
+        channel: table, lower, upper, cryostat, then ambient for the auxiliary
+        channels."""
+        with self.lock:
+            self._advance()
+            temps = self.x[0]*np.ones(len(thermal_control.AIN_NAMES))
+            temps[:len(self.C)] = np.dot(self.C, self.x)
+            return temps
+
+    def _begin(self, name, handle=None):
+        """Account for a call, wait for its latency, and raise an LJMError if it
+        should fail."""
+        self.ncalls[name] += 1
+        delay = self.latency
+        if self.latency_jitter > 0:
+            delay += self.latency_jitter*self.rng.normal()
+        if delay > 0:
+            self.sleep(delay)
+        fail = self.offline or self.rng.uniform() < self.failure_rate
+        if self.nfail > 0:
+            self.nfail -= 1
+            fail = True
+        if fail:
+            self.nfailures[name] += 1
+            raise LJMError("Simulated failure in {}".format(name))
+        if handle is not None and handle not in self.handles:
+            self.nfailures[name] += 1
+            raise LJMError("Invalid handle {}".format(handle))
+
+    def _advance(self):
+        """Propagate the model to the current time."""
+        model_time = self.speedup*(self.clock() - self.clock_start)
+        dt = model_time - self.model_time
+        if dt > 0:
+            #At a fixed servo rate, the timestep is almost always the same.
+            if self.zoh_dt is None or abs(dt - self.zoh_dt) > ZOH_DT_RTOL*dt:
+                self.Phi, self.Gamma = lti.zoh(self.A, self.B, dt)
+                self.zoh_dt = dt
+            self.x = np.dot(self.Phi, self.x) + np.dot(self.Gamma, self.u)
+            self.model_time = model_time
+
+    def _update_inputs(self):
+        """Set the model inputs from the PWM registers."""
+        roll = self.registers.get("DIO_EF_CLOCK0_ROLL_VALUE", 0)
+        fractions = np.zeros(len(thermal_control.HEATER_DIOS))
+        if self.registers.get("DIO_EF_CLOCK0_ENABLE", 0) == 1 and roll > 0:
+            for ix, dio in enumerate(thermal_control.HEATER_DIOS):
+                if self.registers.get("DIO"+dio+"_EF_ENABLE", 0) == 1 and \
+                    self.registers.get("DIO"+dio+"_EF_INDEX", 0) == 0:
+                    fractions[ix] = self.registers.get("DIO"+dio+"_EF_CONFIG_A", 0)/roll
+        fractions = np.clip(fractions, 0, 1)
+        self.u[:-1] = thermal_model.heater_powers(fractions[:4])
+        self.u[-1] = fractions[4]*CRYO_HEATER_POWER
+
+    def _ain_voltages(self, names, nsamples=1):
+        """Return the (nsamples, len(names)) bridge voltages of the modelled
+        temperatures for a list of thermal_control.AIN_NAMES, with independent
+        noise for each sample."""
+        channels = [thermal_control.AIN_NAMES.index(name) for name in names]
+        temps = self.temperatures()[channels] + thermal_control.T_OFFSETS[channels]
+        temps = np.tile(temps, (nsamples, 1))
+        if self.noise > 0:
+            temps += self.noise*self.rng.normal(size=temps.shape)
+        return thermistor.bridge_voltages(thermistor.steinhart_hart_resistances(temps))
+
+    def _read(self, names):
+        """Read a list of registers, converting the modelled temperatures to
+        voltages for the analog inputs."""
+        values = [self.registers.get(name, 0) for name in names]
+        ain = [ix for ix, name in enumerate(names) if name in thermal_control.AIN_NAMES]
+        if len(ain) > 0:
+            voltages = self._ain_voltages([names[ix] for ix in ain])[0]
+            for ix, voltage in zip(ain, voltages):
+                values[ix] = float(voltage)
+        return values
+
+    def _scans_due(self, stream):
+        """The number of scans the stream has made by now."""
+        return int((self.clock() - stream['start'])*stream['scan_rate'])
+
+    def openS(self, deviceType, connectionType, identifier):
+        with self.lock:
+            self._begin("openS")
+            handle = self.next_handle
+            self.next_handle += 1
+            self.handles.add(handle)
+            return handle
+
+    def close(self, handle):
+        #Closing is local to the host, so it doesn't fail while offline.
+        with self.lock:
+            self.ncalls["close"] += 1
+            if handle not in self.handles:
+                raise LJMError("Invalid handle {}".format(handle))
+            self.handles.remove(handle)
+
+    def eReadName(self, handle, name):
+        with self.lock:
+            self._begin("eReadName", handle)
+            return self._read([name])[0]
+
+    def eReadNames(self, handle, numFrames, aNames):
+        with self.lock:
+            self._begin("eReadNames", handle)
+            return self._read(aNames[:numFrames])
+
+    def eWriteNames(self, handle, numFrames, aNames, aValues):
+        with self.lock:
+            self._begin("eWriteNames", handle)
+            #The old heater values apply up until now.
+            self._advance()
+            for name, value in zip(aNames[:numFrames], aValues[:numFrames]):
+                self.registers[name] = value
+            self._update_inputs()
+
+    def namesToAddresses(self, numFrames, aNames):
+        #This is a lookup in the LJM library, so it doesn't fail while offline.
+        with self.lock:
+            self.ncalls["namesToAddresses"] += 1
+            addresses = []
+            for name in aNames[:numFrames]:
+                if not name.startswith("AIN") or not name[3:].isdigit():
+                    raise LJMError("Unknown register name {}".format(name))
+                addresses.append(AIN_ADDRESS + AIN_ADDRESS_STEP*int(name[3:]))
+            return addresses, [AIN_DATA_TYPE]*len(addresses)
+
+    def eStreamStart(self, handle, scansPerRead, numAddresses, aScanList, scanRate):
+        with self.lock:
+            self._begin("eStreamStart", handle)
+            if self.stream is not None:
+                raise LJMError("Stream is already running")
+            names = ["AIN{:d}".format((address - AIN_ADDRESS)//AIN_ADDRESS_STEP) 
+                for address in aScanList[:numAddresses]]
+            for name in names:
+                if name not in thermal_control.AIN_NAMES:
+                    raise LJMError("{} is not simulated".format(name))
+            self.stream = dict(handle=handle, names=names, scans_per_read=scansPerRead, 
+                scan_rate=float(scanRate), start=self.clock(), nread=0, callback=None)
+            return float(scanRate)
+
+    def setStreamCallback(self, handle, callback):
+        with self.lock:
+            self._begin("setStreamCallback", handle)
+            if self.stream is None:
+                raise LJMError("Stream is not running")
+            self.stream['callback'] = callback
+
+    def eStreamRead(self, handle):
+        """Return the next scans_per_read scans, as (aData, deviceScanBacklog,
+        ljmScanBacklog)."""
+        with self.lock:
+            self._begin("eStreamRead", handle)
+            stream = self.stream
+            if stream is None:
+                raise LJMError("Stream is not running")
+            nscans = stream['scans_per_read']
+            scans = self._ain_voltages(stream['names'], nscans)
+            ndummy = min(self.noverflow, nscans)
+            scans[:ndummy] = STREAM_DUMMY_VALUE
+            self.noverflow -= ndummy
+            stream['nread'] += nscans
+            backlog = max(self._scans_due(stream) - stream['nread'], 0)
+            return [float(value) for value in scans.ravel()], backlog, 0
+
+    def eStreamStop(self, handle):
+        with self.lock:
+            self._begin("eStreamStop", handle)
+            if self.stream is None:
+                raise LJMError("Stream is not running")
+            self.stream = None
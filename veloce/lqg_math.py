@@ -2,17 +2,23 @@
 loop"""
 
 from __future__ import division, print_function
+import os
+import hashlib
+import tempfile
+import zipfile
 import numpy as np
-import scipy.linalg as la
+from . import lti
+from . import thermal_model
 
 lqg_dt = 0.3
 
 #Random changes for ambient per second, tfloor, and tcryo in K.
-#FIXME: this should probably automatically change when the timestep changes
-T_random = 0.1*lqg_dt
+T_RANDOM_RATE = 0.1
+T_random = T_RANDOM_RATE*lqg_dt
 
 #Measurement noise per second
-T_noise = 0.0003*lqg_dt
+T_NOISE_RATE = 0.0003
+T_noise = T_NOISE_RATE*lqg_dt
 
 #so forget that in the cost function. Mike think's that a cost function with a 
 #1 in the [1,1] position is trying to minimise the RMS plate temperature. We 
@@ -57,66 +63,9 @@ B_mat = np.array([[0],[0.0065], [4.4184e-05]])
 C_mat = np.array([[1.4998e-04,0,0.9999]])
 '''
 
-#DEFINE SIMULATION LOOP MATRIX CONSTANTS
-#Side numbers 
-# 1     Top/Lid
-# 2     Table
-# 3     Bottom/Base
-# 4     Cryostat
-
-#Heater Ambient Conductances
-# The bottom has 18 heater, and the top has 42 Heaters, so define an individual heater conductance and multiply these
-individual_gah = 0.0011
-gah1 = individual_gah*42
-gah3 = individual_gah*18
-#Heater to plate conductance
-#Use an individual conductance and then multiply by the number of heaters
-individual_ghp = 192.6
-ghp1 = individual_ghp*42
-ghp3 = individual_ghp*18
-ghp4 = individual_ghp
-#Plate Ambient conductances, set individual conductances for these
-gpa1 = 5.5206
-gpa3 = 2.1756 
-#Lid to base conductance
-g13 = 5.046
-#Lid to table radiative coupling
-g12 = 3.6
-#Table to Base conductance
-g23 = 4.5
-#Table cryostat conductance
-g24 = 10
-#Bottom to floor conductance
-gpf3 = 3.661
-#Conductance from outside of cryostat to inside temperature
-gpc4 = 0.0657
-#Capacitances
-cp1 = 82898.64 
-cp2 = 234879.48
-cp3 = 46054.8  
-cp4 = 8605.48
-
-A_mat= np.array([[-0.00000000001,0,0,0,0,0,0],
-                 [0,-0.00000000001,0,0,0,0,0],
-                 [0,0,-0.00000000001,0,0,0,0],
-                 [(gah1*ghp1 + gah1*gpa1 + ghp1*gpa1)/(cp1*(gah1 + ghp1)),0,0,((-(g12*gah1) - g13*gah1 - g12*ghp1 - g13*ghp1 - gah1*ghp1 - gah1*gpa1 - ghp1*gpa1))/(cp1*(gah1 + ghp1)),(g12*gah1 + g12*ghp1)/(cp1*(gah1 + ghp1)),(g13*gah1 + g13*ghp1)/(cp1*(gah1 + ghp1)),0],
-                 [0,0,0,g12/cp2,(-g12 - g23 - g24)/cp2,g23/cp2,g24/cp2],
-                 [(gah3*ghp3 + gah3*gpa3 + ghp3*gpa3)/(cp3*(gah3 + ghp3)),0,(gah3*gpf3 + ghp3*gpf3)/(cp3*(gah3 + ghp3)),(g13*gah3 + g13*ghp3)/(cp3*(gah3 + ghp3)),(g23*gah3 + g23*ghp3)/(cp3*(gah3 + ghp3)),(-(g13*gah3) - g23*gah3 - g13*ghp3 - g23*ghp3 - gah3*ghp3 - gah3*gpa3 - ghp3*gpa3 - gah3*gpf3 - ghp3*gpf3)/(cp3*(gah3 + ghp3)),0],
-                 [0,gpc4/cp4,0,0,g24/cp4,0,(-g24-gpc4)/cp4]])
-
-B_mat = np.array([[0,0,0],
-                  [0,0,0],
-                  [0,0,0],
-                  [ghp1/(cp1*(gah1 + ghp1)),0,0],
-                  [0,0,0],
-                  [0,ghp3/(cp3*(gah3 + ghp3)),0],
-                  [0,0,1/cp4]])
-#This edited from original since we cant measure t_amb at the moment
-C_mat = np.array([
-                  [0,0,0,1,0,0,0],
-                  [0,0,0,0,0,0,0],
-                  [0,0,0,0,0,1,0],
-                  [0,0,0,0,0,0,1]])
+#The hand-reduced model of the enclosure. See thermal_model.LQG_MODEL_ELEMENTS
+#for its states and elements.
+A_cont, B_cont, C_mat = thermal_model.lqg_enclosure_model()
 #The "R" matrix, which balances wanting small heater outputs with maintaining
 #temperature.
 #FIXME: This seems to bias the algorithm if heater outputs can only be 
@@ -127,34 +76,421 @@ R_mat = 0.1*np.eye(3)
 
 
 
-#FIXME: Not 100% certain that this is correct.
-A_mat = np.eye(len(A_mat)) + lqg_dt*A_mat
-           
+def discretise(A, B, dt):
+    """Discretise the continuous-time model A, B for a timestep dt, exactly 
+    for heater powers that are constant over each timestep. See lti.zoh."""
+    return lti.zoh(A, B, dt)
+
+#A state whose decay over a timestep is less than this is treated as not 
+#decaying at all (see external_states).
+EXTERNAL_TOL = 1e-6
 
-#Scale by the timestep
-B_mat *= lqg_dt
+def external_states(A, B, tol=EXTERNAL_TOL):
+    """Return a mask of the external states of a discrete-time model A, B: 
+    those that neither the other states nor the heaters drive, and that don't
+    decay (to within tol) over a timestep, like the ambient temperature. The
+    heaters can't bring these to the setpoint."""
+    offdiag = A - np.diag(np.diag(A))
+    return np.all(offdiag == 0, axis=1) & np.all(B == 0, axis=1) & \
+        (np.abs(np.diag(A)) >= 1 - tol)
+
+def noise_covariances(dt, random_rate=T_RANDOM_RATE, noise_rate=T_NOISE_RATE,
+    nstates=None, nmeasured=None):
+    """Return the process noise (V) and measurement noise (W) covariance 
+    matrices for a timestep dt, given the noise in K per second. The number 
+    of states and measurements default to those of A_cont and C_mat."""
+    if nstates is None:
+        nstates = len(A_cont)
+    if nmeasured is None:
+        nmeasured = len(C_mat)
+    V = ((random_rate*dt)**2)*np.eye(nstates)
+    W = ((noise_rate*dt)**2)*np.eye(nmeasured)
+    return V, W
 
- #3x3 V
-V_mat = (T_random**2)*np.eye(7)
-V_mat[0,0] = T_random**2
 '''
 #2x2 V
 V_mat = np.array([[T_random**2,0],
                           [0, 0]])
 '''
+V_mat, W_mat = noise_covariances(lqg_dt)
+
+#The discretised model (A_mat and B_mat), the Riccati solutions and the gains 
+#(P_mat, S_mat, K_mat and L_mat) are only computed when first used (see 
+#__getattr__ below), and are cached on disk in GAIN_CACHE_DIR, so that 
+#importing this module doesn't need a matrix exponential or solver call.
+GAIN_NAMES = ['A_mat', 'B_mat', 'P_mat', 'S_mat', 'K_mat', 'L_mat']
+DESIGN_NAMES = ['A_cont', 'B_cont', 'C_mat', 'Q_mat', 'R_mat', 'V_mat', 'W_mat', 'lqg_dt']
+GAIN_CACHE_DIR = os.environ.get('VELOCE_CACHE_DIR', 
+    os.path.join(os.path.expanduser('~'), '.cache', 'veloce'))
+
+def default_design():
+    """Return the matrices defined in this module as a design dict, with keys
+    DESIGN_NAMES."""
+    return dict([(name, globals()[name]) for name in DESIGN_NAMES])
+
+def lqg_design(Q=None, R=None, dt=None, random_rate=T_RANDOM_RATE, 
+    noise_rate=T_NOISE_RATE, model=None):
+    """Make a complete LQG design, i.e. the discretised model, weights, noise
+    covariances and gains. This can take as long as a Riccati solve, unless the
+    gains are already cached.
+    
+    Parameters
+    ----------
+    Q: numpy array (optional)
+        State weights. Defaults to Q_mat.
+    R: numpy array (optional)
+        Heater weights. Defaults to R_mat.
+    dt: float (optional)
+        Timestep. Defaults to lqg_dt.
+    random_rate, noise_rate: float (optional)
+        Process and measurement noise in K per second. See noise_covariances.
+    model: dict (optional)
+        A different model to A_cont, B_cont and C_mat, with these keys and a 
+        default Q_mat, e.g. from model_reduction.reduced_model. The state 
+        vector has its number of states.
+    
+    Returns
+    -------
+    design: dict
+        Everything in DESIGN_NAMES and GAIN_NAMES.
+    """
+    if dt is None:
+        dt = lqg_dt
+    if model is None:
+        model = dict(A_cont=A_cont, B_cont=B_cont, C_mat=C_mat, Q_mat=Q_mat)
+    design = dict(A_cont=model['A_cont'], B_cont=model['B_cont'], 
+        C_mat=model['C_mat'], lqg_dt=dt)
+    design['Q_mat'] = model['Q_mat'] if Q is None else np.asarray(Q, dtype=float)
+    design['R_mat'] = R_mat if R is None else np.asarray(R, dtype=float)
+    design['V_mat'], design['W_mat'] = noise_covariances(dt, random_rate, 
+        noise_rate, len(design['A_cont']), len(design['C_mat']))
+    design.update(load_gains(design))
+    return design
+
+def design_key(design=None):
+    """Return a hash of everything the gains depend on. 
+    
+    Parameters
+    ----------
+    design: dict (optional)
+        The matrices in DESIGN_NAMES. Defaults to default_design().
+    """
+    if design is None:
+        design = default_design()
+    h = hashlib.sha1()
+    for name in DESIGN_NAMES[:-1]:
+        mat = np.ascontiguousarray(design[name], dtype=float)
+        h.update(str(mat.shape).encode())
+        h.update(mat.tobytes())
+    h.update(repr(float(design['lqg_dt'])).encode())
+    return h.hexdigest()
+
+def solve_gains(design=None):
+    """Discretise the model, solve the Riccati equations and compute the gains.
+    
+    Parameters
+    ----------
+    design: dict (optional)
+        The matrices in DESIGN_NAMES. Defaults to default_design().
+    
+    Returns
+    -------
+    gains: dict
+        The matrices in GAIN_NAMES
+    """
+    if design is None:
+        design = default_design()
+    A_mat, B_mat = discretise(design['A_cont'], design['B_cont'], design['lqg_dt'])
+    C_mat = design['C_mat']
+    Q_mat, R_mat = design['Q_mat'], design['R_mat']
+    V_mat, W_mat = design['V_mat'], design['W_mat']
+    #Importing scipy.linalg takes longer than everything else here, so only
+    #do it when we need the solver.
+    import scipy.linalg as la
+    #Note that the first equation has a couple of matrices that have to be 
+    #transposed for the Riccati difference equation to apply in its standard form.
+    P_mat = la.solve_discrete_are(A_mat.T, C_mat.T, V_mat, W_mat)
+    S_mat = la.solve_discrete_are(A_mat, B_mat, Q_mat, R_mat)
+
+    #Compute the Kalman gain and Feedback gain matrices
+    K_mat = np.dot(np.dot(P_mat, C_mat.T), 
+        np.linalg.inv(np.dot(np.dot(C_mat, P_mat), C_mat.T) + W_mat))
+    L_mat = np.dot(np.linalg.inv(np.dot(np.dot(B_mat.T, S_mat),B_mat)),
+        np.dot(np.dot(B_mat.T, S_mat),A_mat))
+    return dict(A_mat=A_mat, B_mat=B_mat, P_mat=P_mat, S_mat=S_mat, K_mat=K_mat, L_mat=L_mat)
+
+def load_gains(design=None):
+    """Load the gains for the design from the cache, or solve for them and 
+    cache the result. A cache file made from different matrices has a 
+    different name, so is never used.
+    
+    Parameters
+    ----------
+    design: dict (optional)
+        The matrices in DESIGN_NAMES. Defaults to default_design().
+    
+    Returns
+    -------
+    gains: dict
+        The matrices in GAIN_NAMES
+    """
+    key = design_key(design)
+    filename = os.path.join(GAIN_CACHE_DIR, 'lqg_gains_' + key + '.npz')
+    #A missing, truncated or corrupt cache file is just recomputed and 
+    #written again.
+    try:
+        with np.load(filename) as cached:
+            if str(cached['key']) == key:
+                return dict([(name, cached[name]) for name in GAIN_NAMES])
+    except (IOError, OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        pass
+    gains = solve_gains(design)
+    #Write to a temporary file first and then replace the cache file, so that
+    #neither another process nor an interrupted save can leave a partly 
+    #written cache. Failing to write the cache isn't an error.
+    tmpname = None
+    try:
+        if not os.path.isdir(GAIN_CACHE_DIR):
+            os.makedirs(GAIN_CACHE_DIR)
+        fd, tmpname = tempfile.mkstemp(suffix='.npz', dir=GAIN_CACHE_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, key=key, **gains)
+        os.replace(tmpname, filename)
+    except (IOError, OSError):
+        if tmpname is not None and os.path.exists(tmpname):
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+    return gains
+
+def stationary_covariance(Phi, noise, tol=EXTERNAL_TOL):
+    """Return the stationary covariance of x_{i+1} = Phi x_i + w_i, where w_i
+    is white noise with covariance noise, by solving the discrete Lyapunov
+    equation. 
+    
+    This raises UserWarning unless every eigenvalue of Phi decays by at least 
+    tol per step, as the covariance of a marginally stable system is either 
+    infinite or dominated by the rounding of its slowest mode.
+    """
+    if np.max(np.abs(np.linalg.eigvals(Phi))) > 1 - tol:
+        raise UserWarning("Closed loop is not strictly stable, so has no steady-state covariance")
+    #Importing scipy.linalg is slow, so only do it when it is needed.
+    import scipy.linalg as la
+    Sigma = la.solve_discrete_lyapunov(Phi, noise)
+    return 0.5*(Sigma + Sigma.T)
+
+def closed_loop_covariance(design=None, K=None, L=None, hold_external=True):
+    """Compute the steady-state covariances of the closed loop exactly,
+    rather than by simulating it.
+    
+    With the estimator and controller as for LQGStep (without clipping the
+    outputs), the plant state x and estimate x_est evolve as
+    
+    [x; x_est]_{i+1} = [[A, -BL], [KCA, A-BL-KCA]] [x; x_est]_i 
+        + [[I, 0], [KC, K]] [w_i; v_{i+1}]
+    
+    where w and v are the process and measurement noise, with covariances V 
+    and W. The stationary covariance of [x; x_est] solves the discrete 
+    Lyapunov equation for this system (see stationary_covariance).
+    
+    The external states (see external_states) random walk without bound, so
+    have no steady-state covariance. By default they are held fixed instead,
+    giving the response to the noise on the other states and on the 
+    measurements.
+    
+    Parameters
+    ----------
+    design: dict (optional)
+        An LQG design, as returned by lqg_design. Defaults to lqg_design().
+    K, L: numpy array (optional)
+        Kalman and feedback gains to use instead of those in the design.
+    hold_external: bool (optional)
+        Whether to hold the external states fixed. If False, a model with
+        external states raises UserWarning.
+    
+    Returns
+    -------
+    covariances: dict
+        'state', 'estimate' and 'error' (x - x_est) covariances, the 
+        'sensors' (measurement) and 'heaters' (output) covariances, and 
+        'state_rms' and 'sensor_rms', the square roots of their diagonals.
+        The rows and columns of any held external states are zero.
+    """
+    if design is None:
+        design = lqg_design()
+    A, B, C = design['A_mat'], design['B_mat'], design['C_mat']
+    V, W = design['V_mat'], design['W_mat']
+    if K is None:
+        K = design['K_mat']
+    if L is None:
+        L = design['L_mat']
+    n_all = len(A)
+    if hold_external:
+        keep = np.flatnonzero(~external_states(A, B))
+    else:
+        keep = np.arange(n_all)
+    A = A[np.ix_(keep, keep)]
+    B, C, V = B[keep], C[:,keep], V[np.ix_(keep, keep)]
+    K, L = K[keep], L[:,keep]
+    n = len(A)
+    p = len(C)
+    BL = np.dot(B, L)
+    KCA = np.dot(np.dot(K, C), A)
+    Phi = np.vstack((np.hstack((A, -BL)), np.hstack((KCA, A - BL - KCA))))
+    G = np.vstack((np.hstack((np.eye(n), np.zeros( (n,p) ))), 
+        np.hstack((np.dot(K, C), K))))
+    noise = np.zeros( (n+p, n+p) )
+    noise[:n,:n] = V
+    noise[n:,n:] = W
+    Sigma = stationary_covariance(Phi, np.dot(np.dot(G, noise), G.T))
+    state = np.zeros( (n_all, n_all) )
+    estimate = np.zeros( (n_all, n_all) )
+    error = np.zeros( (n_all, n_all) )
+    ix = np.ix_(keep, keep)
+    state[ix] = Sigma[:n,:n]
+    estimate[ix] = Sigma[n:,n:]
+    error[ix] = Sigma[:n,:n] + Sigma[n:,n:] - Sigma[:n,n:] - Sigma[n:,:n]
+    sensors = np.dot(np.dot(C, Sigma[:n,:n]), C.T) + W
+    heaters = np.dot(np.dot(L, Sigma[n:,n:]), L.T)
+    return dict(state=state, estimate=estimate, error=error, sensors=sensors,
+        heaters=heaters, state_rms=np.sqrt(np.diag(state)), 
+        sensor_rms=np.sqrt(np.diag(sensors)))
+
+#Relative difference between the time-varying and steady state Kalman gains,
+#below which LQGStep goes back to the steady state update.
+STEADY_RTOL = 1e-3
+
+class LQGStep:
+    def __init__(self, design, umax):
+        """The estimator and controller update for one servo tick, with the
+        matrices combined ahead of time and all buffers preallocated.
+
+        The Kalman filter update
+        
+        x_{i+1} = A x_i + B u_i + K (y - C (A x_i + B u_i))
+        
+        is computed as a single product [(I-KC)A, (I-KC)B, K] [x_i; u_i; y], 
+        or [A, B] [x_i; u_i] with no measurement. This is followed by 
+        u_{i+1} = -L x_{i+1}, clipped to the range 0 to umax.
+        
+        If some measurements are missing, or ticks were late, the filter
+        instead propagates its covariance, and only updates with the
+        measurements that arrived (see update).
+
+        Parameters
+        ----------
+        design: dict
+            An LQG design, as returned by lqg_design.
+        umax: array
+            The maximum of each output (heater power).
+        """
+        A, B, C = design['A_mat'], design['B_mat'], design['C_mat']
+        K, L = design['K_mat'], design['L_mat']
+        n, m = B.shape
+        p = len(C)
+        I_KC = np.eye(n) - np.dot(K, C)
+        self.update_mat = np.ascontiguousarray(np.hstack((np.dot(I_KC, A), np.dot(I_KC, B), K)))
+        self.predict_mat = np.ascontiguousarray(np.hstack((A, B)))
+        self.minus_L = np.ascontiguousarray(-L)
+        self.umax = np.array(umax, dtype=float)
+        #The state, output and measurement are stored in one vector, so that
+        #they can be multiplied by the combined matrices without copying.
+        self.z = np.zeros(n + m + p)
+        self.x = self.z[:n]
+        self.u = self.z[n:n+m]
+        self.y = self.z[n+m:]
+        self.xu = self.z[:n+m]
+        self.x_new = np.zeros(n)
+        self.fractions = np.zeros(m)
+        #For ticks with missing measurements, the filter is run with its own
+        #covariance, starting from the steady state covariance after a 
+        #measurement update. Once every channel is measured again, the 
+        #gain converges back, and we go back to the combined matrices.
+        self.A, self.B, self.C, self.K = A, B, C, K
+        self.V, self.W = design['V_mat'], design['W_mat']
+        self.P_steady = np.dot(I_KC, design['P_mat'])
+        self.P = self.P_steady.copy()
+        self.steady = True
+        self.all_valid = np.ones(p, dtype=bool)
+
+    def set_state(self, x, u):
+        """Copy in the state estimate and outputs, e.g. from the step for a
+        previous design."""
+        self.x[:] = np.ravel(x)
+        self.u[:] = np.ravel(u)
+
+    def update(self, valid=None, nsteps=1):
+        """Advance one tick. Before calling this, self.y has to hold the new
+        measurement for each valid channel.
+        
+        Parameters
+        ----------
+        valid: numpy bool array (optional)
+            For each measurement, whether it is new this tick. Defaults to all
+            channels. If only some are valid, the estimate is updated with those
+            alone, rather than with stale values for the rest.
+        nsteps: int (optional)
+            The number of timesteps since the last update, if ticks were late.
+            The estimate is predicted forwards with the outputs held, before the
+            measurement update.
+
+        Returns
+        -------
+        fractions: numpy array
+            Each output as a fraction of umax. This is a buffer that is 
+            overwritten on the next update.
+        """
+        self.estimate(valid, nsteps)
+        np.dot(self.minus_L, self.x, out=self.u)
+        np.clip(self.u, 0, self.umax, out=self.u)
+        np.divide(self.u, self.umax, out=self.fractions)
+        return self.fractions
 
-W_mat = (T_noise**2)*np.eye(4) 
+    def estimate(self, valid=None, nsteps=1):
+        """Update the state estimate self.x only, for a controller that sets
+        self.u itself. See update."""
+        if valid is None:
+            valid = self.all_valid
+        if self.steady and nsteps == 1 and np.all(valid):
+            np.dot(self.update_mat, self.z, out=self.x_new)
+            self.x[:] = self.x_new
+        else:
+            self.filter_update(valid, nsteps)
 
-#Note that the first equation has a couple of matrices that have to be 
-#transposed for the Riccati difference equation to apply in its standard form.
-P_mat = la.solve_discrete_are(A_mat.T, C_mat.T, V_mat, W_mat)
-S_mat = la.solve_discrete_are(A_mat, B_mat, Q_mat, R_mat)
+    def filter_update(self, valid, nsteps=1):
+        """The time-varying Kalman filter update, for when some measurements
+        are missing or ticks were late, propagating the covariance self.P.
+        See update."""
+        P = self.P
+        for i in range(max(nsteps, 1)):
+            np.dot(self.predict_mat, self.xu, out=self.x_new)
+            self.x[:] = self.x_new
+            P = np.dot(np.dot(self.A, P), self.A.T) + self.V
+        valid = np.asarray(valid, dtype=bool)
+        steady = False
+        if np.any(valid):
+            C = self.C[valid]
+            PCt = np.dot(P, C.T)
+            S = np.dot(C, PCt) + self.W[np.ix_(valid, valid)]
+            K = np.linalg.solve(S, PCt.T).T
+            #Once the gain is back to its steady state, the combined matrices
+            #give the same update.
+            steady = np.all(valid) and \
+                np.linalg.norm(K - self.K) <= STEADY_RTOL*np.linalg.norm(self.K)
+            self.x += np.dot(K, self.y[valid] - np.dot(C, self.x))
+            P = P - np.dot(K, PCt.T)
+            P = 0.5*(P + P.T)
+        self.steady = steady
+        self.P = self.P_steady.copy() if steady else P
 
-#Compute the Kalman gain and Feedback gain matrices
-K_mat = np.dot(np.dot(P_mat, C_mat.T), 
-    np.linalg.inv(np.dot(np.dot(C_mat, P_mat), C_mat.T) + W_mat))
-L_mat = np.dot(np.linalg.inv(np.dot(np.dot(B_mat.T, S_mat),B_mat)),
-    np.dot(np.dot(B_mat.T, S_mat),A_mat))
+def __getattr__(name):
+    """Compute (or load) the gains the first time one of them is used."""
+    if name in GAIN_NAMES:
+        gains = load_gains()
+        globals().update(gains)
+        return gains[name]
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 
 #We need to store both the actual and estimated values for x
@@ -0,0 +1,62 @@
+"""Linear time-invariant system utilities."""
+from __future__ import print_function, division
+import numpy as np
+
+def zoh(A, B, dt):
+    """Discretise dx/dt = Ax + Bu exactly, assuming that u is held constant
+    over each timestep (zero-order hold).
+
+    The matrix exponential of [[A, B], [0, 0]]*dt is [[Phi, Gamma], [0, I]],
+    where x_{i+1} = Phi x_i + Gamma u_i.
+
+    Parameters
+    ----------
+    A: numpy array
+        (n,n) continuous-time state matrix.
+    B: numpy array
+        (n,m) continuous-time input matrix.
+    dt: float
+        The timestep.
+
+    Returns
+    -------
+    Phi, Gamma: numpy array
+        The (n,n) and (n,m) discrete-time state and input matrices.
+    """
+    #Importing scipy.linalg is slow, so only do it when it is needed.
+    import scipy.linalg as la
+    n, m = B.shape
+    M = np.zeros( (n+m, n+m) )
+    M[:n,:n] = A*dt
+    M[:n,n:] = B*dt
+    E = la.expm(M)
+    return E[:n,:n], E[:n,n:]
+
+def propagate(Phi, Gamma, x0, u):
+    """Propagate the discrete-time model x_{i+1} = Phi x_i + Gamma u_i.
+    
+    The input terms for every step are computed at once, leaving only a 
+    matrix-vector product per step.
+
+    Parameters
+    ----------
+    Phi, Gamma: numpy array
+        The (n,n) and (n,m) discrete-time state and input matrices, e.g. from
+        zoh.
+    x0: numpy array
+        The initial state.
+    u: numpy array
+        The (nsteps,m) inputs for each step.
+
+    Returns
+    -------
+    x: numpy array
+        The (nsteps+1,n) states, starting with x0.
+    """
+    u = np.asarray(u, dtype=float)
+    forcing = np.dot(u, Gamma.T)
+    x = np.empty( (len(u)+1, len(Phi)) )
+    x[0] = np.ravel(x0)
+    for i in range(len(u)):
+        x[i+1] = np.dot(Phi, x[i]) + forcing[i]
+    return x
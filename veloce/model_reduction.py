@@ -0,0 +1,143 @@
+"""Balanced truncation of the enclosure model, for the LQG estimator.
+
+The full plant (thermal_model.plant_model) has 16 states, but many of them
+(e.g. the heater casings) hardly affect the sensors on the servo timescale,
+and each state costs time in every estimator update. Balanced truncation
+transforms the model to coordinates in which each state is as controllable as
+it is observable, measured by its Hankel singular value, and then discards
+the states with singular values below a cutoff. The peak error in the
+sensor temperatures is then bounded by twice the sum of the discarded
+singular values, for unit inputs.
+
+The ambient temperature has no dynamics of its own, so it is kept as a state
+and only the rest of the model is reduced, with the ambient temperature as
+one of its inputs. The heater inputs are scaled to their full powers before
+the reduction, so that the singular values are in K. For example:
+
+    from veloce import model_reduction, lqg_math, thermal_control as tc
+    model = model_reduction.reduced_model(1e-3, tc.HEATER_MAX, tc.LQG_HEATERS, tc.LQG_SENSORS)
+    design = lqg_math.lqg_design(model=model)
+"""
+from __future__ import print_function, division
+import numpy as np
+
+from . import thermal_model
+
+#Hankel singular value in K below which states are discarded.
+HSV_CUTOFF = 1e-3
+#The ambient temperature decays very slowly, as for lqg_math.A_cont, so that
+#the Riccati equations have solutions.
+AMBIENT_DECAY = 1e-11
+#Weights on the temperatures of thermal_model.PLANT_OUTPUT_LABELS in the LQG
+#cost, as for lqg_math.Q_mat.
+OUTPUT_WEIGHTS = [1000., 1., 1., 1.]
+
+def psd_factor(W):
+    """Return L with W = L L' for a symmetric positive semi-definite matrix W,
+    even if it is singular to working precision."""
+    w, v = np.linalg.eigh(0.5*(W + W.T))
+    return v*np.sqrt(np.maximum(w, 0))
+
+def balanced_truncation(A, B, C, cutoff=HSV_CUTOFF, nstates=None):
+    """Reduce a stable continuous-time model by balanced truncation.
+
+    Parameters
+    ----------
+    A, B, C: numpy array
+        The state, input and output matrices.
+    cutoff: float (optional)
+        States with Hankel singular values below this are discarded.
+    nstates: int (optional)
+        The number of states to keep, instead of using cutoff.
+
+    Returns
+    -------
+    A_r, B_r, C_r: numpy array
+        The reduced model.
+    hsv: numpy array
+        The Hankel singular values of the full model, in decreasing order.
+    """
+    #Importing scipy.linalg is slow, so only do it when it is needed.
+    import scipy.linalg as la
+    Wc = la.solve_continuous_lyapunov(A, -np.dot(B, B.T))
+    Wo = la.solve_continuous_lyapunov(A.T, -np.dot(C.T, C))
+    Lc = psd_factor(Wc)
+    Lo = psd_factor(Wo)
+    U, hsv, Vt = np.linalg.svd(np.dot(Lo.T, Lc))
+    if nstates is None:
+        nstates = max(int(np.sum(hsv > cutoff)), 1)
+    scale = hsv[:nstates]**-0.5
+    T = np.dot(Lc, Vt[:nstates].T)*scale
+    T_inv = scale[:,None]*np.dot(U[:,:nstates].T, Lo.T)
+    return np.dot(T_inv, np.dot(A, T)), np.dot(T_inv, B), np.dot(C, T), hsv
+
+def lqg_inputs(umax, heaters):
+    """Return the (7,m) matrix that converts LQG outputs in W to the inputs of
+    thermal_model.plant_model.
+
+    Parameters
+    ----------
+    umax: array
+        The maximum of each LQG output (thermal_control.HEATER_MAX).
+    heaters: list
+        The LQG output driving each heater (thermal_control.LQG_HEATERS), for
+        the long, short, lid, base and cryostat heaters. The cryostat heater
+        has a full power of umax.
+    """
+    umax = np.asarray(umax, dtype=float)
+    heaters = np.asarray(heaters)
+    inputs = np.zeros( (7, len(umax)) )
+    for ix in range(len(umax)):
+        fractions = (heaters == ix).astype(float)
+        inputs[:6,ix] = thermal_model.heater_powers(fractions[:4])
+        inputs[6,ix] = fractions[4]*umax[heaters[4]]
+    return inputs/umax
+
+def reduced_model(cutoff, umax, heaters, sensors, constants=None, nstates=None):
+    """Reduce the plant model for use by lqg_math.lqg_design.
+
+    Parameters
+    ----------
+    cutoff: float
+        Hankel singular value in K below which states are discarded.
+    umax, heaters:
+        See lqg_inputs.
+    sensors: list
+        The thermal_model.PLANT_OUTPUT_LABELS index of each LQG measurement
+        (thermal_control.LQG_SENSORS).
+    constants: numpy array (optional)
+        The model constants. Defaults to thermal_model.default_constants().
+    nstates: int (optional)
+        The number of states to keep apart from the ambient temperature,
+        instead of using cutoff.
+
+    Returns
+    -------
+    model: dict
+        The continuous-time 'A_cont', 'B_cont', 'C_mat' and state weights
+        'Q_mat', with the ambient temperature as state 0. Also the Hankel
+        singular values 'hsv' and the 'error_bound' on the outputs in K.
+    """
+    if constants is None:
+        constants = thermal_model.default_constants()
+    A, B, C = thermal_model.plant_model(constants)
+    umax = np.asarray(umax, dtype=float)
+    B = np.dot(B, lqg_inputs(umax, heaters))
+    #Reduce everything but the ambient temperature, with the ambient
+    #temperature as an extra input, and the heater inputs scaled to full power.
+    B_rest = np.hstack((A[1:,:1], B[1:]*umax))
+    A_r, B_r, C_r, hsv = balanced_truncation(A[1:,1:], B_rest, C[:,1:],
+        cutoff, nstates)
+    n = len(A_r) + 1
+    A_cont = np.zeros( (n, n) )
+    A_cont[0,0] = -AMBIENT_DECAY
+    A_cont[1:,0] = B_r[:,0]
+    A_cont[1:,1:] = A_r
+    B_cont = np.zeros( (n, len(umax)) )
+    B_cont[1:] = B_r[:,1:]/umax
+    C_out = np.zeros( (len(C), n) )
+    C_out[:,0] = C[:,0]
+    C_out[:,1:] = C_r
+    Q_mat = np.dot(C_out.T*OUTPUT_WEIGHTS, C_out)
+    return dict(A_cont=A_cont, B_cont=B_cont, C_mat=C_out[sensors], Q_mat=Q_mat,
+        hsv=hsv, error_bound=2*np.sum(hsv[n-1:]))
@@ -0,0 +1,308 @@
+"""Model-predictive control of the heaters.
+
+The LQG controller computes unconstrained heater powers and then clips them
+to the range 0 to HEATER_MAX, which is not optimal whenever a heater is at a
+limit. Instead, every servo tick this solves the finite-horizon problem
+
+    minimise  sum_{k=1}^{N-1} l_k x_k' Q x_k + x_N' S x_N + sum_{k=0}^{N-1} l_k u_k' R u_k
+    subject to x_{k+1} = A_k x_k + B_k u_k,  0 <= u_k <= umax
+
+with the same discretised model, weights and estimator as lqg_math, and S the
+(unconstrained) LQR cost-to-go for the remainder after the horizon. Each u_k
+is held for a block of l_k timesteps, with A_k and B_k the model over the 
+block (see prediction_matrices). The first block is one timestep, and the 
+blocks get longer so that the horizon spans hours: the heaters can stay at
+a limit for that long while the enclosure warms up, and a horizon that ends
+sooner lets the controller count on the unconstrained LQR cost-to-go, i.e. 
+on heater powers that can't be reached.
+
+Eliminating the states gives a quadratic programme in the heater powers
+U = [u_0, ..., u_{N-1}] with only box constraints,
+
+    minimise  U' H U / 2 + U' F x_0,  0 <= U <= umax
+
+which is solved by accelerated projected gradient descent (FISTA), starting
+from the previous tick's solution moved forwards by one timestep. The long 
+blocks make H badly conditioned, so the iterations work with each heater 
+power scaled by 1/sqrt(H_ii), which keeps the box constraints a box and 
+brings the iterations down to a few tens.
+
+The external states (see lqg_math.external_states), e.g. the ambient 
+temperature, aren't driven by the heaters and don't decay within the horizon.
+While they are away from the setpoint, the other states can only be held at 
+the setpoint with steady heater powers, so regulating every state and heater 
+power to zero, as the LQR does, leaves a permanent offset. Instead, x and u 
+are regulated to the steady state for the current external states (see
+steady_state_targets).
+"""
+from __future__ import print_function, division
+import time
+import numpy as np
+from . import lqg_math
+
+#Number of blocks in the prediction horizon, and the time in seconds that
+#they span. The heater powers are held over each block, and the blocks get
+#longer geometrically after the first timestep, so that the horizon covers
+#the hours that the heaters can stay at a limit while warming up.
+MPC_HORIZON = 30
+MPC_HORIZON_TIME = 4*3600.
+#Maximum number of iterations per solve, and the change in heater power (W)
+#between iterations below which the solution has converged.
+MPC_MAX_ITER = 200
+MPC_TOL = 1e-3
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+def block_lengths(horizon, nsteps):
+    """Return the number of timesteps in each block of the horizon, growing
+    geometrically from 1 so that they add up to nsteps.
+
+    Parameters
+    ----------
+    horizon: int
+        The number of blocks, N.
+    nsteps: int
+        The total number of timesteps. If this is at most N, every block is 
+        one timestep.
+
+    Returns
+    -------
+    lengths: numpy int array
+        The N block lengths.
+    """
+    if nsteps <= horizon:
+        return np.ones(horizon, dtype=int)
+    #Find the ratio r for which 1 + r + ... + r^(N-1) = nsteps, by bisection.
+    lower, upper = 1., float(nsteps)
+    for i in range(100):
+        r = (lower + upper)/2
+        if (r**horizon - 1)/(r - 1) < nsteps:
+            lower = r
+        else:
+            upper = r
+    ends = np.round(np.cumsum(r**np.arange(horizon))).astype(int)
+    #Every block is at least one timestep, and the last ends at nsteps.
+    ends = np.maximum.accumulate(np.maximum(ends, np.arange(1, horizon+1)))
+    ends = np.minimum(ends, nsteps - np.arange(horizon-1, -1, -1))
+    ends[-1] = nsteps
+    return np.diff(np.concatenate(([0], ends)))
+
+def prediction_matrices(A, B, horizon, lengths=None):
+    """Return the matrices that predict the states from the initial state and
+    the outputs over a horizon.
+
+    Parameters
+    ----------
+    A, B: numpy array
+        The (n,n) and (n,m) discrete-time state and input matrices.
+    horizon: int
+        The number of blocks, N.
+    lengths: numpy int array (optional)
+        The number of timesteps in each block, over which its output is held.
+        Defaults to one timestep each.
+
+    Returns
+    -------
+    Phi, Gamma: numpy array
+        The (N*n,n) and (N*n,N*m) matrices for which
+        [x_1; ...; x_N] = Phi x_0 + Gamma [u_0; ...; u_{N-1}], where x_k is
+        the state at the end of block k-1.
+    """
+    n, m = B.shape
+    if lengths is None:
+        lengths = np.ones(horizon, dtype=int)
+    Phi = np.zeros( (horizon*n, n) )
+    Gamma = np.zeros( (horizon*n, horizon*m) )
+    #For a block of l timesteps with its output held, [[A, B], [0, I]]^l is
+    #[[A^l, (I + A + ... + A^(l-1)) B], [0, I]].
+    M = np.eye(n+m)
+    M[:n,:n] = A
+    M[:n,n:] = B
+    Ak = np.eye(n)
+    for k in range(horizon):
+        Ml = np.linalg.matrix_power(M, int(lengths[k]))
+        Al, Bl = Ml[:n,:n], Ml[:n,n:]
+        Ak = np.dot(Al, Ak)
+        Phi[k*n:(k+1)*n] = Ak
+        #Earlier outputs propagate through this block.
+        if k > 0:
+            Gamma[k*n:(k+1)*n, :k*m] = np.dot(Al, Gamma[(k-1)*n:k*n, :k*m])
+        Gamma[k*n:(k+1)*n, k*m:(k+1)*m] = Bl
+    return Phi, Gamma
+
+def steady_state_targets(A, B, Q):
+    """Return the steady state and heater powers for the external states.
+
+    With the external states x_E held, the other (internal) states settle to
+    
+        x_I = (I - A_II)^-1 (A_IE x_E + B_I u)
+    
+    for steady heater powers u. The target u minimises x_I' Q_II x_I, i.e. 
+    without the R weight, so that it doesn't trade an offset against heater
+    power.
+
+    Parameters
+    ----------
+    A, B: numpy array
+        The (n,n) and (n,m) discrete-time state and input matrices.
+    Q: numpy array
+        The (n,n) state weights.
+
+    Returns
+    -------
+    Tx, Tu: numpy array
+        The (n,n) and (m,n) matrices for which the target state is Tx x and 
+        the target heater powers are Tu x, given the state x. Only the 
+        external states of x are used.
+    """
+    n, m = B.shape
+    ext = lqg_math.external_states(A, B)
+    I = ~ext
+    M = np.linalg.inv(np.eye(np.sum(I)) - A[np.ix_(I,I)])
+    G = np.dot(M, A[np.ix_(I,ext)])
+    N = np.dot(M, B[I])
+    NtQ = np.dot(N.T, Q[np.ix_(I,I)])
+    Tu_E = -np.dot(np.linalg.pinv(np.dot(NtQ, N)), np.dot(NtQ, G))
+    Tx = np.zeros( (n,n) )
+    Tx[np.ix_(ext,ext)] = np.eye(np.sum(ext))
+    Tx[np.ix_(I,ext)] = G + np.dot(N, Tu_E)
+    Tu = np.zeros( (m,n) )
+    Tu[:,ext] = Tu_E
+    return Tx, Tu
+
+class MPCStep:
+    def __init__(self, design, umax, horizon=MPC_HORIZON, horizon_time=MPC_HORIZON_TIME,
+        max_iter=MPC_MAX_ITER, tol=MPC_TOL):
+        """The constrained controller for one servo tick, with the QP matrices
+        computed ahead of time.
+
+        Parameters
+        ----------
+        design: dict
+            An LQG design, as returned by lqg_math.lqg_design.
+        umax: array
+            The maximum of each output (heater power).
+        horizon: int (optional)
+            The number of blocks in the prediction horizon.
+        horizon_time: float (optional)
+            The time in seconds spanned by the horizon. See block_lengths.
+        max_iter: int (optional)
+            Maximum number of iterations per solve.
+        tol: float (optional)
+            Change in heater power between iterations at which to stop.
+        """
+        A, B = design['A_mat'], design['B_mat']
+        Q, R, S = design['Q_mat'], design['R_mat'], design['S_mat']
+        n, m = B.shape
+        self.horizon = horizon
+        self.max_iter = max_iter
+        self.tol = tol
+        self.lengths = block_lengths(horizon, int(round(horizon_time/design['lqg_dt'])))
+        Phi, Gamma = prediction_matrices(A, B, horizon, self.lengths)
+        Q_Gamma = np.empty_like(Gamma)
+        Q_Phi = np.empty_like(Phi)
+        #The stage costs of each block are its length times those at its start.
+        for k in range(horizon):
+            Qk = S if k == horizon-1 else self.lengths[k+1]*Q
+            Q_Gamma[k*n:(k+1)*n] = np.dot(Qk, Gamma[k*n:(k+1)*n])
+            Q_Phi[k*n:(k+1)*n] = np.dot(Qk, Phi[k*n:(k+1)*n])
+        self.H = np.dot(Gamma.T, Q_Gamma) + np.kron(np.diag(self.lengths), R)
+        #Regulate to the targets rather than to zero. Substituting 
+        #U - [Tu x; ...; Tu x] for U and (I - Tx) x for x, and dropping the
+        #constant, the linear term becomes U'(F (I - Tx) - H [I; ...; I] Tu) x.
+        Tx, Tu = steady_state_targets(A, B, Q)
+        H_sum = np.dot(self.H, np.kron(np.ones( (horizon,1) ), np.eye(m)))
+        self.F = np.dot(np.dot(Gamma.T, Q_Phi), np.eye(n) - Tx) - np.dot(H_sum, Tu)
+        #The iterations solve for V = U/scale, with the QP matrices and the
+        #upper bounds scaled to match.
+        self.scale = 1/np.sqrt(np.diag(self.H))
+        self.H_scaled = np.ascontiguousarray(self.H*np.outer(self.scale, self.scale))
+        self.F_scaled = np.ascontiguousarray(self.F*self.scale[:,np.newaxis])
+        #The gradient step is 1/(largest eigenvalue of H_scaled).
+        self.step_size = 1/np.linalg.eigvalsh(self.H_scaled)[-1]
+        self.umax = np.array(umax, dtype=float)
+        self.upper = np.tile(self.umax, horizon)
+        self.upper_scaled = self.upper/self.scale
+        #The solution over the horizon, and buffers for the iterations.
+        self.U = np.zeros(horizon*m)
+        self.V = np.zeros(horizon*m)
+        self.V_new = np.zeros(horizon*m)
+        self.Y = np.zeros(horizon*m)
+        self.grad = np.zeros(horizon*m)
+        self.f = np.zeros(horizon*m)
+        self.m = m
+        #For the warm start, the block of the previous solution that each 
+        #block starts in, one timestep on.
+        ends = np.cumsum(self.lengths)
+        self.warm_ix = np.minimum(np.searchsorted(ends, ends - self.lengths + 1, 
+            side='right'), horizon-1)
+        #Solve statistics.
+        self.nsolves = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.total_iter = 0
+        self.max_iter_used = 0
+        self.nunconverged = 0
+
+    def solve(self, x):
+        """Solve for the heater powers over the horizon, from state x.
+
+        Returns
+        -------
+        u: numpy array
+            The heater powers for this tick. This is a view of the solution,
+            which is overwritten on the next solve.
+        """
+        t0 = monotonic()
+        m = self.m
+        #Warm start: the previous solution, one timestep on, holding the last
+        #output.
+        self.U[:] = self.U.reshape( (-1,m) )[self.warm_ix].ravel()
+        np.divide(self.U, self.scale, out=self.V)
+        np.dot(self.F_scaled, np.ravel(x), out=self.f)
+        self.Y[:] = self.V
+        t = 1.
+        converged = False
+        for niter in range(1, self.max_iter+1):
+            np.dot(self.H_scaled, self.Y, out=self.grad)
+            self.grad += self.f
+            self.grad *= -self.step_size
+            self.grad += self.Y
+            np.clip(self.grad, 0, self.upper_scaled, out=self.V_new)
+            t_new = (1 + np.sqrt(1 + 4*t*t))/2
+            #Y = V_new + (t-1)/t_new (V_new - V), computed in place.
+            np.subtract(self.V_new, self.V, out=self.Y)
+            #The change in heater power, using grad as a scratch buffer.
+            np.multiply(self.Y, self.scale, out=self.grad)
+            change = np.max(np.abs(self.grad))
+            self.Y *= (t - 1)/t_new
+            self.Y += self.V_new
+            self.V[:] = self.V_new
+            t = t_new
+            if change <= self.tol:
+                converged = True
+                break
+        #Undo the scaling, without rounding past the limits.
+        np.multiply(self.V, self.scale, out=self.U)
+        np.clip(self.U, 0, self.upper, out=self.U)
+        elapsed = monotonic() - t0
+        self.nsolves += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.total_iter += niter
+        self.max_iter_used = max(self.max_iter_used, niter)
+        if not converged:
+            self.nunconverged += 1
+        return self.U[:m]
+
+    def summary(self):
+        """Return a summary of the solve times and iterations."""
+        if self.nsolves == 0:
+            return "MPC horizon {:d} blocks, {:d} steps, no solves yet.".format(
+                self.horizon, np.sum(self.lengths))
+        return "MPC horizon {:d} blocks, {:d} steps, {:d} solves, {:d} unconverged\n".format(
+            self.horizon, np.sum(self.lengths), self.nsolves, self.nunconverged) + \
+            "Solve time: mean {:.6f}s, max {:.6f}s\n".format(
+            self.total_time/self.nsolves, self.max_time) + \
+            "Iterations: mean {:.1f}, max {:d}".format(
+            self.total_iter/self.nsolves, self.max_iter_used)
@@ -0,0 +1,74 @@
+"""Background reconnection with exponential backoff.
+
+Re-opening a network connection can block for several seconds, so it must not
+be done inside the servo loop. A Reconnector instead retries a connect
+function on its own thread, doubling the delay between attempts up to a
+maximum, until the connection succeeds or it is stopped.
+"""
+from __future__ import print_function, division
+import threading
+import logging
+
+#Delay in seconds before the first retry, and the maximum delay between retries.
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+class Reconnector:
+    def __init__(self, connect, min_delay=RECONNECT_MIN_DELAY,
+        max_delay=RECONNECT_MAX_DELAY):
+        """Retry a connection in the background.
+
+        Parameters
+        ----------
+        connect: function
+            A function with no arguments that connects, raising an exception on
+            failure.
+        min_delay: float (optional)
+            Delay in seconds after the first failed attempt.
+        max_delay: float (optional)
+            Maximum delay in seconds between attempts.
+        """
+        self.connect = connect
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.nattempts = 0
+        self.nreconnects = 0
+        self.last_error = None
+
+    def running(self):
+        """Return True if we are currently trying to reconnect."""
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Start trying to reconnect, unless we already are."""
+        if self.running():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="reconnect")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop trying to reconnect. An attempt in progress is not interrupted."""
+        self.stop_event.set()
+
+    def _run(self):
+        delay = self.min_delay
+        while not self.stop_event.is_set():
+            self.nattempts += 1
+            try:
+                self.connect()
+            except Exception as e:
+                self.last_error = e
+                logging.warning("Reconnection attempt {:d} failed, retrying in {:.1f}s: {}".format(
+                    self.nattempts, delay, e))
+            else:
+                self.nreconnects += 1
+                logging.info("Reconnected after {:d} attempts".format(self.nattempts))
+                self.nattempts = 0
+                return
+            if self.stop_event.wait(delay):
+                return
+            delay = min(2*delay, self.max_delay)
@@ -0,0 +1,202 @@
+"""Faster than real time closed-loop runs of the servo against a simulated plant.
+
+ThermalControl.job_doservo is run on a virtual clock against a fake_ljm.FakeLJM,
+with the same fixed-rate schedule as the server but no real waiting, so that
+days of closed-loop operation take minutes. Log records are written in the
+production format, with their timestamps taken from the virtual clock, so
+that the usual log analysis tools work on the output. For example, to compare
+controllers over a week:
+
+    from veloce import replay
+    replay.compare(["lqg", "mpc", "pid cryo"], duration=7*86400)
+"""
+from __future__ import print_function, division
+import sys
+import os
+import time
+import logging
+import numpy as np
+
+from . import thermal_control
+from . import fake_ljm
+from . import lqg_math
+from .server.scheduler import PeriodicJob
+
+SERVOS = ["lqg", "mpc", "pid", "cryo"]
+#Number of ticks between records in the returned history.
+RECORD_EVERY = 10
+
+class VirtualClock:
+    def __init__(self, start=0.):
+        """A clock that only moves when told to.
+
+        Parameters
+        ----------
+        start: float (optional)
+            The initial time in seconds (e.g. a Unix time, for log files).
+        """
+        self.t = start
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, dt):
+        """Advance the clock by dt seconds, instead of waiting."""
+        if dt > 0:
+            self.t += dt
+
+    def advance_to(self, t):
+        """Advance the clock to time t, if that is in the future."""
+        self.t = max(self.t, t)
+
+class VirtualTimeFilter(logging.Filter):
+    def __init__(self, clock):
+        """A logging filter that stamps records with the time from clock."""
+        logging.Filter.__init__(self)
+        self.clock = clock
+
+    def filter(self, record):
+        record.created = self.clock()
+        record.msecs = (record.created - int(record.created))*1000
+        return True
+
+def replay(servos="lqg", duration=86400., logfile='replay.log', setpoint=25.0,
+    period=lqg_math.lqg_dt, start_time=None, verbose=False, **plant_args):
+    """Run the servo in closed loop with a simulated plant.
+
+    Parameters
+    ----------
+    servos: string (optional)
+        The servo loops to run, separated by spaces, from SERVOS.
+    duration: float (optional)
+        Simulated time in seconds.
+    logfile: string (optional)
+        File to write the log to, or None for no log.
+    setpoint: float (optional)
+        Temperature setpoint in Celcius.
+    period: float (optional)
+        Servo period in seconds.
+    start_time: float (optional)
+        The Unix time the run starts at. Defaults to now.
+    verbose: bool (optional)
+        Whether to let the servo print to the screen.
+    plant_args:
+        Passed on to fake_ljm.FakeLJM, e.g. ambient, noise, latency or seed.
+
+    Returns
+    -------
+    history: dict
+        Every RECORD_EVERY ticks, the time ('time'), the measured ('temps') and
+        true ('true_temps') sensor temperatures and the heater fractions
+        ('heaters'). 'timing' is the schedule summary.
+    """
+    servos = servos.split()
+    for servo in servos:
+        if servo not in SERVOS:
+            raise UserWarning("Unknown servo: {}".format(servo))
+    if start_time is None:
+        start_time = time.time()
+    clock = VirtualClock(start_time)
+    plant = fake_ljm.FakeLJM(clock=clock, sleep=clock.sleep, **plant_args)
+
+    #Send the servo's log records to our own file, with virtual times.
+    root = logging.getLogger()
+    old_handlers = root.handlers[:]
+    old_level = root.level
+    for handler in old_handlers:
+        root.removeHandler(handler)
+    root.setLevel(thermal_control.LOG_LEVEL)
+    if logfile is not None:
+        handler = logging.FileHandler(logfile, mode='w')
+        handler.setFormatter(logging.Formatter(thermal_control.LOG_FORMAT,
+            thermal_control.LOG_DATEFMT))
+        handler.addFilter(VirtualTimeFilter(clock))
+        root.addHandler(handler)
+    else:
+        root.addHandler(logging.NullHandler())
+    stdout = sys.stdout
+    devnull = open(os.devnull, 'w')
+    tc = None
+    try:
+        tc = thermal_control.ThermalControl(backend=plant, clock=clock)
+        tc.setpoint = setpoint
+        tc.storedata = logfile is not None
+        tc.lqg = "lqg" in servos
+        tc.mpc = "mpc" in servos
+        tc.pid = "pid" in servos
+        tc.cryo_pid = "cryo" in servos
+        job = PeriodicJob(tc.job_doservo, period, clock=clock)
+        tc.servo_job = job
+        nticks = int(duration/period)
+        nrecords = nticks//RECORD_EVERY
+        history = dict(time=np.empty(nrecords),
+            temps=np.empty( (nrecords, len(thermal_control.AIN_NAMES)) ),
+            true_temps=np.empty( (nrecords, len(thermal_control.AIN_NAMES)) ),
+            heaters=np.empty( (nrecords, len(thermal_control.HEATER_DIOS)) ))
+        for tick in range(nticks):
+            clock.advance_to(job.next_deadline if job.next_deadline is not None else clock())
+            #Discard the servo's print() output unless verbose.
+            if not verbose:
+                sys.stdout = devnull
+            try:
+                job.run()
+            finally:
+                sys.stdout = stdout
+            if tick % RECORD_EVERY == 0 and tick//RECORD_EVERY < nrecords:
+                ix = tick//RECORD_EVERY
+                snapshot = tc.get_snapshot()
+                history['time'][ix] = snapshot['time'] - start_time
+                history['temps'][ix] = snapshot['temps']
+                history['true_temps'][ix] = plant.temperatures()
+                history['heaters'][ix] = snapshot['heaters']
+        history['timing'] = job.summary()
+    finally:
+        #Don't leave a reconnection thread running after the replay.
+        if tc is not None:
+            tc.reconnector.stop()
+        devnull.close()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+            handler.close()
+        for handler in old_handlers:
+            root.addHandler(handler)
+        root.setLevel(old_level)
+    return history
+
+def compare(servo_sets, duration=86400., settle_time=None, **kwargs):
+    """Run replay for several sets of servos, and print the RMS deviation of
+    the true table and cryostat temperatures from the setpoint.
+
+    Parameters
+    ----------
+    servo_sets: list of strings
+        e.g. ["lqg", "pid cryo"]
+    duration: float (optional)
+        Simulated time in seconds for each run.
+    settle_time: float (optional)
+        Time to ignore at the start of each run. Defaults to duration/4.
+    kwargs:
+        Passed on to replay. Each run gets its own log file unless logfile is
+        given.
+
+    Returns
+    -------
+    histories: dict
+        The history from replay for each set of servos.
+    """
+    if settle_time is None:
+        settle_time = duration/4
+    setpoint = kwargs.get('setpoint', 25.0)
+    histories = {}
+    print("{:>12s} {:>12s} {:>12s} {:>12s}".format("Servos", "Table RMS", "Cryo RMS", "Wall time"))
+    for servos in servo_sets:
+        run_kwargs = dict(kwargs)
+        run_kwargs.setdefault('logfile', 'replay_' + '_'.join(servos.split()) + '.log')
+        t0 = time.time()
+        history = replay(servos, duration=duration, **run_kwargs)
+        settled = history['time'] >= settle_time
+        table_rms = np.sqrt(np.mean((history['true_temps'][settled,0] - setpoint)**2))
+        cryo_rms = np.sqrt(np.mean((history['true_temps'][settled,3] - setpoint)**2))
+        print("{:>12s} {:12.6f} {:12.6f} {:12.1f}".format(servos, table_rms, cryo_rms, time.time()-t0))
+        histories[servos] = history
+    return histories
@@ -1 +1 @@
-from server_zmq_socket import *
\ No newline at end of file
+from .server_zmq_socket import *
\ No newline at end of file
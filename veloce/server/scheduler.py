@@ -0,0 +1,128 @@
+"""Fixed-rate scheduling of server jobs.
+
+A PeriodicJob fires its job at exact multiples of its period on a monotonic
+clock, rather than sleeping for a fixed time between runs, so that time spent
+on I/O or handling commands doesn't make the period drift. If a run is more
+than one period late, the missed deadlines are counted and skipped, rather
+than running the job several times back to back.
+
+Every run records its start latency (jitter) relative to the deadline, the
+actual period since the previous run and the job duration, so that the loop
+rate can be compared with the rate assumed by the servo design.
+"""
+
+from __future__ import division, print_function
+
+import time
+import numpy as np
+
+#Python 2 has no monotonic clock in the time module.
+monotonic = getattr(time, 'monotonic', time.time)
+
+#Histogram bin edges in seconds. Jitter is always positive (we can't run
+#early), while the period error can have either sign.
+JITTER_BINS = np.array([0, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2,
+    0.1, 0.2, 0.5, np.inf])
+PERIOD_ERROR_BINS = np.concatenate((-JITTER_BINS[:0:-1], JITTER_BINS[1:]))
+
+class PeriodicJob:
+    def __init__(self, job, period, clock=monotonic):
+        """Run a job at a fixed rate.
+
+        Parameters
+        ----------
+        job: function
+            A function with no arguments. It may return a message to print.
+        period: float
+            The period in seconds.
+        clock: function (optional)
+            A monotonic clock, returning seconds.
+        """
+        self.job = job
+        self.period = period
+        self.clock = clock
+        self.__name__ = job.__name__
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Restart the schedule and clear all statistics."""
+        self.next_deadline = None
+        self.last_start = None
+        self.nruns = 0
+        self.nmissed = 0
+        self.jitter_hist = np.zeros(len(JITTER_BINS)-1, dtype=int)
+        self.period_hist = np.zeros(len(PERIOD_ERROR_BINS)-1, dtype=int)
+        #Sums for the mean and RMS of the period, and the mean duration.
+        self.period_sum = 0.
+        self.period_sumsq = 0.
+        self.nperiods = 0
+        self.max_jitter = 0.
+        self.duration_sum = 0.
+        self.max_duration = 0.
+
+    def time_to_deadline(self):
+        """Return the time in seconds until the job is next due (negative if
+        the job is late)."""
+        if self.next_deadline is None:
+            return 0.
+        return self.next_deadline - self.clock()
+
+    def set_period(self, period):
+        """Change the period, keeping the current deadline."""
+        self.period = period
+
+    def run(self):
+        """Run the job now, and schedule the next deadline.
+
+        Returns
+        -------
+        message:
+            Whatever the job returned.
+        missed: int
+            The number of deadlines that were skipped because we were late.
+        """
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        jitter = max(now - self.next_deadline, 0.)
+        missed = int(jitter // self.period)
+        self.next_deadline += (missed + 1) * self.period
+        self.nmissed += missed
+        self.jitter_hist[np.searchsorted(JITTER_BINS, jitter, side='right')-1] += 1
+        self.max_jitter = max(self.max_jitter, jitter)
+        if self.last_start is not None:
+            actual_period = now - self.last_start
+            ix = np.searchsorted(PERIOD_ERROR_BINS, actual_period - self.period, side='right')-1
+            self.period_hist[ix] += 1
+            self.period_sum += actual_period
+            self.period_sumsq += actual_period**2
+            self.nperiods += 1
+        self.last_start = now
+        message = self.job()
+        duration = self.clock() - now
+        self.duration_sum += duration
+        self.max_duration = max(self.max_duration, duration)
+        self.nruns += 1
+        return message, missed
+
+    def summary(self):
+        """Return a string summarising the timing statistics."""
+        lines = ["{}: period {:.4f}s, {:d} runs, {:d} missed deadlines".format(
+            self.__name__, self.period, self.nruns, self.nmissed)]
+        if self.nperiods > 0:
+            mean = self.period_sum/self.nperiods
+            rms = np.sqrt(max(self.period_sumsq/self.nperiods - mean**2, 0))
+            lines.append("Actual period: mean {:.6f}s, RMS {:.6f}s".format(mean, rms))
+        if self.nruns > 0:
+            lines.append("Jitter: max {:.6f}s. Duration: mean {:.6f}s, max {:.6f}s".format(
+                self.max_jitter, self.duration_sum/self.nruns, self.max_duration))
+        lines.append("Jitter histogram (s):")
+        lines.extend(_format_hist(JITTER_BINS, self.jitter_hist))
+        lines.append("Period error histogram (s):")
+        lines.extend(_format_hist(PERIOD_ERROR_BINS, self.period_hist))
+        return "\n".join(lines)
+
+def _format_hist(edges, counts):
+    """Format the non-empty bins of a histogram, one per line."""
+    return ["  [{:9.4f}, {:9.4f}): {:d}".format(edges[i], edges[i+1], counts[i])
+        for i in range(len(counts)) if counts[i] > 0]
@@ -7,16 +7,25 @@ It is based on Ian Price's ZMQ standards in his C++ codes.
 from __future__ import division, print_function
 
 import sys, time
+import math
+import threading
+import traceback
 import string
 import zmq
 import select
 from datetime import datetime
 import struct
 import pdb
+from .scheduler import PeriodicJob
 
 DEBUG=True
 SECRET_CODE = 314159
 DTYPES = {str:0, int:1, float:2, "image":3}
+#How often jobs without a period are run, and how often we check for input if
+#there are no jobs at all.
+IDLE_TIME = 0.1
+#How long to wait for the job thread to finish its current job on exit.
+JOB_THREAD_JOIN_TIMEOUT = 5.0
 
 class ServerSocket:
     #Some properties needed by multiple methods.
@@ -32,6 +41,7 @@ class ServerSocket:
             self.server.bind(tcpstring)
             self.poller = zmq.Poller()
             self.poller.register(self.server, zmq.POLLIN)
+            self.poller.register(sys.stdin, zmq.POLLIN)
             self.connected=True
         except: 
             print('ERROR: Could not initiate server socket.')
@@ -66,21 +76,103 @@ class ServerSocket:
         self.server.close
 
 #This medhod adds a new job to the queue.
-    def add_job(self, new_job):
+    def add_job(self, new_job, period=None):
+        """Add a job to be run by the server.
+        
+        Parameters
+        ----------
+        new_job: function
+            A function with no arguments, which may return a message to print.
+        period: float (optional)
+            If given, run the job at exact multiples of this many seconds (see
+            scheduler.PeriodicJob). Otherwise, run the job every IDLE_TIME, 
+            or whenever input is handled.
+            
+        Returns
+        -------
+        job: 
+            The PeriodicJob (which holds the timing statistics) or new_job.
+        """
+        if period is not None:
+            new_job = PeriodicJob(new_job, period)
         self.jobs.append(new_job)
+        return new_job
+
+#The longest we can wait for input before a job needs running.
+    def time_to_next_job(self):
+        timeout = IDLE_TIME
+        for the_job in self.jobs:
+            if isinstance(the_job, PeriodicJob):
+                timeout = min(timeout, the_job.time_to_deadline())
+        return max(timeout, 0)
+
+#Wait for up to timeout seconds for input, returning a list of inputs that are ready.
+    def wait_for_input(self, timeout):
+        if self.connected:
+            socks = dict(self.poller.poll(int(math.ceil(1000*timeout))))
+            return [s for s in self.input + [self.server] if socks.get(s) == zmq.POLLIN]
+        inputready,outputready,exceptready = select.select(self.input,[],[],timeout)
+        return inputready
+
+#Run all jobs that are due.
+    def run_jobs(self):
+        for the_job in self.jobs:
+            missed = 0
+            if isinstance(the_job, PeriodicJob):
+                if the_job.time_to_deadline() > 0:
+                    continue
+                run_job = the_job.run
+            else:
+                run_job = the_job
+            if DEBUG:
+                message=run_job()
+            else:
+                try: message=run_job()
+                except:
+                    raise UserWarning('Unable to do the '+the_job.__name__+' function. Check if the hardward needed is connected.')
+            if isinstance(the_job, PeriodicJob):
+                message, missed = message
+            if missed:
+                self.log("WARNING: {} missed {:d} deadline(s)".format(the_job.__name__, missed))
+            if message:
+                print(message)
+                #ISSUE: No way to get these messages to clients with the client-server model.
+                #Resolve this with a status command, e.g. returning json name-value pairs.
+                #for i in self.clients:
+                #    i.send(message)
+
+#This method runs the jobs on their own thread, until stop_jobs is set. An error in
+#a job is printed but doesn't stop the thread, as there is nobody to catch it.
+    def job_loop(self):
+        while not self.stop_jobs.wait(self.time_to_next_job()):
+            try:
+                self.run_jobs()
+            except:
+                self.log("ERROR in job thread:\n" + traceback.format_exc())
 
 #This method runs the jobs and waits for new input
-    def run(self):
+    def run(self, threaded_jobs=False):
+        """Handle input and run jobs until an exit command is received.
+        
+        Parameters
+        ----------
+        threaded_jobs: bool (optional)
+            If True, run the jobs on a separate thread, so that slow commands
+            never delay a job and a slow job never delays command handling. 
+            Jobs and commands then have to share any state with locks.
+        """
         self.log("Waiting for connection, number of clients connected: "+str(len(self.clients)))
+        if threaded_jobs:
+            self.stop_jobs = threading.Event()
+            self.job_thread = threading.Thread(target=self.job_loop, name="jobs")
+            self.job_thread.daemon = True
+            self.job_thread.start()
         running=True
         while running:
-            time.sleep(0.1)
-            inputready,outputready,exceptready = select.select(self.input,[],[],0)
-            #pdb.set_trace()
-            if self.connected:
-                socks = dict(self.poller.poll(10))
-                if self.server in socks and socks[self.server] == zmq.POLLIN:
-                    inputready.append(self.server)
+            if threaded_jobs:
+                inputready = self.wait_for_input(IDLE_TIME)
+            else:
+                inputready = self.wait_for_input(self.time_to_next_job())
             for s in inputready:  #loop through our array of sockets/inputs
                 data = self.socket_funct(s)
                 if data == -1:
@@ -118,17 +210,8 @@ class ServerSocket:
                             else:
                                 print("WARNING: Unknown response type!")
                                 s.send("")
-            for the_job in self.jobs:
-                if DEBUG:
-                    message=the_job()
-                else:
-                    try: message=the_job()
-                    except:
-                        raise UserWarning('Unable to do the '+the_job.__name__+' function. Check if the hardward needed is connected.')
-                if message:
-                    print(message)
-                    #ISSUE: No way to get these messages to clients with the client-server model.
-                    #Resolve this with a status command, e.g. returning json name-value pairs.
-                    #for i in self.clients:
-                    #    i.send(message)
-
+            if not threaded_jobs:
+                self.run_jobs()
+        if threaded_jobs:
+            self.stop_jobs.set()
+            self.job_thread.join(JOB_THREAD_JOIN_TIMEOUT)
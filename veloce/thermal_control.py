@@ -10,17 +10,24 @@ Version history
 """
 from __future__ import print_function, division
 import numpy as np
-from labjack import ljm
+try:
+    from labjack import ljm
+except ImportError:
+    #Without the LJM library, the conversions etc. here can still be used 
+    #for analysis, but we can't talk to a labjack.
+    ljm = None
 import time
 import numpy as np
 import logging
+import threading
+import functools
 
-#FIXME: we should of course import lqg_math and then refer to the variables as 
-#e.g.
-#lqg_math.lqg_dt
-#lqg_math.A_mat
-#...etc.
-import lqg_math_2_cap as lqg_math
+from . import lqg_math
+from . import mpc
+from . import model_reduction
+from . import ain_stream
+from . import thermistor
+from . import reconnect
 
 LABJACK_IP = "192.168.1.7"
 #Long sides, short sides, lid and base for FIO 0,2,3,4 respectively.
@@ -33,8 +40,17 @@ AIN_LABELS = ["Table", "Lower", "Upper", "Cryostat", "Aux 1", "Aux 2", "Aux 3"]
 AIN_NAMES = ["AIN0", "AIN2", "AIN4", "AIN6", "AIN8", "AIN10", "AIN12"] #Temperature analog input names
 
 #Calibrated using calibrate.py @25.3C - see M-Robertson for details
-T_OFFSETS = [-0., 0.01531123, 0.06008029, 0.01812604, 0.06101344, 0.02001082, 0.06289097] 
+T_OFFSETS = np.array([-0., 0.01531123, 0.06008029, 0.01812604, 0.06101344, 0.02001082, 0.06289097])
+#Voltage to temperature lookup table for all channels.
+TEMP_TABLE = thermistor.ThermistorTable(offsets=T_OFFSETS)
 HEATER_MAX = [67.2,28.8,13.09]
+#The AIN_NAMES index of each LQG measurement, and the LQG output driving each
+#of HEATER_DIOS.
+LQG_SENSORS = [2,0,1,3]
+LQG_HEATERS = [0,0,0,1,2]
+#Hankel singular value cutoff in K for reducing the full plant model for the
+#LQG design (see model_reduction), or None to use the model in lqg_math.
+LQG_HSV_CUTOFF = None
 LJ_REST_TIME = 0.01
 
 #Derivative of the temperature in K/s with the heater on full.
@@ -54,24 +70,99 @@ NESTED_GAIN = 8.0
 NESTED_TIME_CONST = 3600.0 #About 10 hours.
 TABLE_DEADZONE = 0.05
 
+#How long a command waits for the servo thread to release the labjack.
+IO_LOCK_TIMEOUT = 2.0
+#Number of ticks in a row with no channels read before we assume that the
+#connection is lost and start re-opening it.
+RECONNECT_AFTER_TICKS = 3
+#Age in servo timesteps (at the start of a tick) beyond which a sample is too
+#old for the LQG estimator to use.
+SAMPLE_MAX_AGE = 1.0
+
 LOG_FILENAME = 'thermal_control.log'
+LOG_FORMAT = '%(asctime)s, %(created)f, %(levelname)s,  %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
 #Set the following to logging.INFO on or logging.DEBUG on
-logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG, \
-    format='%(asctime)s, %(created)f, %(levelname)s,  %(message)s', \
-    datefmt='%Y-%m-%d %H:%M:%S')
+LOG_LEVEL = logging.DEBUG
+
+def labjack_command(cmd):
+    """Decorator for commands that use the labjack handle. The command holds 
+    io_lock while it runs, so that it can't interleave with the I/O of a servo 
+    tick running on another thread. If a tick holds the lock for longer than 
+    IO_LOCK_TIMEOUT, the command gives up rather than blocking."""
+    @functools.wraps(cmd)
+    def locked_cmd(self, the_command):
+        if not self.io_lock.acquire(timeout=IO_LOCK_TIMEOUT):
+            return "ERROR: Labjack busy - servo tick did not finish."
+        try:
+            return cmd(self, the_command)
+        finally:
+            self.io_lock.release()
+    return locked_cmd
 
 class ThermalControl:
-    def __init__(self, ip=None):
-        if not ip:
-            self.ip = LABJACK_IP
+    def __init__(self, ip=None, backend=None, clock=time.time):
+        """The servo loop and its commands.
+        
+        Parameters
+        ----------
+        ip: string (optional)
+            The labjack IP address. Defaults to LABJACK_IP.
+        backend: module or object (optional)
+            Provides the labjack.ljm functions used here. Defaults to the real 
+            LJM library, but can be e.g. a fake_ljm.FakeLJM to run without 
+            hardware.
+        clock: function (optional)
+            Returns the time in seconds, e.g. a replay.VirtualClock.
+        """
+        #Log to LOG_FILENAME unless logging is already set up (e.g. by replay).
+        #This is done here rather than on import, so that importing the module
+        #(e.g. in the worker processes of a tuning sweep) doesn't open the log.
+        logging.basicConfig(filename=LOG_FILENAME, level=LOG_LEVEL, \
+            format=LOG_FORMAT, datefmt=LOG_DATEFMT)
+        self.ip = ip if ip else LABJACK_IP
+        self.ljm = backend if backend is not None else ljm
+        self.clock = clock
+        #When the servo runs on its own thread, io_lock protects the labjack
+        #handle, and state_lock protects the snapshot and the servo mode flags.
+        self.io_lock = threading.RLock()
+        self.state_lock = threading.Lock()
+        #An ain_stream.AINStream when in streaming acquisition mode.
+        self.stream = None
+        #The server's scheduler.PeriodicJob for job_doservo, for timing statistics.
+        self.servo_job = None
+        #Re-opens the labjack connection in the background after I/O errors.
+        self.reconnector = reconnect.Reconnector(self.reconnect)
+        self.current_heaters = np.zeros(len(HEATER_DIOS))
+        self.heater_registers = np.zeros(len(HEATER_DIOS), dtype=int)
+        #The labjack handle, or None if it has never been opened.
+        self.handle = None
         
         self.cmd_open("")
         
         #WARNING: This really should read from the labjack, and set the heater values
         #appropriately
-        self.cmd_initialize("")
+        if self.labjack_open:
+            try:
+                self.cmd_initialize("")
+            except self.ljm.LJMError as e:
+                #Leave it to the reconnector (started below) to set up the
+                #labjack, rather than failing to start.
+                print("Unable to initialize labjack: {}".format(e))
+                logging.error("Unable to initialize labjack, reconnecting in the background: {}".format(e))
+                self.labjack_open = False
         self.voltages=99.9*np.ones(len(AIN_NAMES))
+        #The voltages that self.temps and self.resistances were computed from.
+        self.conversion_voltages = None
+        self.ain_ok = np.zeros(len(AIN_NAMES), dtype=bool)
+        #The time each channel was last read, the start time of the last servo
+        #tick, and the number of timesteps since the tick before.
+        self.ain_times = -np.inf*np.ones(len(AIN_NAMES))
+        self.tick_time = None
+        self.tick_nsteps = 1
+        self.nfailed_ticks = 0
         self.lqg=False
+        self.mpc=False
         self.use_lqg=True
         
         #This turns logging on or off.
@@ -81,8 +172,22 @@ class ThermalControl:
         self.last_print=-1
         self.ulqg = 0
         self.lqgverbose = False
-        self.x_est = np.zeros((11,1))
-        self.u = np.zeros((3,1))
+        #The LQG design in use, and the parameters it was (or is being) made 
+        #from. New designs are computed on a worker thread by retune, and
+        #swapped in at the start of a servo tick.
+        self.lqg_params = dict(Q=lqg_math.Q_mat.astype(float), R=lqg_math.R_mat.astype(float),
+            dt=lqg_math.lqg_dt, random_rate=lqg_math.T_RANDOM_RATE, 
+            noise_rate=lqg_math.T_NOISE_RATE, hsv_cutoff=LQG_HSV_CUTOFF)
+        if LQG_HSV_CUTOFF is not None:
+            self.lqg_params['Q'] = None
+        self.lqg_design = self.make_design(self.lqg_params)
+        self.lqg_design['generation'] = 0
+        self.dt = self.lqg_design['lqg_dt']
+        self.use_step(lqg_math.LQGStep(self.lqg_design, HEATER_MAX),
+            mpc.MPCStep(self.lqg_design, HEATER_MAX))
+        self.pending_design = None
+        self.design_generation = 0
+        self.design_error = None
 
         #PID Constants
         self.pid=False
@@ -100,11 +205,18 @@ class ThermalControl:
         self.cryo_pid_gain = CRYO_PID_GAIN_HZ/CRYO_TEMP_DERIV
         self.cryo_pid_i = 0.5*CRYO_PID_GAIN_HZ**2/CRYO_TEMP_DERIV
         self.cryo_pid_int = 0.
+        self.publish_snapshot()
+        #If the labjack couldn't be opened, keep trying in the background. This
+        #has to wait until everything above exists, as the reconnection runs
+        #on its own thread.
+        if not self.labjack_open:
+            self.reconnector.start()
     
+    @labjack_command
     def cmd_open(self, the_command):
         """Open the socket connection to the labjack"""
         try:
-            self.handle = ljm.openS("ANY", "ANY", self.ip)
+            self.handle = self.ljm.openS("ANY", "ANY", self.ip)
         except:
             print("Unable to open labjack {}".format(self.ip))
             self.labjack_open=False
@@ -113,6 +225,7 @@ class ThermalControl:
         return "Labjack Connection Opened"
 
     #Our user or socket commands
+    @labjack_command
     def cmd_initialize(self, the_command):
         """Set the heaters to zero, and set the local copy of the heater values
         (in the range 0-1) to 0. 
@@ -122,38 +235,103 @@ class ThermalControl:
         """
         if not self.labjack_open:
             raise UserWarning("Labjack not open!")
-            
+        #The analog inputs can't be reconfigured while streaming.
+        self.stop_stream()
+        with self.state_lock:
+            self.current_heaters = np.zeros(len(HEATER_DIOS))
+        self.configure_pwm()
+        self.configure_ain()
+        return "Labjack Initialized"
+
+    def configure_pwm(self):
+        """Set up the PWM clock and the heater outputs, with each heater 
+        starting at its value in self.current_heaters."""
         #Set FIO 0,2,3 as an example. Note that FIO 1 isn't allowed to have PWM:
         #https://labjack.com/support/datasheets/t7/digital-io/extended-features
         #(and FIO4 upwards is only available via one of the DB connectors)
-        self.current_heaters = np.zeros(len(HEATER_DIOS))
+        with self.state_lock:
+            values = (self.current_heaters * PWM_MAX).astype(int)
         aNames = ["DIO_EF_CLOCK0_DIVISOR", "DIO_EF_CLOCK0_ROLL_VALUE", "DIO_EF_CLOCK0_ENABLE"]
         #Set the first number below to 256 for testing on a multimeter.
         #Set to 16 for normal operation (5Hz)
         aValues = [16, PWM_MAX, 1]
-        for dio in HEATER_DIOS:
+        for dio, value in zip(HEATER_DIOS, values):
             aNames.extend(["DIO"+dio+"_EF_INDEX", "DIO"+dio+"_EF_CONFIG_A", "DIO"+dio+"_EF_ENABLE"])
-            aValues.extend([0,0,1])
+            aValues.extend([0,int(value),1])
 
         #See labjack example python scripts - looks pretty simple!
         numFrames = len(aNames)
-        results = ljm.eWriteNames(self.handle, numFrames, aNames, aValues)
-        
-        #Now set up the Analog input
+        results = self.ljm.eWriteNames(self.handle, numFrames, aNames, aValues)
+        #The DIOx_EF_CONFIG_A values last written to the labjack.
+        self.heater_registers = values
+
+    def configure_ain(self):
+        """Set up the analog inputs."""
         #Note that the settling time is set to default (0), which isn't actually
         #zero microsecs.
         aNames = ["AIN_ALL_NEGATIVE_CH", "AIN_ALL_RANGE", "AIN_ALL_RESOLUTION_INDEX", "AIN_ALL_SETTLING_US"]
         aValues = [1, 1, 10, 0]
         numFrames = len(aNames)
-        results = ljm.eWriteNames(self.handle, numFrames, aNames, aValues)
-        return "Labjack Initialized"
+        results = self.ljm.eWriteNames(self.handle, numFrames, aNames, aValues)
         
+    @labjack_command
     def cmd_close(self, the_command):
         """Close the connection to the labjack"""
-        ljm.close(self.handle)
-        self.labjack_open=True
+        #Don't let a background reconnection re-open it.
+        self.reconnector.stop()
+        self.stop_stream()
+        if self.handle is not None:
+            self.ljm.close(self.handle)
+            self.handle = None
+        self.labjack_open=False
         return "Labjack connection closed."
+
+    def reconnect(self):
+        """Re-open the labjack connection. This is run by self.reconnector on
+        its own thread, and raises an exception if the labjack can't be reached.
         
+        If the labjack kept running while we were disconnected, its PWM clock 
+        is left alone so that the heaters don't glitch, and the heater values
+        staged since the connection dropped are written on the next servo tick.
+        Otherwise (e.g. after a power cycle) the heaters are reconfigured,
+        starting at their last values rather than at zero.
+        
+        If the reconnector is stopped (e.g. by cmd_close) while the labjack is
+        being opened, the new connection is closed again rather than used.
+        """
+        #Opening can take seconds, so don't hold io_lock for it.
+        handle = self.ljm.openS("ANY", "ANY", self.ip)
+        with self.io_lock:
+            if self.reconnector.stop_event.is_set():
+                self.ljm.close(handle)
+                return
+            try:
+                self.stop_stream()
+                if self.handle is not None:
+                    try:
+                        self.ljm.close(self.handle)
+                    except self.ljm.LJMError:
+                        pass
+                self.handle = handle
+                clock = self.ljm.eReadNames(self.handle, 2, ["DIO_EF_CLOCK0_ENABLE", "DIO_EF_CLOCK0_ROLL_VALUE"])
+                if clock[0] == 1 and clock[1] == PWM_MAX:
+                    #Force every heater to be written on the next flush.
+                    self.heater_registers[:] = -1
+                else:
+                    self.configure_pwm()
+                self.configure_ain()
+            except:
+                #Whatever went wrong, don't leak the new handle.
+                self.handle = None
+                try:
+                    self.ljm.close(handle)
+                except self.ljm.LJMError:
+                    pass
+                raise
+            self.labjack_open = True
+        print("Labjack connection re-opened")
+        
+    @labjack_command
     def cmd_heater(self, the_command):
         """Set a single heater to a single PWM output"""
         the_command = the_command.split()
@@ -179,17 +357,47 @@ class ThermalControl:
         #Check that the labjack is open
         if not self.labjack_open:
             raise UserWarning("Labjack not open!")
-        self.set_heater(int(the_command[1]), float(the_command[2]))
+        with self.state_lock:
+            self.set_heater(int(the_command[1]), float(the_command[2]))
+        self.flush_heaters()
         #import pdb; pdb.set_trace()
         return "Done."
         
+    @labjack_command
+    def cmd_streamstart(self, the_command):
+        """Sample the analog inputs continuously in LJM stream mode, and use the
+        average of all samples since the last servo tick as each tick's voltage."""
+        if not self.labjack_open:
+            raise UserWarning("Labjack not open!")
+        self.stop_stream()
+        self.stream = ain_stream.AINStream(self.handle, AIN_NAMES, backend=self.ljm)
+        try:
+            scan_rate = self.stream.start()
+        except self.ljm.LJMError as e:
+            self.stop_stream()
+            return "ERROR: Could not start stream: {}".format(e)
+        return "Streaming at {:6.2f} scans per second".format(scan_rate)
+
+    @labjack_command
+    def cmd_streamstop(self, the_command):
+        """Stop stream mode and go back to reading the analog inputs once per tick."""
+        self.stop_stream()
+        return "Stream stopped"
+
+    def stop_stream(self):
+        """Stop the stream, if there is one."""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
     def cmd_setgain(self, the_command):
         """Set the PID gain"""
         the_command = the_command.split()
         if len(the_command)!=2:
             return "Useage: SETGAIN [newgain]"
         else:
-            self.pid_gain = float(the_command[1])
+            with self.state_lock:
+                self.pid_gain = float(the_command[1])
             return "Gain set to {:6.5f}".format(self.pid_gain)
 
     def cmd_seti(self, the_command):
@@ -198,7 +406,8 @@ class ThermalControl:
         if len(the_command)!=2:
             return "Useage: SETI [newi]"
         else:
-            self.pid_i = float(the_command[1])
+            with self.state_lock:
+                self.pid_i = float(the_command[1])
             return "PID I term set to {:6.5f}".format(self.pid_i)
 
     def cmd_setnestgain(self, the_command):
@@ -207,7 +416,8 @@ class ThermalControl:
         if len(the_command)!=2:
             return "Useage: SETNESTGAIN [newgain]"
         else:
-            self.pid_gain = float(the_command[1])
+            with self.state_lock:
+                self.pid_gain = float(the_command[1])
             return "Nested servo gain set to {:6.5f}".format(self.nested_gain)
 
     def cmd_setnesti(self, the_command):
@@ -216,29 +426,39 @@ class ThermalControl:
         if len(the_command)!=2:
             return "Useage: SETNESTI [newi]"
         else:
-            self.nested_i = float(the_command[1])
+            with self.state_lock:
+                self.nested_i = float(the_command[1])
             return "PID I term set to {:6.5f}".format(self.nested_i)      
           
     def cmd_getvs(self, the_command):
         """Return the current voltages as a string.
         """
-        return (', {:9.6f}'*len(AIN_NAMES)).format(*self.voltages)[2:]
+        voltages = self.get_snapshot()['voltages']
+        return (', {:9.6f}'*len(AIN_NAMES)).format(*voltages)[2:]
 
     def cmd_gettemp(self, the_command):
         """Return the temperature to the client as a string"""
-        temps = self.gettemps()
+        temps = self.get_snapshot()['temps']
         return (', {:9.6f}'*len(AIN_NAMES)).format(*temps)[2:]
         #return "{0:9.6f}, {0:9.6f} {0:9.6f}".format(self.gettemp(0), self.gettemp(1), self.gettemp(2))
         
     def cmd_getresistance(self, the_command):
         """Return the temperature to the client as a string"""
-        resistances = self.getresistances()
+        resistances = self.get_snapshot()['resistances']
         return (', {:12.9f}'*len(AIN_NAMES)).format(*resistances)[2:]
         #return "{0:9.6f}, {0:9.6f} {0:9.6f}".format(self.gettemp(0), self.gettemp(1), self.gettemp(2))
 
+    def cmd_servotiming(self, the_command):
+        """Return the servo loop period, jitter and missed deadline statistics"""
+        if self.servo_job is None:
+            return "Servo loop is not running on a fixed-rate schedule."
+        return self.servo_job.summary()
+
     def cmd_lqgstart(self, the_command):
-        self.pid = False
-        self.lqg = True
+        with self.state_lock:
+            self.pid = False
+            self.mpc = False
+            self.lqg = True
     
     def cmd_lqgsilent(self, the_command):
         self.lqgverbose = False
@@ -257,24 +477,48 @@ class ThermalControl:
         return ""
 
     def cmd_lqgstop(self, the_command):
-        self.lqg = False 
+        with self.state_lock:
+            self.lqg = False
         return ""
 
     def cmd_pidstart(self, the_command):
-        self.pid = True
-        self.lqg = False
+        with self.state_lock:
+            self.pid = True
+            self.lqg = False
+            self.mpc = False
         return ""
 
     def cmd_pidstop(self, the_command):
-        self.pid = False
+        with self.state_lock:
+            self.pid = False
+        return ""
+
+    def cmd_mpcstart(self, the_command):
+        """Start the constrained model-predictive controller, which uses the
+        LQG design but respects the heater limits."""
+        with self.state_lock:
+            self.pid = False
+            self.lqg = False
+            self.mpc = True
+        return ""
+
+    def cmd_mpcstop(self, the_command):
+        with self.state_lock:
+            self.mpc = False
         return ""
 
+    def cmd_mpctiming(self, the_command):
+        """Return the MPC solve time and iteration statistics"""
+        return self.mpc_step.summary()
+
     def cmd_cryostart(self, the_command):
-        self.cryo_pid = True
+        with self.state_lock:
+            self.cryo_pid = True
         return ""
 
     def cmd_cryostop(self, the_command):
-        self.cryo_pid = False
+        with self.state_lock:
+            self.cryo_pid = False
         return ""
 
     def cmd_setpoint(self, the_command):
@@ -283,12 +527,220 @@ class ThermalControl:
         if len(the_command)!=2:
             return "Useage: SETPOINT [new setpoint]"
         else:
-            self.setpoint = float(the_command[1])
+            with self.state_lock:
+                self.setpoint = float(the_command[1])
             return "Temperature setpoing set to {:6.5f}".format(self.setpoint)
 
+    def cmd_setq(self, the_command):
+        """Set the LQG weight for one state"""
+        the_command = the_command.split()
+        if len(the_command)!=3:
+            return "Useage: SETQ [state index] [weight]"
+        try:
+            ix = int(the_command[1])
+            weight = float(the_command[2])
+        except:
+            return "ERROR: state index must be an integer and weight a number"
+        Q = self.lqg_params['Q']
+        if Q is None:
+            #The weights are the defaults for the model in use.
+            with self.state_lock:
+                if self.lqg_design['generation'] != self.design_generation:
+                    return "ERROR: a new LQG design is being computed, try again later"
+                Q = self.lqg_design['Q_mat']
+        Q = Q.copy()
+        if (ix < 0) or (ix >= len(Q)):
+            return "ERROR: state index out of range"
+        Q[ix,ix] = weight
+        return self.retune(Q=Q)
+
+    def cmd_setr(self, the_command):
+        """Set the LQG weight for one heater output"""
+        the_command = the_command.split()
+        if len(the_command)!=3:
+            return "Useage: SETR [heater index] [weight]"
+        try:
+            ix = int(the_command[1])
+            weight = float(the_command[2])
+        except:
+            return "ERROR: heater index must be an integer and weight a number"
+        R = self.lqg_params['R'].copy()
+        if (ix < 0) or (ix >= len(R)):
+            return "ERROR: heater index out of range"
+        R[ix,ix] = weight
+        return self.retune(R=R)
+
+    def cmd_setnoise(self, the_command):
+        """Set the LQG process and measurement noise, in K per second"""
+        the_command = the_command.split()
+        if len(the_command)!=3:
+            return "Useage: SETNOISE [process noise] [measurement noise]"
+        try:
+            random_rate = float(the_command[1])
+            noise_rate = float(the_command[2])
+        except:
+            return "ERROR: noise values must be numbers"
+        return self.retune(random_rate=random_rate, noise_rate=noise_rate)
+
+    def cmd_setdt(self, the_command):
+        """Set the servo timestep, and recompute the LQG design for it"""
+        the_command = the_command.split()
+        if len(the_command)!=2:
+            return "Useage: SETDT [timestep in sec]"
+        try:
+            dt = float(the_command[1])
+        except:
+            return "ERROR: timestep must be a number"
+        if dt <= 0:
+            return "ERROR: timestep must be positive"
+        return self.retune(dt=dt)
+
+    def cmd_setreduction(self, the_command):
+        """Build the LQG design from the full plant model reduced by balanced 
+        truncation, or from the model in lqg_math"""
+        the_command = the_command.split()
+        if len(the_command)!=2:
+            return "Useage: SETREDUCTION [Hankel singular value cutoff in K, or 0 for the lqg_math model]"
+        try:
+            cutoff = float(the_command[1])
+        except:
+            return "ERROR: cutoff must be a number"
+        if cutoff < 0:
+            return "ERROR: cutoff must not be negative"
+        #The state weights change with the model, so go back to its defaults.
+        if cutoff == 0:
+            return self.retune(hsv_cutoff=None, Q=lqg_math.Q_mat.copy())
+        return self.retune(hsv_cutoff=cutoff, Q=None)
+
+    def cmd_lqgstatus(self, the_command):
+        """Return the LQG design in use, and whether a new one is being computed"""
+        with self.state_lock:
+            design = self.lqg_design
+            generation = self.design_generation
+            error = self.design_error
+        if design['hsv_cutoff'] is None:
+            model = "Model: lqg_math, {:d} states".format(len(design['A_cont']))
+        else:
+            model = "Model: balanced truncation at {:.3g}K, {:d} states, error bound {:.3g}K".format(
+                design['hsv_cutoff'], len(design['A_cont']), design['error_bound'])
+        lines = [model, "Timestep: {:6.3f}s".format(design['lqg_dt']),
+            "Q diagonal: " + ", ".join(["{:.4g}".format(q) for q in np.diag(design['Q_mat'])]),
+            "R diagonal: " + ", ".join(["{:.4g}".format(r) for r in np.diag(design['R_mat'])])]
+        if error is not None:
+            lines.append("Last design failed: " + error)
+        elif design['generation'] != generation:
+            lines.append("A new design is being computed.")
+        return "\n".join(lines)
+
+    def retune(self, **changes):
+        """Start computing a new LQG design on a worker thread, with some of 
+        the parameters in self.lqg_params changed. See lqg_math.lqg_design. 
+        
+        The servo keeps running with the old design, and job_doservo swaps in
+        the new one (keeping x_est) at the start of the first tick after it is
+        ready. If retune is called again before then, the older design is 
+        discarded.
+        """
+        with self.state_lock:
+            params = dict(self.lqg_params)
+            params.update(changes)
+            self.lqg_params = params
+            self.design_generation += 1
+            generation = self.design_generation
+        worker = threading.Thread(target=self.compute_design, args=(generation, params))
+        worker.daemon = True
+        worker.start()
+        return "Computing new LQG design..."
+
+    def compute_design(self, generation, params):
+        """Worker thread target for retune."""
+        try:
+            design = self.make_design(params)
+            step = lqg_math.LQGStep(design, HEATER_MAX)
+            mpc_step = mpc.MPCStep(design, HEATER_MAX)
+        except Exception as e:
+            logging.error("LQG design failed: {}".format(e))
+            with self.state_lock:
+                if generation == self.design_generation:
+                    self.design_error = str(e)
+            return
+        design['generation'] = generation
+        with self.state_lock:
+            if generation == self.design_generation:
+                self.pending_design = (design, step, mpc_step)
+                self.design_error = None
+
+    def make_design(self, params):
+        """Make the LQG design for a set of parameters like self.lqg_params,
+        with the model reduced from the full plant model if hsv_cutoff is set
+        (see model_reduction.reduced_model)."""
+        params = dict(params)
+        cutoff = params.pop('hsv_cutoff')
+        error_bound = None
+        if cutoff is not None:
+            params['model'] = model_reduction.reduced_model(cutoff, HEATER_MAX,
+                LQG_HEATERS, LQG_SENSORS)
+            error_bound = params['model']['error_bound']
+        design = lqg_math.lqg_design(**params)
+        design['hsv_cutoff'] = cutoff
+        design['error_bound'] = error_bound
+        return design
+
+    def swap_design(self):
+        """If a new LQG design is ready, start using it. The state estimate 
+        x_est is kept, as it doesn't depend on the design."""
+        with self.state_lock:
+            pending = self.pending_design
+            self.pending_design = None
+        if pending is None:
+            return
+        design, step, mpc_step = pending
+        if step.x.shape == self.lqg_step.x.shape:
+            step.set_state(self.lqg_step.x, self.lqg_step.u)
+            if mpc_step.U.shape == self.mpc_step.U.shape:
+                mpc_step.U[:] = self.mpc_step.U
+        else:
+            logging.warning("LQG state size changed, resetting the state estimate")
+        self.lqg_design = design
+        self.use_step(step, mpc_step)
+        if design['lqg_dt'] != self.dt:
+            self.dt = design['lqg_dt']
+            if self.servo_job is not None:
+                self.servo_job.set_period(self.dt)
+        logging.info("New LQG design in use, timestep {:6.3f}".format(self.dt))
+
+    def use_step(self, step, mpc_step):
+        """Use an lqg_math.LQGStep for lqg_servo, and an mpc.MPCStep for 
+        mpc_servo. self.x_est and self.u are views of the LQGStep's state and 
+        output."""
+        self.lqg_step = step
+        self.mpc_step = mpc_step
+        self.x_est = step.x.reshape( (-1,1) )
+        self.u = step.u.reshape( (-1,1) )
+        self.ulqg = self.u
+
+    def publish_snapshot(self):
+        """Store a copy of the state that commands report, so that commands 
+        running on another thread never see a half-finished servo tick."""
+        temps, resistances = self.gettemps(), self.getresistances()
+        with self.state_lock:
+            self.snapshot = dict(time=self.clock(), voltages=self.voltages.copy(),
+                temps=temps, resistances=resistances,
+                ain_ok=self.ain_ok.copy(), ain_times=self.ain_times.copy(), 
+                heaters=self.current_heaters.copy(), x_est=self.x_est.copy(), u=self.u.copy())
+
+    def get_snapshot(self):
+        """Return the state published at the end of the last servo tick."""
+        with self.state_lock:
+            return self.snapshot
+
     def set_heater(self, ix, fraction):
         """Set the heater to a fraction of its full range.
         
+        This only stages the new value in self.current_heaters. Nothing is sent
+        to the labjack until flush_heaters is called, which job_doservo does 
+        once at the end of every servo tick.
+        
         Parameters
         ----------
         ix: int
@@ -297,139 +749,244 @@ class ThermalControl:
         fraction: float
             The fractional heater current (via PWM).
         """
-        #self.u[ix] = fraction
-        aNames = ["DIO"+HEATER_DIOS[ix]+"_EF_CONFIG_A"]
-        aValues = [int(fraction * PWM_MAX)]
-        numFrames = len(aNames)
-        results = ljm.eWriteNames(self.handle, numFrames, aNames, aValues)
-        #import pdb; pdb.set_trace()
+        self.current_heaters[ix] = fraction
+
+    def flush_heaters(self):
+        """Write all staged heater values to the labjack in a single eWriteNames
+        call. Registers whose DIOx_EF_CONFIG_A value hasn't changed since the 
+        last successful write are skipped.
+        
+        Returns
+        -------
+        nwritten: int
+            The number of registers written.
+        """
+        with self.state_lock:
+            values = (self.current_heaters * PWM_MAX).astype(int)
+        changed = np.where(values != self.heater_registers)[0]
+        if len(changed)==0:
+            return 0
+        aNames = ["DIO"+HEATER_DIOS[ix]+"_EF_CONFIG_A" for ix in changed]
+        aValues = [int(values[ix]) for ix in changed]
+        self.ljm.eWriteNames(self.handle, len(aNames), aNames, aValues)
+        #Only remember what was written once the write has succeeded, so that
+        #a failed write is retried on the next flush.
+        self.heater_registers[changed] = values[changed]
+        return len(changed)
+
+    def acquire_voltages(self):
+        """Update self.voltages from the stream if we are streaming, or by reading
+        the analog inputs otherwise, and self.ain_times for the channels that
+        were read. Channels that fail are not retried: they are just missing
+        this tick. If no channel can be read for RECONNECT_AFTER_TICKS ticks in
+        a row, we start re-opening the labjack connection in the background. 
+        Until that succeeds, no channels are read.
+        
+        Returns
+        -------
+        ok: numpy bool array
+            True for each channel in AIN_NAMES with a new voltage.
+        """
+        if not self.labjack_open:
+            return np.zeros(len(AIN_NAMES), dtype=bool)
+        if self.stream is not None and self.stream.error is not None:
+            print("Stream failed, reverting to polling: {}".format(self.stream.error))
+            logging.error("Stream failed, reverting to polling: {}".format(self.stream.error))
+            self.stop_stream()
+        if self.stream is not None:
+            #Channels with no new samples this tick keep their last voltage.
+            ok = self.read_stream_voltages()
+            for ix in np.where(~ok)[0]:
+                logging.warning("No streamed samples for temperature {:d}".format(ix))
+        else:
+            ok = self.read_voltages()
+            for ix in np.where(~ok)[0]:
+                print("Could not read temperature {:d} one time".format(ix))
+                logging.warning("Could not read temperature {:d} one time".format(ix))
+            if np.any(ok):
+                self.nfailed_ticks = 0
+            else:
+                self.nfailed_ticks += 1
+                if self.nfailed_ticks >= RECONNECT_AFTER_TICKS:
+                    print("Trying to re-open labjack connection...")
+                    logging.error("Labjack connection lost, reconnecting in the background")
+                    self.nfailed_ticks = 0
+                    self.labjack_open = False
+                    self.reconnector.start()
+        self.ain_times[ok] = self.clock()
+        return ok
+
+    def read_voltages(self):
+        """Read all AIN_NAMES into self.voltages with a single eReadNames 
+        transaction, i.e. one Modbus round trip per servo tick.
+        
+        If the batched read fails, each channel is read individually so that 
+        the failing channels can be identified, and every channel that can be
+        read is still updated. Channels that fail keep their previous voltage.
+        
+        Returns
+        -------
+        ok: numpy bool array
+            True for each channel in AIN_NAMES that was read successfully.
+        """
+        ok = np.ones(len(AIN_NAMES), dtype=bool)
+        try:
+            self.voltages[:] = self.ljm.eReadNames(self.handle, len(AIN_NAMES), AIN_NAMES)
+            return ok
+        except self.ljm.LJMError:
+            pass
+        for ix, ain_name in enumerate(AIN_NAMES):
+            try:
+                self.voltages[ix] = self.ljm.eReadName(self.handle, ain_name)
+            except self.ljm.LJMError:
+                ok[ix] = False
+        return ok
 
-    def gettemp(self, ix, invert_voltage=True):
-        """Return one temperature as a float. See Roberton's the
+    def read_stream_voltages(self):
+        """Set self.voltages to the average of all streamed samples that arrived
+        since the last servo tick.
         
-        v_out = v_in * [ R_t/(R_T + R) - R/(R_T + R) ]
-        R_T - R = (R_T + R) * (v_out/v_in)
-        R_T*(1 - (v_out/v_in)) = R * (1 + (v_out/v_in))
-        R_T = R * (v_in + v_out) / (v_in - v_out)
+        Returns
+        -------
+        ok: numpy bool array
+            True for each channel in AIN_NAMES with at least one new sample.
+        """
+        voltages, nsamples = self.stream.average()
+        ok = nsamples > 0
+        self.voltages[ok] = voltages[ok]
+        return ok
+
+    def gettemp(self, ix, invert_voltage=True, voltages=None):
+        """Return one temperature as a float. See gettemps.
         
         Parameters
         ----------
         ix: int
             Index of the sensor to be provided.
+        voltages: numpy array (optional)
+            Voltages to use instead of self.voltages.
             
         Returns
         -------
         temp: float
             Temperature in Celcius
         """
-        ##uses converts voltage temperature, resistance implemented
-        R = 10000
-        Vin = 5
         if invert_voltage:
-            voltage = -self.voltages[ix]
-        else:
-            voltage = self.voltages[ix]
-        resistance = R * (Vin + voltage)/(Vin - voltage)
-        #resistance = (2*R*self.voltage)/(Vin - self.voltage)
-        #resistance += R
-        aVal = 0.00113259149597421
-        bVal = 0.000233514798680064
-        cVal = 0.00000009045521729374
-        temp_inv = aVal + bVal*np.log(resistance) + cVal*((np.log(resistance))**3)
-        tempKelv = 1/(temp_inv)
-        tempCelc = tempKelv -273.15
-        return tempCelc - T_OFFSETS[ix]
-        
-    def getresistance(self, ix, invert_voltage=True):
-        """Return one resistance as a float. See Roberton's the
-        
-        v_out = v_in * [ R_t/(R_T + R) - R/(R_T + R) ]
-        R_T - R = (R_T + R) * (v_out/v_in)
-        R_T*(1 - (v_out/v_in)) = R * (1 + (v_out/v_in))
-        R_T = R * (v_in + v_out) / (v_in - v_out)
+            return self.gettemps(voltages)[ix]
+        if voltages is None:
+            voltages = self.voltages
+        resistances = thermistor.bridge_resistances(voltages, invert_voltage=False)
+        return thermistor.steinhart_hart(resistances[ix]) - T_OFFSETS[ix]
+        
+    def getresistance(self, ix, invert_voltage=True, voltages=None):
+        """Return one resistance as a float. See getresistances.
         
         Parameters
         ----------
         ix: int
             Index of the sensor to be provided.
+        voltages: numpy array (optional)
+            Voltages to use instead of self.voltages.
             
         Returns
         -------
-        temp: float
-            Temperature in Celcius
+        resistance: float
+            Resistance in Ohms
         """
-        ##uses converts voltage temperature, resistance implemented
-        R = 10000
-        Vin = 5
         if invert_voltage:
-            voltage = -self.voltages[ix]
-        else:
-            voltage = self.voltages[ix]
-        resistance = R * (Vin + voltage)/(Vin - voltage)
-        return resistance
+            return self.getresistances(voltages)[ix]
+        if voltages is None:
+            voltages = self.voltages
+        return thermistor.bridge_resistances(voltages, invert_voltage=False)[ix]
 
-    def gettemps(self):
-        """Get all temperatures.
+    def update_conversions(self):
+        """Recompute the cached resistances and temperatures, if self.voltages
+        has changed since they were last computed."""
+        if self.conversion_voltages is not None and \
+            np.array_equal(self.voltages, self.conversion_voltages):
+            return
+        resistances = thermistor.bridge_resistances(self.voltages)
+        temps = TEMP_TABLE.temps(self.voltages)
+        #Consumers share these arrays, so make sure that none of them can
+        #modify them.
+        resistances.flags.writeable = False
+        temps.flags.writeable = False
+        self.resistances = resistances
+        self.temps = temps
+        self.conversion_voltages = self.voltages.copy()
+
+    def gettemps(self, voltages=None):
+        """Get all temperatures. 
+        
+        For self.voltages, the temperatures are only computed once each time 
+        the voltages change, so every consumer in a servo tick shares the same 
+        (read-only) array.
+        
+        Parameters
+        ----------
+        voltages: numpy array (optional)
+            Voltages to use instead of self.voltages.
         
         Returns
         -------
-        temps: list
-            A list of temperatures for all sensors.
+        temps: numpy array
+            Temperatures for all sensors in Celcius.
         """
-        temps = ()
-        for ix in range(0, (len(AIN_NAMES))):
-            temps += (self.gettemp(ix),)
-        return temps
+        if voltages is not None:
+            return TEMP_TABLE.temps(voltages)
+        self.update_conversions()
+        return self.temps
 
-    def getresistances(self):
-        """Get all temperatures.
+    def getresistances(self, voltages=None):
+        """Get all thermistor resistances. See thermistor.bridge_resistances. 
+        
+        As for gettemps, these are cached until self.voltages changes.
+        
+        Parameters
+        ----------
+        voltages: numpy array (optional)
+            Voltages to use instead of self.voltages.
         
         Returns
         -------
-        temps: list
-            A list of temperatures for all sensors.
+        resistances: numpy array
+            Resistances for all sensors in Ohms.
         """
-        resistances = ()
-        for ix in range(0, (len(AIN_NAMES))):
-            resistances += (self.getresistance(ix),)
-        return resistances
+        if voltages is not None:
+            return thermistor.bridge_resistances(voltages)
+        self.update_conversions()
+        return self.resistances
 
     def lqg_servo(self):
+        """Update the LQG state estimate and heater outputs. The estimator 
+        only uses the temperatures that were read this tick, and not more than
+        SAMPLE_MAX_AGE timesteps before it. Without any (e.g. while the 
+        labjack is reconnecting), we run on the estimator's prediction alone.
+        If ticks were late, the estimate is predicted over the missed 
+        timesteps."""
+        step = self.lqg_step
         #Store the current temperature in y.
-        y = np.array([ [self.gettemp(2) - self.setpoint] ,[self.gettemp(0) - self.setpoint],[self.gettemp(1)- self.setpoint],[self.gettemp(3)- self.setpoint]])   
-        #Based on this measurement, what is the next value of x_i+1 est?
-        x_est_new = np.dot(lqg_math.A_mat, self.x_est)
-        #import pdb; pdb.set_trace()
-        x_est_new += np.dot(lqg_math.B_mat, self.u)
-        dummy = y - np.dot(lqg_math.C_mat, (np.dot(lqg_math.A_mat, self.x_est) + np.dot(lqg_math.B_mat, self.u)))
-        x_est_new += np.dot(lqg_math.K_mat, dummy)
-        self.x_est = x_est_new #x_i+1 has now become xi
-        # Now find u
-        self.u = -np.dot(lqg_math.L_mat, self.x_est)
-        self.ulqg = self.u
-        #offset because heater can't be negative
-        fraction = [0]*len(HEATER_MAX)
-        for i in range(0, len(HEATER_MAX)):
-	    fraction[i] = self.u[i]/HEATER_MAX[i]
-	    
+        np.take(self.gettemps(), LQG_SENSORS, out=step.y)
+        step.y -= self.setpoint
+        valid = self.ain_ok[LQG_SENSORS] & \
+            (self.tick_time - self.ain_times[LQG_SENSORS] <= SAMPLE_MAX_AGE*self.dt)
+        fractions = step.update(valid, self.tick_nsteps)
         #Setting the Heaters
-        for i, frac in enumerate(fraction):
-    	    if frac < 0:
-	        self.u[i,0] = 0
-	        fraction[i] = 0
-	    elif fraction > 1:
-	        self.u[i,0] = HEATER_MAX[i]
-	        fraction[i] = 1
-    
-        for i, frac in enumerate(fraction):
-	    if i == 0:
-	        self.set_heater(0,frac)
-	        self.set_heater(1,frac)
-	        self.set_heater(2,frac)
-	    if i == 1:
-	        self.set_heater(3,frac)
-	    if i == 2:
-	        self.set_heater(4, frac) 
+        np.take(fractions, LQG_HEATERS, out=self.current_heaters)
+
+    def mpc_servo(self):
+        """Update the LQG state estimate as for lqg_servo, then set the heater
+        outputs by solving the constrained problem in mpc.MPCStep."""
+        step = self.lqg_step
+        np.take(self.gettemps(), LQG_SENSORS, out=step.y)
+        step.y -= self.setpoint
+        valid = self.ain_ok[LQG_SENSORS] & \
+            (self.tick_time - self.ain_times[LQG_SENSORS] <= SAMPLE_MAX_AGE*self.dt)
+        step.estimate(valid, self.tick_nsteps)
+        step.u[:] = self.mpc_step.solve(step.x)
+        np.divide(step.u, step.umax, out=step.fractions)
+        np.take(step.fractions, LQG_HEATERS, out=self.current_heaters)
+
     def pid_servo(self):
         #Set the Enclosure set point according to the table temperature
         t_tab = self.gettemp(0)
@@ -441,7 +998,7 @@ class ThermalControl:
         if t_tab < self.setpoint - TABLE_DEADZONE:
             t_tab = self.setpoint - TABLE_DEADZONE
             self.nested_int=0
-        self.nested_int += lqg_math.lqg_dt*(self.setpoint - t_tab)
+        self.nested_int += self.dt*(self.setpoint - t_tab)
         self.enc_setpoint = self.setpoint + self.nested_gain*(self.setpoint - t_tab) \
             + self.nested_i*self.nested_int
             
@@ -451,7 +1008,7 @@ class ThermalControl:
         #Start the Enclosue PID loop. For the integral component, reset 
         #all integral terms whenever the heater hits the rail.
         t0 = self.gettemp(1)
-        self.pid_ints[0] += lqg_math.lqg_dt*(self.enc_setpoint - t0)
+        self.pid_ints[0] += self.dt*(self.enc_setpoint - t0)
         h0 = 0.5 + self.pid_gain*(self.enc_setpoint - t0) + self.pid_i*self.pid_ints[0]
         if (h0<0):
             h0=0
@@ -462,7 +1019,7 @@ class ThermalControl:
             self.pid_ints[0]=0
             self.nested_int=0
         t1 = self.gettemp(2)
-        self.pid_ints[1] += lqg_math.lqg_dt*(self.enc_setpoint - t1)
+        self.pid_ints[1] += self.dt*(self.enc_setpoint - t1)
         h1 = 0.5 + self.pid_gain*(self.enc_setpoint - t1) + self.pid_i*self.pid_ints[1]
         if (h1<0):
             h1=0
@@ -484,7 +1041,7 @@ class ThermalControl:
 
     def cryo_servo(self):
         t2 = self.gettemp(3)
-        self.cryo_pid_int += lqg_math.lqg_dt*(self.setpoint - t2)
+        self.cryo_pid_int += self.dt*(self.setpoint - t2)
         h2 = 0.5 + self.cryo_pid_gain*(self.setpoint - t2) + self.cryo_pid_i*self.cryo_pid_int
         if (h2<0):
             h2=0
@@ -499,66 +1056,90 @@ class ThermalControl:
     def job_doservo(self):
         """Servo loop job
         
-        Every lqg_math.lgq_dt, we read the voltages into our local variables, then
+        Every self.dt, we read the voltages into our local variables, then
         compute the temperatures. Note that gettemp therefore doesn't actually get
         the temperatures, it just computs them from the last time voltages were read
         in.
         
+        This job doesn't wait between ticks itself, so it has to be added to the
+        server with period=self.dt to run at the rate the LQG matrices
+        assume.
         """
-        time.sleep(lqg_math.lqg_dt) 
-        for ix, ain_name in enumerate(AIN_NAMES):
+        self.swap_design()
+        tick_time = self.clock()
+        if self.tick_time is not None:
+            self.tick_nsteps = max(int(round((tick_time - self.tick_time)/self.dt)), 1)
+        self.tick_time = tick_time
+
+        #Don't wait for a command that is using the labjack: carry on with
+        #the last voltages instead.
+        if self.io_lock.acquire(False):
             try:
-                self.voltages[ix] = ljm.eReadName(self.handle, ain_name)
-            except:
-                print("Could not read temperature {:d} one time".format(ix))
-                logging.warning("Could not read temperature {:d} one time".format(ix))
-                #Now try again
-                try:
-                    self.voltages[ix] = ljm.eReadName(self.handle, ain_name)
-                except:
-                    print("Trying to re-open labjack connection...")
-                    print(self.cmd_close(""))
-                    print(self.cmd_open(""))
-                    print(self.cmd_initialize(""))
-                    try:
-                        self.voltages[ix] = ljm.eReadName(self.handle, ain_name)
-                    except:
-                        print("Giving up reading temperature {:d}".format(ix))
-                        logging.error("Giving up reading temperature {:d}".format(ix))
+                ok = self.acquire_voltages()
+            finally:
+                self.io_lock.release()
+        else:
+            logging.warning("Labjack busy with a command, no new voltages this tick")
+            ok = np.zeros(len(AIN_NAMES), dtype=bool)
+        self.ain_ok = ok
                     
-        if time.time() > self.last_print + 1:
-            self.last_print=time.time()
-
-        #The servo can be LQG or PID. When either is set to true, the other is set to 
-        #false.
-        if self.lqg:
-            self.lqg_servo()
-
-            #Special real-time debugging mode for printing to screen
-        if self.lqgverbose == 1:
-            for i in range(0,len(self.ulqg)):
-                print("Heater " + str(i) + " Wattage:" + str(self.ulqg[i]))
-            print("Calculated Ambient Temperature {:9.4f}".format(self.x_est[0,0] + self.setpoint))
-            print("Calculated Cryostat Inside Temperature {:9.4f}".format(self.x_est[1,0] + self.setpoint))
-            print("Calculated Floor Temperature {:9.4f}".format(self.x_est[2,0] + self.setpoint))
+        if self.clock() > self.last_print + 1:
+            self.last_print=self.clock()
+
+        #Commands on the server thread change the gains, setpoint, servo mode
+        #and heater values, so the whole servo computation holds state_lock.
+        #io_lock is never taken while holding state_lock.
+        with self.state_lock:
+            lqg, pid, cryo_pid, use_mpc = self.lqg, self.pid, self.cryo_pid, self.mpc
+
+            #The servo can be LQG or PID. When either is set to true, the other is set to 
+            #false.
+            if lqg:
+                self.lqg_servo()
+            elif use_mpc:
+                self.mpc_servo()
+
+                #Special real-time debugging mode for printing to screen
+            if self.lqgverbose == 1:
+                for i in range(0,len(self.ulqg)):
+                    print("Heater " + str(i) + " Wattage:" + str(self.ulqg[i]))
+                print("Calculated Ambient Temperature {:9.4f}".format(self.x_est[0,0] + self.setpoint))
+                print("Calculated Cryostat Inside Temperature {:9.4f}".format(self.x_est[1,0] + self.setpoint))
+                print("Calculated Floor Temperature {:9.4f}".format(self.x_est[2,0] + self.setpoint))
                 
             
-            logging.debug('HEATERS, ' + (len(self.u)*", {:9.6f}").format(*self.u.flatten())[2:])
+                logging.debug('HEATERS, ' + (len(self.u)*", {:9.6f}").format(*self.u.flatten())[2:])
                 
-        if self.pid:
-            h0, h1 = self.pid_servo()
-        else:
-	    h0 = 0
-            h1 = 0    
+            #The PID loops have no estimator, so without new voltages they hold
+            #their heater values rather than integrating stale temperatures.
+            fresh = np.any(ok)
+            if pid and fresh:
+                h0, h1 = self.pid_servo()
+            else:
+                h0 = 0
+                h1 = 0    
  
                 
-            #Also start the cryostat PID loop, which is completely independent.
-        if self.cryo_pid:
-            h2 = self.cryo_servo()
-        else:
-            h2 = 0    
+                #Also start the cryostat PID loop, which is completely independent.
+            if cryo_pid and fresh:
+                h2 = self.cryo_servo()
+            else:
+                h2 = 0    
+
+        #Send all of this tick's heater values in one transaction. If a command
+        #is using the labjack, or it is reconnecting, they are sent on a later
+        #tick instead.
+        if self.labjack_open and self.io_lock.acquire(False):
+            try:
+                self.flush_heaters()
+            except self.ljm.LJMError:
+                print("Could not write heater values")
+                logging.warning("Could not write heater values")
+            finally:
+                self.io_lock.release()
+        self.publish_snapshot()
 
-        if (self.cryo_pid or self.pid) and self.storedata: 
+        if (cryo_pid or pid) and self.storedata: 
             logging.debug('HEATPID, {0:5.3f}, {1:5.3f}, {2:5.3f}, {3:5.3f}, {4:5.3f}, {5:5.3f}'.format(h0,h1,h2,self.pid_ints[0],self.pid_ints[1],self.cryo_pid_int))
         
         if self.lqgverbose:
@@ -567,8 +1148,9 @@ class ThermalControl:
             print("Lower Temperature: {0:9.6f}".format(self.gettemp(1)))
             print("Upper Temperature: {0:9.6f}".format(self.gettemp(2)))
             print("Cryostat Temperature: {0:9.6f}".format(self.gettemp(3)))
-            print("Estimated ti1:")
-            print(int(self.x_est[4,0]) + self.setpoint)
+            if len(self.x_est) > 4:
+                print("Estimated ti1:")
+                print(int(self.x_est[4,0]) + self.setpoint)
             
         if self.storedata:
             logging.info('TEMPS, ' + self.cmd_gettemp(""))
@@ -32,7 +32,7 @@ class CommandList():
     
         This returns a string containing the response, or a -1 if a quit is commanded.'''
         m = self.module_with_functions
-        the_functions = dict(open=m.cmd_open,initialize=m.cmd_initialize,close=m.cmd_close,heater=m.cmd_heater,setgain=m.cmd_setgain,seti=m.cmd_seti,setnestgain=m.cmd_setnestgain,setnesti=m.cmd_setnesti,getvs=m.cmd_getvs,gettemp=m.cmd_gettemp,getresistance=m.cmd_getresistance,lqgstart=m.cmd_lqgstart,lqgsilent=m.cmd_lqgsilent,lqgverbose=m.cmd_lqgverbose,startrec=m.cmd_startrec,stoprec=m.cmd_stoprec,lqgstop=m.cmd_lqgstop,pidstart=m.cmd_pidstart,pidstop=m.cmd_pidstop,cryostart=m.cmd_cryostart,cryostop=m.cmd_cryostop,setpoint=m.cmd_setpoint)
+        the_functions = dict(open=m.cmd_open,initialize=m.cmd_initialize,close=m.cmd_close,heater=m.cmd_heater,streamstart=m.cmd_streamstart,streamstop=m.cmd_streamstop,setgain=m.cmd_setgain,seti=m.cmd_seti,setnestgain=m.cmd_setnestgain,setnesti=m.cmd_setnesti,getvs=m.cmd_getvs,gettemp=m.cmd_gettemp,getresistance=m.cmd_getresistance,servotiming=m.cmd_servotiming,lqgstart=m.cmd_lqgstart,lqgsilent=m.cmd_lqgsilent,lqgverbose=m.cmd_lqgverbose,startrec=m.cmd_startrec,stoprec=m.cmd_stoprec,lqgstop=m.cmd_lqgstop,pidstart=m.cmd_pidstart,pidstop=m.cmd_pidstop,mpcstart=m.cmd_mpcstart,mpcstop=m.cmd_mpcstop,mpctiming=m.cmd_mpctiming,cryostart=m.cmd_cryostart,cryostop=m.cmd_cryostop,setpoint=m.cmd_setpoint,setq=m.cmd_setq,setr=m.cmd_setr,setnoise=m.cmd_setnoise,setdt=m.cmd_setdt,setreduction=m.cmd_setreduction,lqgstatus=m.cmd_lqgstatus)
         commands = the_command.split()
         #Make sure we ignore case.
         commands[0] = commands[0].lower()
@@ -40,7 +40,7 @@ class CommandList():
             return ""
         if commands[0] == "help":
             if (len(commands) == 1):
-                return '** Available Commands **\nexit\nopen\ninitialize\nclose\nheater\nsetgain\nseti\nsetnestgain\nsetnesti\ngetvs\ngettemp\ngetresistance\nlqgstart\nlqgsilent\nlqgverbose\nstartrec\nstoprec\nlqgstop\npidstart\npidstop\ncryostart\ncryostop\nsetpoint\n'
+                return '** Available Commands **\nexit\nopen\ninitialize\nclose\nheater\nstreamstart\nstreamstop\nsetgain\nseti\nsetnestgain\nsetnesti\ngetvs\ngettemp\ngetresistance\nservotiming\nlqgstart\nlqgsilent\nlqgverbose\nstartrec\nstoprec\nlqgstop\npidstart\npidstop\nmpcstart\nmpcstop\nmpctiming\ncryostart\ncryostop\nsetpoint\nsetq\nsetr\nsetnoise\nsetdt\nsetreduction\nlqgstatus\n'
             elif commands[1] in the_functions:
                 td=pydoc.TextDoc()
                 return td.docroutine(the_functions[commands[1]])
@@ -0,0 +1,467 @@
+"""The lumped-element thermal model of the Veloce enclosure.
+
+This is the 15 state model fitted by simulator_output_func, with states:
+
+0       Ambient temperature (an input, so it has no dynamics)
+1       Internal air temperature
+2-8     Plates 1 to 7 (see the side numbers below), where 7 is the optical table
+9-14    Heaters on plates 1 to 6
+
+The inputs are the powers in W of the 6 heater groups, and the outputs are the
+sensors on plates 2 (upper), 4 (lower) and 7 (table).
+"""
+from __future__ import print_function, division
+import collections
+import functools
+import threading
+import numpy as np
+
+#Heater supply voltage and individual heater resistance in Ohms. The heaters
+#are wired in series strings of 6.
+HEATER_VOLTAGE = 23.68
+HEATER_RESISTANCE = 10
+STRING_POWER = HEATER_VOLTAGE**2/(HEATER_RESISTANCE*6)
+
+N_STATES = 15
+OUTPUT_LABELS = ["Upper", "Lower", "Table"]
+#Index of the optical table state.
+TABLE_STATE = 8
+
+#Cryostat heat capacity (J/K) and conductance to the optical table (W/K), as
+#for lqg_math.
+CRYO_CAPACITANCE = 8605.48
+CRYO_CONDUCTANCE = 10.0
+#The sensors of plant_model, in thermal_control.AIN_NAMES order.
+PLANT_OUTPUT_LABELS = ["Table", "Lower", "Upper", "Cryostat"]
+
+#The conductances (W/K) and heat capacities (J/K) of the thermal network in
+#network_model. See enclosure_model for their meanings.
+NETWORK_ELEMENTS = ['gah1', 'gah2', 'gah3', 'gah4', 'gah5', 'gah6',
+    'ghp1', 'ghp2', 'ghp3', 'ghp4', 'ghp5', 'ghp6',
+    'gpb1', 'gpb2', 'gpb3', 'gpb4', 'gpb5', 'gpb6', 'gpb7',
+    'gpa1', 'gpa2', 'gpa3', 'gpa4', 'gpa5', 'gpa6',
+    'gps2', 'gps4', 'gps7', 'gsb2', 'gsb4', 'gsb7',
+    'gih1', 'gih2', 'gih3', 'gih4', 'gih5', 'gih6',
+    'g12', 'g14', 'g15', 'g16', 'g17', 'g23', 'g25', 'g26', 'g34', 'g35', 
+    'g36', 'g37', 'g45', 'g46', 'g47', 'g57', 'g67',
+    'ch1', 'ch2', 'ch3', 'ch4', 'ch5', 'ch6',
+    'cp1', 'cp2', 'cp3', 'cp4', 'cp5', 'cp6', 'cp7', 'cb']
+
+#The hand-reduced model used by lqg_math, with states ambient, cryostat 
+#inside, floor, then sides 1 (top/lid), 2 (table), 3 (bottom/base) and 4 
+#(cryostat). 
+#Heater Ambient Conductances
+# The bottom has 18 heater, and the top has 42 Heaters, so define an individual heater conductance and multiply these
+individual_gah = 0.0011
+#Heater to plate conductance
+#Use an individual conductance and then multiply by the number of heaters
+individual_ghp = 192.6
+LQG_MODEL_ELEMENTS = collections.OrderedDict([
+    ('gah1', individual_gah*42),
+    ('gah3', individual_gah*18),
+    ('ghp1', individual_ghp*42),
+    ('ghp3', individual_ghp*18),
+    #Plate Ambient conductances, set individual conductances for these
+    ('gpa1', 5.5206),
+    ('gpa3', 2.1756),
+    #Lid to base conductance
+    ('g13', 5.046),
+    #Lid to table radiative coupling
+    ('g12', 3.6),
+    #Table to Base conductance
+    ('g23', 4.5),
+    #Table cryostat conductance
+    ('g24', 10),
+    #Bottom to floor conductance
+    ('gpf3', 3.661),
+    #Conductance from outside of cryostat to inside temperature
+    ('gpc4', 0.0657),
+    #Capacitances
+    ('cp1', 82898.64),
+    ('cp2', 234879.48),
+    ('cp3', 46054.8),
+    ('cp4', 8605.48)])
+
+#Imaginary step for complex-step derivatives. There is no subtraction, so 
+#this can be tiny.
+COMPLEX_STEP = 1e-30
+#Number of models kept by each memoised model builder.
+MODEL_CACHE_SIZE = 64
+
+def memoise(builder):
+    """Decorator for model builders, that caches the arrays they return keyed
+    on their (hashable) arguments. The arrays are made read-only, as they 
+    are shared by every caller."""
+    cache = collections.OrderedDict()
+    lock = threading.Lock()
+    @functools.wraps(builder)
+    def cached_builder(*args):
+        with lock:
+            result = cache.pop(args, None)
+        if result is None:
+            result = builder(*args)
+            for array in result:
+                array.setflags(write=False)
+        with lock:
+            cache[args] = result
+            while len(cache) > MODEL_CACHE_SIZE:
+                cache.popitem(last=False)
+        return result
+    cached_builder.cache = cache
+    return cached_builder
+
+def default_constants():
+    """"Some initial/default values of constants"""
+    constants = 27.6*np.ones( (30) )
+    constants[0] = 192.6 #individual_ghp
+    constants[1] = 264.0594 #gpb_total
+    constants[2] = 74.2374 #gpb7
+    constants[3] = 7.6962 #gpa_total
+    constants[4] = 0.4599 #gps
+    constants[5] = 0.003 #gsb
+    constants[6] = 85.719  #individual_gih
+    constants[7] = 1366.6667 #linear conductance lid
+    constants[8] = 1.125 #optical table conductance to other sides
+    constants[9] = 29.8553 #individual_ch
+    constants[10] = 82898.64 #lid cp
+    constants[11] = 234879.48 #table cp
+    constants[12] = 2387.88 #cb
+    constants[13] = 46054.8 #bottom cp
+    constants[14] = 1366.6667 #bottom linear conductance
+    constants[15] = 22.0 #Guess of ambient temperature.
+    return constants
+
+def heater_powers(fractions):
+    """Convert the PWM fractions of the long, short, lid and base heater 
+    channels (thermal_control.HEATER_DIOS[:4]) to the powers of the 6 model 
+    heater groups. 
+    
+    The long and short sides have one string of 6 heaters each, while the top 
+    and bottom have 3 strings in parallel.
+    
+    Parameters
+    ----------
+    fractions: numpy array
+        Fractions with shape (4, ...)
+        
+    Returns
+    -------
+    powers: numpy array
+        Powers in W with shape (6, ...)
+    """
+    long_side, short_side, lid, base = np.asarray(fractions, dtype=float)*STRING_POWER
+    return np.array([long_side, 3*lid, long_side, 3*base, short_side, short_side])
+
+def enclosure_model(constants):
+    """Build the continuous-time state space model of the enclosure. Models 
+    are cached, so this is fast for constants it has seen recently.
+    
+    Parameters
+    ----------
+    constants: numpy array
+        The model parameters, as for simulator_output_func.simulate. Only the
+        first 15 (conductances and capacitances) are used.
+    
+    Returns
+    -------
+    A_sim, B_sim, C_sim: numpy array
+        The (15,15) state matrix, (15,6) input matrix and (3,15) output matrix.
+        These are read-only.
+    """
+    return _enclosure_model(tuple([float(c) for c in constants[:15]]))
+
+@memoise
+def _enclosure_model(constants):
+    return _network_model(enclosure_elements(constants), None)
+
+def enclosure_model_derivatives(constants):
+    """Differentiate the enclosure model with respect to the constants, by 
+    the complex-step method. This is exact to rounding error, unlike finite
+    differences. Derivatives are cached like the models.
+    
+    Parameters
+    ----------
+    constants: numpy array
+        The model parameters, as for enclosure_model.
+    
+    Returns
+    -------
+    dA, dB, dC: numpy array
+        The (15,15,15), (15,15,6) and (15,3,15) derivatives of A_sim, B_sim and
+        C_sim, with the first index the constant. These are read-only.
+    """
+    return _enclosure_model_derivatives(tuple([float(c) for c in constants[:15]]))
+
+@memoise
+def _enclosure_model_derivatives(constants):
+    derivatives = []
+    for ix in range(len(constants)):
+        perturbed = np.array(constants, dtype=complex)
+        perturbed[ix] += 1j*COMPLEX_STEP
+        model = _network_model.__wrapped__(enclosure_elements(perturbed), None)
+        derivatives.append([matrix.imag/COMPLEX_STEP for matrix in model])
+    return tuple([np.array(derivative) for derivative in zip(*derivatives)])
+
+def enclosure_elements(constants):
+    """Return the values of NETWORK_ELEMENTS for the enclosure, from the first
+    15 model constants (see enclosure_model). This works for complex constants
+    too."""
+    individual_ghp = constants[0]
+    gpb_total = constants[1]
+    gpb7 = constants[2]
+    gpa_total = constants[3]
+    gps = constants[4]
+    gsb = constants[5]
+    individual_gih = constants[6]
+    linear_cond = constants[7]
+    table_cond = constants[8]
+    individual_ch = constants[9]
+    lid_total = constants[10]
+    cp7 = constants[11]
+    cb = constants[12]
+    cp4 = constants[13]
+    linear_cond_bottom = constants[14]
+    #DEFINE SIMULATION LOOP MATRIX CONSTANTS
+    #a lot of sides can be determined relative to each other by surface area ratios
+    # long sides(1.94 x 0.66), short sides (1.54 x 0.66), top/bottom (1.54 x 1.94)
+    total_sa = 2*(1.94*0.66 + 1.54*0.66 + 1.94*1.54)
+    #----individual fractions of total system qauntity that each side type should have based on surface area ratio
+    #----side number designations----see doco - curently M.R. thesis
+    #SIDE       NUMBER      COUPLING
+    #LONG A     1           2,4,5,6,7
+    #TOP        2           1,3,5,6
+    #LONG B     3           2,4,5,6,7
+    #BOTTOM     4           1,3,5,6,7
+    #SHORT A    5           1,2,3,4,7
+    #SHORT B    6           1,2,3,4,7
+    #OPTICAL    7           1,3,4,5,6       
+    long_frac = 1.94*0.66/total_sa #sides 1,3
+    short_frac = 1.54*0.66/total_sa #sides 5,6
+    topbottom_frac = 1.94*1.54/total_sa #sides 2,4
+
+    #Gah - conductance between heater and the ambient - model as 0 for simplictiy, add if needed later
+    gah1 = gah2 = gah3 = gah4 = gah5 = gah6 = 0 
+
+    #ghp - conductance between heaters and plates, defined by the conductance for an individual heater and # of heaters on each of the sides W/K
+    #individual_ghp = 192.6
+    ghp1 = ghp3 = ghp5 = ghp6 = 6*individual_ghp
+    ghp2 = ghp4 = 18*individual_ghp
+
+    #Gpb - conductance between plate and internal air temperature t_b
+    #defined by estimated total system values W/K
+    #gpb_total = 264.0594
+    gpb1 = gpb3 = long_frac*gpb_total
+    gpb5 = gpb6 = short_frac*gpb_total
+    gpb2 = gpb4 = topbottom_frac*gpb_total
+
+    #gpb7 = 74.2374
+    #gpa - conduction between plates and ambient W/K
+    #gpa_total = 7.6962
+    gpa1 = gpa3 = long_frac*gpa_total
+    gpa5 = gpa6 = short_frac*gpa_total
+    gpa2 = gpa4 = topbottom_frac*gpa_total
+    #Gps - conduction between plate and sensor W/K
+    #gps = 0.4599
+    gps2 = gps4 = gps7 = gps
+    #Gsb - conduction between sensor and enclosure air temperature W/K
+    #gsb = 0.003
+    gsb2 = gsb4 = gsb7 = gsb
+    #Gih - conduction betweeen internal heater temperature and exterior of heater casing W/K
+    #individual_gih = 85.719
+    gih1 = gih3 = gih5 = gih6 = 6*individual_gih
+    gih2 = gih4 = 18*individual_gih
+    #gnm - conduction between sides and optical table, proportional to the length of intersection between the sides for the sides while optical table is different
+    #this assumes thickness of joins are the same for all sides
+    #linear_cond = 1,366.6667 #W/K/mm
+    #--three different types
+    #but bottom is different since it is bolted on
+    #BOTTOM
+    g14 = g34 = 1940*linear_cond_bottom*10**(-3)
+    g45 = g46 = 1540*linear_cond_bottom*10**(-3)
+    #1940mm
+    g23 = g12 = 1940*linear_cond*10**(-3)
+    #1540mm
+    g25 = g26 = 1540*linear_cond*10**(-3)
+    #660mm
+    g15 = g35 = g36 = g16 = 660*linear_cond*10**(-3)
+    #optical table will couple differently
+    #table_cond =1.125
+    g17 = g27 = g37 = g47 = g57 = g67 = table_cond
+
+    #ch - heater thermal capacitances J/K
+    #individual_ch = 29.8552579523659
+    ch1 = ch3 = ch5 = ch6 = individual_ch*6 #heater thermal capacitance of the short and long sides
+    ch2 = ch4 = individual_ch*18 #heater thermal capacitance of top and bottom, 3x greater due to 3x more heaters
+    
+    #cp - plate thermal capacitances J/K
+    #cp_total = 40000
+    #in testing bottom plate was found to exhibit different behaviour to the top plate, so define different area ratios
+    lid_sa = 1.94*1.54 + 2*(1.94*0.66 + 1.54*0.66) # surface area of lid of enclosure
+    cp2 = (1.94*1.54/lid_sa)*lid_total
+    cp1 = cp3 = (1.94*0.66/lid_sa)*lid_total
+    cp5 = cp6 = (1.54*0.66/lid_sa)*lid_total
+    #cp7 = 100000 #optical table approx 200kg of Al
+    #cb - Internal air thermal capacitance J/K
+    #cb = 2387.88 #J/K
+    #dt_damp ambient noise dampening constant
+    #dt_damp = 1000
+    
+    elements = locals()
+    return tuple([elements[name] for name in NETWORK_ELEMENTS])
+
+def network_model(elements, dt_damp=None):
+    """Build the continuous-time state space model of the thermal network, 
+    from the value of each of its elements. Models are cached, so this is fast
+    for values it has seen recently.
+    
+    Parameters
+    ----------
+    elements: dict
+        The value of each of NETWORK_ELEMENTS.
+    dt_damp: float (optional)
+        Damping time of the ambient temperature. By default, it has no 
+        dynamics.
+    
+    Returns
+    -------
+    A_sim, B_sim, C_sim: numpy array
+        The (15,15) state matrix, (15,6) input matrix and (3,15) output matrix.
+        These are read-only.
+    """
+    return _network_model(tuple([float(elements[name]) for name in NETWORK_ELEMENTS]), dt_damp)
+
+@memoise
+def _network_model(values, dt_damp):
+    (gah1, gah2, gah3, gah4, gah5, gah6, 
+        ghp1, ghp2, ghp3, ghp4, ghp5, ghp6, 
+        gpb1, gpb2, gpb3, gpb4, gpb5, gpb6, gpb7, 
+        gpa1, gpa2, gpa3, gpa4, gpa5, gpa6, 
+        gps2, gps4, gps7, gsb2, gsb4, gsb7, 
+        gih1, gih2, gih3, gih4, gih5, gih6, 
+        g12, g14, g15, g16, g17, g23, g25, g26, g34, g35, 
+        g36, g37, g45, g46, g47, g57, g67, 
+        ch1, ch2, ch3, ch4, ch5, ch6, 
+        cp1, cp2, cp3, cp4, cp5, cp6, cp7, cb) = values
+    ambient_rate = 0 if dt_damp is None else -1/dt_damp
+    A_sim= np.array([ [ambient_rate, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,], 
+            [0, (-gpb1 - gpb2 - gpb3 - gpb4 - gpb5 - gpb6 - gpb7 - gsb2 + gsb2**2/(gps2 + gsb2) - gsb4 + gsb4**2/(gps4 + gsb4) - gsb7 + gsb7**2/(gps7 + gsb7))/cb, gpb1/cb, (gpb2 + (gps2*gsb2)/(gps2 + gsb2))/cb, gpb3/cb, (gpb4 + (gps4*gsb4)/(gps4 + gsb4))/cb, gpb5/cb, gpb6/cb, (gpb7 + (gps7*gsb7)/(gps7 + gsb7))/cb,0,0,0,0,0,0],
+            [(((gah1*ghp1)/(gah1 + ghp1 + gih1) + gpa1))/cp1, (gpb1)/cp1, (-g12 - g14 - g15 - g16 - g17 - ghp1 + ghp1**2/(gah1 + ghp1 + gih1) - gpa1 - gpb1)/cp1, g12/cp1, 0, g14/cp1, g15/cp1, g16/cp1, g17/cp1, (ghp1*gih1)/(cp1*(gah1 + ghp1 + gih1)), 0, 0, 0, 0, 0],
+            [((gah2*ghp2)/(gah2 + ghp2 + gih2) + gpa2)/cp2, (gpb2 + (gps2*gsb2)/(gps2 + gsb2))/cp2, g12/cp2, (-g12 - g23 - g25 - g26 - ghp2 + ghp2**2/(gah2 + ghp2 + gih2) - gpa2 - gpb2 - gps2 + gps2**2/(gps2 + gsb2))/cp2, g23/cp2, 0, g25/cp2, g26/cp2, 0, 0, (ghp2*gih2)/(cp2*(gah2 + ghp2 + gih2)), 0, 0, 0, 0],
+            [((gah3*ghp3)/(gah3 + ghp3 + gih3) + gpa3)/cp3, gpb3/cp3, 0, g23/cp3, (-g23 - g34 - g35 - g36 - g37 - ghp3 + ghp3**2/(gah3 + ghp3 + gih3) - gpa3 - gpb3)/cp3, g34/cp3, g35/cp3, g36/cp3, g37/cp3, 0, 0, (ghp3*gih3)/(cp3*(gah3 + ghp3 + gih3)), 0, 0, 0],
+            [((gah4*ghp4)/(gah4 + ghp4 + gih4) + gpa4)/cp4, (gpb4 + (gps4*gsb4)/(gps4 + gsb4))/cp4, g14/cp4, 0, g34/cp4, (-g14 - g34 - g45 - g46 - g47 - ghp4 + ghp4**2/(gah4 + ghp4 + gih4) - gpa4 - gpb4 - gps4 + gps4**2/(gps4 + gsb4))/cp4, g45/cp4, g46/cp4, g47/cp4, 0, 0, 0, (ghp4*gih4)/(cp4*(gah4 + ghp4 + gih4)),0,0], 
+            [((gah5*ghp5)/(gah5 + ghp5 + gih5) + gpa5)/cp5, gpb5/cp5, g15/cp5, g25/cp5, g35/cp5, g45/cp5, (-g15 - g25 - g35 - g45 - g57 - ghp5 + ghp5**2/(gah5 + ghp5 + gih5) - gpa5 - gpb5)/cp5, 0, g57/cp5, 0, 0, 0, 0, (ghp5*gih5)/(cp5*(gah5 + ghp5 + gih5)), 0],
+            [((gah6*ghp6)/(gah6 + ghp6 + gih6) + gpa6)/cp6, gpb6/cp6, g16/cp6, g26/cp6, g36/cp6, g46/cp6, 0, (-g16 - g26 - g36 - g46 - g67 - ghp6 + ghp6**2/(gah6 + ghp6 + gih6) - gpa6 - gpb6)/cp6, g67/cp6, 0, 0, 0, 0, 0, (ghp6*gih6)/(cp6*(gah6 + ghp6 + gih6))],
+            [0, (gpb7 + (gps7*gsb7)/(gps7 + gsb7))/cp7, g17/cp7, 0, g37/cp7, g47/cp7, g57/cp7, g67/cp7, (-g17 - g37 - g47 - g57 - g67 - gpb7 - gps7 + gps7**2/(gps7 + gsb7))/cp7, 0, 0, 0, 0, 0, 0],
+            [(gah1*gih1)/(ch1*(gah1 + ghp1 + gih1)), 0, (ghp1*gih1)/(ch1*(gah1 + ghp1 + gih1)), 0, 0, 0, 0, 0, 0, (-gih1 + gih1**2/(gah1 + ghp1 + gih1))/ch1, 0, 0, 0, 0, 0],
+            [(gah2*gih2)/(ch2*(gah2 + ghp2 + gih2)),0, 0, (ghp2*gih2)/(ch2*(gah2 + ghp2 + gih2)), 0, 0, 0, 0, 0, 0, (-gih2 + gih2**2/(gah2 + ghp2 + gih2))/ch2, 0, 0, 0, 0],
+            [(gah3*gih3)/(ch3*(gah3 + ghp3 + gih3)), 0, 0, 0, (ghp3*gih3)/(ch3*(gah3 + ghp3 + gih3)), 0, 0, 0, 0, 0, 0, (-gih3 + gih3**2/(gah3 + ghp3 + gih3))/ch3, 0, 0, 0],
+            [(gah4*gih4)/(ch4*(gah4 + ghp4 + gih4)), 0, 0, 0, 0, (ghp4*gih4)/(ch4*(gah4 + ghp4 + gih4)), 0, 0, 0, 0, 0, 0, (-gih4 + gih4**2/(gah4 + ghp4 + gih4))/ch4, 0, 0],
+            [(gah5*gih5)/(ch5*(gah5 + ghp5 + gih5)), 0, 0, 0, 0, 0, (ghp5*gih5)/(ch5*(gah5 + ghp5 + gih5)), 0, 0, 0, 0, 0, 0, (-gih5 + gih5**2/(gah5 + ghp5 + gih5))/ch5, 0],
+            [(gah6*gih6)/(ch6*(gah6 + ghp6 + gih6)), 0, 0, 0, 0, 0, 0, (ghp6*gih6)/(ch6*(gah6 + ghp6 + gih6)), 0, 0, 0, 0, 0, 0, (-gih6 + gih6**2/(gah6 + ghp6 + gih6))/ch6] ])
+
+    B_sim = np.array([ [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0], 
+                   [0,0,0,0,0,0],
+                   [1/ch1,0,0,0,0,0],
+                   [0, 1/ch2,0,0,0,0],
+                   [0,0, 1/ch3,0,0,0],
+                   [0,0,0, 1/ch4,0,0],
+                   [0,0,0,0, 1/ch5,0],
+                   [0,0,0,0,0, 1/ch6] ])
+
+    C_sim = np.array([ [0, gsb2/(gps2 + gsb2), 0, gps2/(gps2 + gsb2), 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                   [0, gsb4/(gps4 + gsb4), 0, 0, 0, gps4/(gps4 + gsb4), 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                   [0, gsb7/(gps7 + gsb7), 0, 0, 0, 0, 0, 0, gps7/(gps7 + gsb7), 0, 0, 0, 0, 0, 0] ])
+
+    return A_sim, B_sim, C_sim
+
+def plant_model(constants):
+    """Build the continuous-time state space model of the enclosure plus a
+    simple cryostat, coupled only to the optical table.
+    
+    Parameters
+    ----------
+    constants: numpy array
+        The model parameters, as for enclosure_model.
+    
+    Returns
+    -------
+    A, B, C: numpy array
+        The (16,16) state matrix, with the cryostat as the last state, the 
+        (16,7) input matrix for the 6 heater group powers and the cryostat 
+        heater power, and the (4,16) output matrix for PLANT_OUTPUT_LABELS.
+        These are read-only.
+    """
+    return _plant_model(tuple([float(c) for c in constants[:15]]))
+
+@memoise
+def _plant_model(constants):
+    A_sim, B_sim, C_sim = _enclosure_model(constants)
+    n, m = B_sim.shape
+    A = np.zeros( (n+1, n+1) )
+    A[:n,:n] = A_sim
+    A[n,n] = -CRYO_CONDUCTANCE/CRYO_CAPACITANCE
+    A[n,TABLE_STATE] = CRYO_CONDUCTANCE/CRYO_CAPACITANCE
+    A[TABLE_STATE,TABLE_STATE] -= CRYO_CONDUCTANCE/constants[11]
+    A[TABLE_STATE,n] += CRYO_CONDUCTANCE/constants[11]
+    B = np.zeros( (n+1, m+1) )
+    B[:n,:m] = B_sim
+    B[n,m] = 1/CRYO_CAPACITANCE
+    C = np.zeros( (4, n+1) )
+    #C_sim has the upper, lower and table sensors.
+    C[:3,:n] = C_sim[::-1]
+    C[3,n] = 1
+    return A, B, C
+
+def lqg_enclosure_model(elements=None):
+    """Build the hand-reduced continuous-time model used by lqg_math.
+    
+    Parameters
+    ----------
+    elements: dict (optional)
+        Values to use instead of those in LQG_MODEL_ELEMENTS.
+    
+    Returns
+    -------
+    A_cont, B_cont, C_mat: numpy array
+        The (7,7) state matrix, the (7,3) input matrix for the lid, base and 
+        cryostat heater powers, and the (4,7) output matrix for the upper, 
+        table (unused, so zero), lower and cryostat sensors, in the order of
+        thermal_control.LQG_SENSORS. These are read-only.
+    """
+    values = dict(LQG_MODEL_ELEMENTS)
+    if elements is not None:
+        values.update(elements)
+    return _lqg_enclosure_model(tuple([float(values[name]) for name in LQG_MODEL_ELEMENTS]))
+
+@memoise
+def _lqg_enclosure_model(values):
+    gah1, gah3, ghp1, ghp3, gpa1, gpa3, g13, g12, g23, g24, gpf3, gpc4, cp1, cp2, cp3, cp4 = values
+    A_cont = np.array([[-0.00000000001,0,0,0,0,0,0],
+                     [0,-0.00000000001,0,0,0,0,0],
+                     [0,0,-0.00000000001,0,0,0,0],
+                     [(gah1*ghp1 + gah1*gpa1 + ghp1*gpa1)/(cp1*(gah1 + ghp1)),0,0,((-(g12*gah1) - g13*gah1 - g12*ghp1 - g13*ghp1 - gah1*ghp1 - gah1*gpa1 - ghp1*gpa1))/(cp1*(gah1 + ghp1)),(g12*gah1 + g12*ghp1)/(cp1*(gah1 + ghp1)),(g13*gah1 + g13*ghp1)/(cp1*(gah1 + ghp1)),0],
+                     [0,0,0,g12/cp2,(-g12 - g23 - g24)/cp2,g23/cp2,g24/cp2],
+                     [(gah3*ghp3 + gah3*gpa3 + ghp3*gpa3)/(cp3*(gah3 + ghp3)),0,(gah3*gpf3 + ghp3*gpf3)/(cp3*(gah3 + ghp3)),(g13*gah3 + g13*ghp3)/(cp3*(gah3 + ghp3)),(g23*gah3 + g23*ghp3)/(cp3*(gah3 + ghp3)),(-(g13*gah3) - g23*gah3 - g13*ghp3 - g23*ghp3 - gah3*ghp3 - gah3*gpa3 - ghp3*gpa3 - gah3*gpf3 - ghp3*gpf3)/(cp3*(gah3 + ghp3)),0],
+                     [0,gpc4/cp4,0,0,g24/cp4,0,(-g24-gpc4)/cp4]])
+
+    B_cont = np.array([[0,0,0],
+                      [0,0,0],
+                      [0,0,0],
+                      [ghp1/(cp1*(gah1 + ghp1)),0,0],
+                      [0,0,0],
+                      [0,ghp3/(cp3*(gah3 + ghp3)),0],
+                      [0,0,1/cp4]])
+    #This edited from original since we cant measure t_amb at the moment
+    C_mat = np.array([
+                      [0,0,0,1,0,0,0],
+                      [0,0,0,0,0,0,0],
+                      [0,0,0,0,0,1,0],
+                      [0,0,0,0,0,0,1]])
+    return A_cont, B_cont, C_mat
@@ -0,0 +1,237 @@
+"""Thermistor conversions, shared by the servo loop and the offline analysis tools.
+
+The exact conversion is the bridge equation followed by the Steinhart-Hart
+equation, which needs two logs and a cube per sample. For large numbers of
+samples (e.g. reprocessing months of logs, or streamed acquisition),
+ThermistorTable instead interpolates a precomputed table with cubic Hermite
+splines on a uniform grid. The grid spacing is chosen when the table is built
+so that the interpolation error is below a given tolerance.
+"""
+from __future__ import print_function, division
+import numpy as np
+
+#The thermistor bridge resistors (Ohms) and supply voltage.
+BRIDGE_R = 10000
+BRIDGE_VIN = 5
+#Steinhart-Hart coefficients for the thermistors, from the datasheet.
+THERM_A = 0.00113259149597421
+THERM_B = 0.000233514798680064
+THERM_C = 0.00000009045521729374
+#Temperature range (Celcius) covered by the tables by default. Values outside
+#this range fall back to the exact equations.
+TABLE_TMIN = -30.0
+TABLE_TMAX = 80.0
+#Default maximum interpolation error in K.
+TABLE_TOL = 1e-6
+#Knots per table are doubled until TABLE_TOL is met, up to this limit.
+TABLE_MAX_KNOTS = 2**20
+#Number of values interpolated at a time.
+TABLE_BLOCK = 2**14
+
+def bridge_resistances(voltages, invert_voltage=True):
+    """Convert bridge voltages to thermistor resistances. See Roberton's thesis:
+
+    v_out = v_in * [ R_t/(R_T + R) - R/(R_T + R) ]
+    R_T - R = (R_T + R) * (v_out/v_in)
+    R_T*(1 - (v_out/v_in)) = R * (1 + (v_out/v_in))
+    R_T = R * (v_in + v_out) / (v_in - v_out)
+
+    Parameters
+    ----------
+    voltages: float or numpy array
+        Bridge output voltages.
+    invert_voltage: bool (optional)
+        Whether the bridge is wired so that v_out is minus the voltage read.
+
+    Returns
+    -------
+    resistances: numpy array
+        Resistance in Ohms
+    """
+    voltages = np.asarray(voltages, dtype=float)
+    if invert_voltage:
+        voltages = -voltages
+    return BRIDGE_R * (BRIDGE_VIN + voltages)/(BRIDGE_VIN - voltages)
+
+def bridge_voltages(resistances, invert_voltage=True):
+    """Convert thermistor resistances to bridge voltages. This is the inverse
+    of bridge_resistances."""
+    resistances = np.asarray(resistances, dtype=float)
+    voltages = BRIDGE_VIN * (resistances - BRIDGE_R)/(resistances + BRIDGE_R)
+    if invert_voltage:
+        return -voltages
+    return voltages
+
+def steinhart_hart(resistances, A=THERM_A, B=THERM_B, C=THERM_C):
+    """Convert thermistor resistances to temperatures in Celcius with the
+    Steinhart-Hart equation."""
+    #Voltages outside the bridge range give NaN rather than a warning.
+    with np.errstate(invalid='ignore'):
+        log_r = np.log(resistances)
+    return 1/(A + B*log_r + C*log_r**3) - 273.15
+
+def steinhart_hart_resistances(temps, A=THERM_A, B=THERM_B, C=THERM_C):
+    """Convert temperatures in Celcius to thermistor resistances. This is the
+    inverse of steinhart_hart, which is a cubic in log(R) with a single real
+    root for positive B and C."""
+    p = B/C
+    q = (A - 1/(np.asarray(temps, dtype=float) + 273.15))/C
+    root = np.sqrt(q**2/4 + p**3/27)
+    return np.exp(np.cbrt(-q/2 + root) + np.cbrt(-q/2 - root))
+
+class ThermistorTable:
+    def __init__(self, offsets=0., A=THERM_A, B=THERM_B, C=THERM_C,
+        domain='voltage', invert_voltage=True, tmin=TABLE_TMIN, tmax=TABLE_TMAX,
+        tol=TABLE_TOL):
+        """A per-channel lookup table for converting to temperature.
+
+        Parameters
+        ----------
+        offsets: float or array (optional)
+            Calibration offset subtracted from each channel's temperature, e.g.
+            thermal_control.T_OFFSETS.
+        A, B, C: float or array (optional)
+            Steinhart-Hart coefficients for each channel.
+        domain: string (optional)
+            'voltage' to convert bridge voltages, or 'resistance' to convert
+            resistances (tabulated in log(R)).
+        invert_voltage: bool (optional)
+            See bridge_resistances.
+        tmin, tmax: float (optional)
+            Temperature range in Celcius covered by the table.
+        tol: float (optional)
+            Maximum interpolation error in K.
+        """
+        self.A, self.B, self.C, self.offsets = [np.atleast_1d(np.asarray(p, dtype=float))
+            for p in np.broadcast_arrays(A, B, C, offsets)]
+        self.nchan = len(self.A)
+        self.domain = domain
+        self.invert_voltage = invert_voltage
+        self.tol = tol
+
+        #Find the range of the abscissa covering tmin to tmax for all channels.
+        r_bounds = steinhart_hart_resistances(np.array([[tmin], [tmax]]),
+            self.A, self.B, self.C)
+        x_bounds = self.abscissa(r_bounds, from_resistance=True)
+        self.x0 = np.min(x_bounds)
+        self.x1 = np.max(x_bounds)
+
+        #Double the number of intervals until the error at points in between
+        #the knots is within tolerance.
+        nint = 64
+        while True:
+            self.build(nint)
+            xtest = self.x0 + (np.arange(3*nint) + 0.5)*self.h/3
+            ftest, dummy = self.exact(np.tile(xtest, (self.nchan,1)).T)
+            if np.max(np.abs(self.interpolate(np.tile(xtest, (self.nchan,1)).T) - ftest)) <= tol:
+                break
+            if nint >= TABLE_MAX_KNOTS:
+                raise UserWarning("Could not meet thermistor table tolerance.")
+            nint *= 2
+
+    def abscissa(self, values, from_resistance=False):
+        """Convert voltages or resistances to the tabulated variable."""
+        if self.domain == 'resistance':
+            return np.log(values)
+        if from_resistance:
+            return bridge_voltages(values, self.invert_voltage)
+        return np.asarray(values, dtype=float)
+
+    def exact(self, x, channel=None):
+        """Exact temperature and its derivative with respect to the tabulated
+        variable x, for x with shape (..., nchan), or any shape if channel is
+        given (as an int or an array the same shape as x)."""
+        if channel is None:
+            A, B, C, offsets = self.A, self.B, self.C, self.offsets
+        else:
+            A, B, C, offsets = self.A[channel], self.B[channel], self.C[channel], self.offsets[channel]
+        if self.domain == 'resistance':
+            log_r = x
+            dlogr_dx = np.ones_like(x)
+        else:
+            v = -x if self.invert_voltage else x
+            with np.errstate(invalid='ignore', divide='ignore'):
+                log_r = np.log(BRIDGE_R * (BRIDGE_VIN + v)/(BRIDGE_VIN - v))
+            dlogr_dx = 1/(BRIDGE_VIN + v) + 1/(BRIDGE_VIN - v)
+            if self.invert_voltage:
+                dlogr_dx = -dlogr_dx
+        temp_inv = A + B*log_r + C*log_r**3
+        temps = 1/temp_inv - 273.15 - offsets
+        dtemps = -(B + 3*C*log_r**2)/temp_inv**2 * dlogr_dx
+        return temps, dtemps
+
+    def build(self, nint):
+        """Build cubic Hermite coefficients for nint uniform intervals. The
+        coefficients are stored as self.coeffs[power, channel*nint + interval]."""
+        self.nint = nint
+        self.h = (self.x1 - self.x0)/nint
+        x = self.x0 + np.arange(nint + 1)*self.h
+        f, df = self.exact(np.tile(x, (self.nchan,1)).T)
+        f, df = f.T, df.T*self.h
+        coeffs = np.empty( (4, self.nchan, nint) )
+        coeffs[0] = f[:,:-1]
+        coeffs[1] = df[:,:-1]
+        coeffs[2] = 3*(f[:,1:] - f[:,:-1]) - 2*df[:,:-1] - df[:,1:]
+        coeffs[3] = 2*(f[:,:-1] - f[:,1:]) + df[:,:-1] + df[:,1:]
+        self.coeffs = coeffs.reshape( (4, self.nchan*nint) )
+        #Offsets into the coefficients for each channel, for interpolating
+        #blocks of (..., nchan) values.
+        self.block = max(TABLE_BLOCK - TABLE_BLOCK % self.nchan, self.nchan)
+        self.chan_offsets = np.tile(np.arange(self.nchan)*nint, self.block//self.nchan)
+
+    def interpolate(self, x, channel=None):
+        """Interpolate the table at x, without checking the range. 
+        
+        This works through x in blocks of TABLE_BLOCK values with in-place 
+        arithmetic, so that the temporary arrays stay in the cache. This is 
+        several times faster than working on the whole array at once."""
+        x = np.asarray(x, dtype=float)
+        flat_x = x.ravel()
+        temps = np.empty_like(flat_x)
+        if channel is None:
+            block = self.block
+        else:
+            block = TABLE_BLOCK
+        for start in range(0, len(flat_x), block):
+            stop = min(start + block, len(flat_x))
+            t = flat_x[start:stop] - self.x0
+            t *= 1/self.h
+            ix = t.astype(np.intp)
+            np.clip(ix, 0, self.nint - 1, out=ix)
+            t -= ix
+            if channel is None:
+                ix += self.chan_offsets[:stop - start]
+            else:
+                ix += channel*self.nint
+            out = temps[start:stop]
+            np.take(self.coeffs[3], ix, out=out, mode='clip')
+            for power in (2, 1, 0):
+                out *= t
+                out += np.take(self.coeffs[power], ix, mode='clip')
+        return temps.reshape(x.shape)
+
+    def temps(self, values, channel=None):
+        """Convert voltages or resistances to temperatures in Celcius.
+
+        Parameters
+        ----------
+        values: numpy array
+            Voltages or resistances (depending on the table domain), with shape
+            (..., nchan), or any shape if channel is given.
+        channel: int (optional)
+            Convert every value using the table for this channel.
+
+        Returns
+        -------
+        temps: numpy array
+            Temperatures, with the same shape as values.
+        """
+        x = self.abscissa(values)
+        temps = self.interpolate(x, channel)
+        #Use the exact equations outside of the table.
+        outside = ~((x >= self.x0) & (x <= self.x1))
+        if np.any(outside):
+            if channel is None:
+                channel = np.nonzero(outside)[-1]
+            temps[outside] = self.exact(x[outside], channel)[0]
+        return temps
@@ -0,0 +1,285 @@
+"""Closed-loop tuning sweeps of the servo parameters.
+
+Rather than running a single-trajectory simulation by hand for each setting,
+a sweep simulates many candidate controllers at once against the lqg_math
+plant model: the states of all candidates in a batch are stacked into one
+array, so that each timestep is a handful of numpy operations however many
+candidates there are, and batches are spread over a process pool. All
+candidates see the same ambient and measurement noise, so that differences
+between them are due to the controller alone. For example:
+
+    from veloce import tuning
+    candidates = tuning.grid("lqg", q_table=[100,1000,10000], r=[0.01,0.1,1]) + \\
+        tuning.random_sample("pid", 1000, pid_gain_hz=(0.0005,0.01), nested_gain=(1,30))
+    results = tuning.sweep(candidates)
+    tuning.print_best(results)
+"""
+from __future__ import print_function, division
+import itertools
+import multiprocessing
+import numpy as np
+
+from . import lqg_math
+from . import thermal_control
+
+SERVOS = ["lqg", "pid"]
+#The parameters of each servo, and their defaults (as used by thermal_control).
+#q_table is the LQG weight on the table temperature, q_enclosure the weight on
+#the lid, base and cryostat temperatures, and r the weight on each heater power.
+SERVO_DEFAULTS = {
+    "lqg": dict(q_table=lqg_math.Q_mat[4,4], q_enclosure=lqg_math.Q_mat[3,3],
+        r=lqg_math.R_mat[0,0]),
+    "pid": dict(pid_gain_hz=thermal_control.PID_GAIN_HZ,
+        nested_gain=thermal_control.NESTED_GAIN)}
+#Indices of the lqg_math model states: the external temperatures (ambient,
+#cryostat inside and floor), then the lid, table, base and cryostat.
+EXTERNAL_STATES = [0,1,2]
+LID_STATE, TABLE_STATE, BASE_STATE, CRYO_STATE = 3, 4, 5, 6
+#Random walk of the external temperatures in the simulated plant, in K per
+#square root second.
+EXTERNAL_RANDOM_RATE = 0.001
+#Default simulated time per candidate, fraction of it ignored while the servo
+#settles, and number of candidates per batch.
+SWEEP_DURATION = 6*3600.
+SETTLE_FRACTION = 0.25
+BATCH_SIZE = 250
+
+def grid(servo, **values):
+    """Return a candidate for every combination of parameter values.
+
+    Parameters
+    ----------
+    servo: string
+        One of SERVOS.
+    values:
+        A list of values for each parameter to vary, e.g. r=[0.01,0.1,1].
+        Other parameters take their defaults.
+
+    Returns
+    -------
+    candidates: list of dicts
+    """
+    names = sorted(values.keys())
+    return [make_candidate(servo, **dict(zip(names, combination)))
+        for combination in itertools.product(*[values[name] for name in names])]
+
+def random_sample(servo, n, seed=None, **ranges):
+    """Return n candidates with parameters drawn log-uniformly from ranges.
+
+    Parameters
+    ----------
+    servo: string
+        One of SERVOS.
+    n: int
+        The number of candidates.
+    seed: int (optional)
+        Random number seed.
+    ranges:
+        The (minimum, maximum) of each parameter to vary.
+    """
+    rng = np.random.RandomState(seed)
+    names = sorted(ranges.keys())
+    samples = np.exp(rng.uniform(np.log([ranges[name][0] for name in names]),
+        np.log([ranges[name][1] for name in names]), size=(n, len(names))))
+    return [make_candidate(servo, **dict(zip(names, sample))) for sample in samples]
+
+def make_candidate(servo, **params):
+    """Return a candidate dict for servo, with defaults for any parameters not
+    given."""
+    if servo not in SERVOS:
+        raise UserWarning("Unknown servo: {}".format(servo))
+    candidate = dict(SERVO_DEFAULTS[servo])
+    for name in params:
+        if name not in candidate:
+            raise UserWarning("Unknown {} parameter: {}".format(servo, name))
+        candidate[name] = float(params[name])
+    candidate['servo'] = servo
+    return candidate
+
+def lqg_step(candidate, dt=lqg_math.lqg_dt):
+    """Solve for the LQG gains of a candidate, returning an lqg_math.LQGStep.
+    The gains are not cached, as each is only used once."""
+    design = lqg_math.default_design()
+    Q = lqg_math.Q_mat.copy()
+    Q[TABLE_STATE,TABLE_STATE] = candidate['q_table']
+    for ix in [LID_STATE, BASE_STATE, CRYO_STATE]:
+        Q[ix,ix] = candidate['q_enclosure']
+    design['Q_mat'] = Q
+    design['R_mat'] = candidate['r']*np.eye(len(lqg_math.R_mat))
+    design['lqg_dt'] = dt
+    design['V_mat'], design['W_mat'] = lqg_math.noise_covariances(dt)
+    design.update(lqg_math.solve_gains(design))
+    return lqg_math.LQGStep(design, thermal_control.HEATER_MAX)
+
+def simulate_batch(servo, candidates, duration=SWEEP_DURATION, dt=lqg_math.lqg_dt,
+    ambient=-3.0, random_rate=EXTERNAL_RANDOM_RATE, seed=0):
+    """Simulate a batch of candidates for the same servo, all at once.
+
+    Parameters
+    ----------
+    servo: string
+        One of SERVOS.
+    candidates: list of dicts
+        Candidates, e.g. from grid or random_sample.
+    duration: float (optional)
+        Simulated time in seconds.
+    dt: float (optional)
+        Servo timestep in seconds.
+    ambient: float (optional)
+        Initial external temperatures relative to the setpoint. Everything
+        else starts at the setpoint.
+    random_rate: float (optional)
+        Random walk of the external temperatures in K per square root second.
+    seed: int (optional)
+        Random number seed for the noise.
+
+    Returns
+    -------
+    table_rms: numpy array
+        The RMS table temperature error for each candidate, after settling.
+    duty: numpy array
+        The mean fraction of full power of each heater (lid and sides, base
+        and cryostat) for each candidate, after settling.
+    """
+    rng = np.random.RandomState(seed)
+    A, B = lqg_math.discretise(lqg_math.A_cont, lqg_math.B_cont, dt)
+    C = lqg_math.C_mat
+    n, m = B.shape
+    p = len(C)
+    umax = np.array(thermal_control.HEATER_MAX)
+    nsteps = int(duration/dt)
+    nsettle = int(SETTLE_FRACTION*nsteps)
+    ncand = len(candidates)
+    #Noise shared by all candidates.
+    process_noise = random_rate*np.sqrt(dt)*rng.normal(size=(nsteps, len(EXTERNAL_STATES)))
+    measurement_noise = lqg_math.T_NOISE_RATE*dt*rng.normal(size=(nsteps, p))
+
+    x = np.zeros( (ncand, n) )
+    x[:,EXTERNAL_STATES] = ambient
+    u = np.zeros( (ncand, m) )
+    sum_sq = np.zeros(ncand)
+    duty = np.zeros( (ncand, m) )
+    if servo == "lqg":
+        steps = [lqg_step(candidate, dt) for candidate in candidates]
+        #The estimator doesn't depend on Q or R, so it is the same for all
+        #candidates. The stacked [x_est, u, y] for all candidates are
+        #updated with one matrix product.
+        update_mat_T = steps[0].update_mat.T
+        minus_L = np.array([step.minus_L for step in steps])
+        z = np.zeros( (ncand, n+m+p) )
+        x_est = z[:,:n]
+        u = z[:,n:n+m]
+        y = z[:,n+m:]
+    elif servo == "pid":
+        #As for ThermalControl.pid_servo and cryo_servo, with the lid and
+        #sides lumped together as in the lqg_math model.
+        hz = np.array([candidate['pid_gain_hz'] for candidate in candidates])
+        pid_gain = hz/thermal_control.TEMP_DERIV
+        pid_i = 0.5*hz**2/thermal_control.TEMP_DERIV
+        nested_gain = np.array([candidate['nested_gain'] for candidate in candidates])
+        nested_i = 1.0/thermal_control.NESTED_TIME_CONST
+        cryo_gain = thermal_control.CRYO_PID_GAIN_HZ/thermal_control.CRYO_TEMP_DERIV
+        cryo_i = 0.5*thermal_control.CRYO_PID_GAIN_HZ**2/thermal_control.CRYO_TEMP_DERIV
+        deadzone = thermal_control.TABLE_DEADZONE
+        nested_int = np.zeros(ncand)
+        pid_ints = np.zeros( (ncand, 2) )
+        cryo_int = np.zeros(ncand)
+        #The table, base, lid and cryostat sensors.
+        sensors = [TABLE_STATE, BASE_STATE, LID_STATE, CRYO_STATE]
+    else:
+        raise UserWarning("Unknown servo: {}".format(servo))
+
+    for i in range(nsteps):
+        if servo == "lqg":
+            y[:] = np.dot(x, C.T) + measurement_noise[i]
+            x_est[:] = np.dot(z, update_mat_T)
+            np.einsum('kmn,kn->km', minus_L, x_est, out=u)
+            np.clip(u, 0, umax, out=u)
+        else:
+            temps = x[:,sensors] + measurement_noise[i]
+            t_tab = temps[:,0]
+            nested_int[np.abs(t_tab) > deadzone] = 0
+            t_tab = np.clip(t_tab, -deadzone, deadzone)
+            nested_int -= dt*t_tab
+            enc_setpoint = -nested_gain*t_tab + nested_i*nested_int
+            errors = enc_setpoint[:,None] - temps[:,1:3]
+            pid_ints += dt*errors
+            h = 0.5 + pid_gain[:,None]*errors + pid_i[:,None]*pid_ints
+            #Reset the integrals whenever a heater hits the rail.
+            rail = (h < 0) | (h > 1)
+            pid_ints[rail] = 0
+            nested_int[np.any(rail, axis=1)] = 0
+            cryo_int -= dt*temps[:,3]
+            h2 = 0.5 - cryo_gain*temps[:,3] + cryo_i*cryo_int
+            cryo_int[(h2 < 0) | (h2 > 1)] = 0
+            #The lid and sides are driven by the upper (lid) loop, and the
+            #base by the lower loop.
+            u[:,0] = np.clip(h[:,1], 0, 1)*umax[0]
+            u[:,1] = np.clip(h[:,0], 0, 1)*umax[1]
+            u[:,2] = np.clip(h2, 0, 1)*umax[2]
+        x = np.dot(x, A.T) + np.dot(u, B.T)
+        x[:,EXTERNAL_STATES] += process_noise[i]
+        if i >= nsettle:
+            sum_sq += x[:,TABLE_STATE]**2
+            duty += u
+    nused = max(nsteps - nsettle, 1)
+    return np.sqrt(sum_sq/nused), duty/nused/umax
+
+def _simulate_batch(args):
+    """Process pool target for sweep."""
+    servo, candidates, kwargs = args
+    return simulate_batch(servo, candidates, **kwargs)
+
+def sweep(candidates, processes=None, batch_size=BATCH_SIZE, **kwargs):
+    """Simulate every candidate, in batches spread over a process pool.
+
+    Parameters
+    ----------
+    candidates: list of dicts
+        Candidates, e.g. from grid or random_sample.
+    processes: int (optional)
+        Number of processes. Defaults to the number of CPUs. With 1, the
+        batches are run in this process.
+    batch_size: int (optional)
+        Maximum number of candidates per batch.
+    kwargs:
+        Passed on to simulate_batch, e.g. duration or seed.
+
+    Returns
+    -------
+    results: dict
+        'candidates', and the 'table_rms' and heater 'duty' from simulate_batch
+        for each of them.
+    """
+    batches = []
+    indices = []
+    for servo in SERVOS:
+        ixs = [ix for ix, candidate in enumerate(candidates) if candidate['servo'] == servo]
+        for start in range(0, len(ixs), batch_size):
+            indices.append(ixs[start:start+batch_size])
+            batches.append( (servo, [candidates[ix] for ix in indices[-1]], kwargs) )
+    if processes == 1:
+        outputs = [_simulate_batch(batch) for batch in batches]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            outputs = pool.map(_simulate_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+    table_rms = np.zeros(len(candidates))
+    duty = np.zeros( (len(candidates), len(thermal_control.HEATER_MAX)) )
+    for ixs, (batch_rms, batch_duty) in zip(indices, outputs):
+        table_rms[ixs] = batch_rms
+        duty[ixs] = batch_duty
+    return dict(candidates=candidates, table_rms=table_rms, duty=duty)
+
+def print_best(results, n=10):
+    """Print the n candidates with the lowest table RMS."""
+    print("{:>5s} {:>12s} {:>20s}  {}".format("Servo", "Table RMS", "Heater duty", "Parameters"))
+    for ix in np.argsort(results['table_rms'])[:n]:
+        candidate = results['candidates'][ix]
+        params = ", ".join(["{}={:.4g}".format(name, candidate[name])
+            for name in sorted(candidate.keys()) if name != 'servo'])
+        print("{:>5s} {:12.6f} {:>20s}  {}".format(candidate['servo'], results['table_rms'][ix],
+            " ".join(["{:6.3f}".format(d) for d in results['duty'][ix]]), params))